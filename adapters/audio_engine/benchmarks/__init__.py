@@ -0,0 +1,41 @@
+import os
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+
+def make_test_file(seconds=10.0, sample_rate=44100, channels=2, directory=None):
+    """
+    Write a tone with some noise to a temporary wav file for benchmarks
+    :param seconds:
+    :param sample_rate:
+    :param channels:
+    :param directory:
+    :return: file path
+    """
+    frames = int(seconds * sample_rate)
+    t = np.arange(frames) / sample_rate
+    tone = 0.3 * np.sin(2 * np.pi * 440 * t) + 0.05 * np.random.default_rng(0).standard_normal(frames)
+    data = np.repeat(tone[:, None], channels, axis=1).astype(np.float32)
+    fd, path = tempfile.mkstemp(suffix='.wav', dir=directory)
+    os.close(fd)
+    sf.write(path, data, sample_rate)
+    return path
+
+
+def make_impulse_response(seconds=3.0, sample_rate=44100, directory=None):
+    """
+    Write exponentially decaying stereo noise, a stand-in for a room impulse response
+    :param seconds:
+    :param sample_rate:
+    :param directory:
+    :return: file path
+    """
+    frames = int(seconds * sample_rate)
+    envelope = np.exp(-6.9 * np.arange(frames) / frames)  # -60 dB at the end
+    noise = np.random.default_rng(1).standard_normal((frames, 2))
+    fd, path = tempfile.mkstemp(suffix='.wav', dir=directory)
+    os.close(fd)
+    sf.write(path, (0.1 * noise * envelope[:, None]).astype(np.float32), sample_rate, subtype='FLOAT')
+    return path
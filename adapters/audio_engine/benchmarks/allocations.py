@@ -0,0 +1,178 @@
+"""
+Check that the channel/mixer render path does not allocate in steady state.
+
+    python -m adapters.audio_engine.benchmarks.allocations
+"""
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+from adapters.audio_engine.benchmarks import make_test_file
+from adapters.audio_engine.core.channel import CoreAudioChannel
+from adapters.audio_engine.core.mixer import CoreMixer
+from adapters.audio_engine.effects.chain import EffectChain, EffectNode
+from adapters.audio_engine.effects.effect import CoreAudioEffect
+from adapters.audio_engine.utils.buffer_pool import BufferPool
+
+
+def run(channels=4, blocks=16, buffer_size=4096, sample_rate=44100):
+    """
+    :param channels: channels mixed per block
+    :param blocks: blocks measured after warm up
+    :param buffer_size:
+    :param sample_rate:
+    :return: dict with pool allocations and traced bytes per block
+    """
+    path = make_test_file(seconds=12, sample_rate=sample_rate)
+    pool = BufferPool(buffer_size)
+    mixer = CoreMixer(sample_rate, buffer_size, buffer_pool=pool)
+    try:
+        for _ in range(channels):
+            channel = CoreAudioChannel(sample_rate, buffer_size, lookahead=10.0, buffer_pool=pool)
+            channel.load_file(path)
+            channel.volume = 1.0
+            channel.playing = True
+            mixer.add_channel(channel)
+
+        # let the decoders fill their lookahead so they stay idle while measuring
+        for channel in mixer.channels:
+            ring = channel.decoder.ring_buffer
+            while ring.free_space() > buffer_size * 2:
+                time.sleep(0.01)
+
+        out = pool.acquire()
+        mixer.get_next_buffer(out=out)
+        allocations = pool.allocations
+
+        tracemalloc.start()
+        peaks = []
+        for _ in range(blocks):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            mixer.get_next_buffer(out=out)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        tracemalloc.stop()
+
+        return {
+            'pool_allocations': pool.allocations - allocations,
+            'max_traced_bytes_per_block': max(peaks),
+            'block_bytes': out.nbytes
+        }
+    finally:
+        mixer.clear_channels()
+        os.remove(path)
+
+
+def _wait_for_decoder(decoder, buffer_size):
+    ring = decoder.ring_buffer
+    while decoder.seek_pending or ring.free_space() > buffer_size * 2 and not decoder.eof:
+        time.sleep(0.01)
+
+
+def run_crossfade(crossfade=2.0, blocks=16, buffer_size=4096, sample_rate=44100):
+    """
+    Same check while a channel crossfades into its queued file
+    :param crossfade: seconds
+    :param blocks: blocks measured, all inside the crossfade
+    :param buffer_size:
+    :param sample_rate:
+    :return: dict with pool allocations and traced bytes per block
+    """
+    seconds = 12
+    current = make_test_file(seconds=seconds, sample_rate=sample_rate)
+    queued = make_test_file(seconds=seconds, sample_rate=sample_rate)
+    pool = BufferPool(buffer_size)
+    channel = CoreAudioChannel(sample_rate, buffer_size, lookahead=10.0, buffer_pool=pool)
+    try:
+        channel.set_crossfade(crossfade)
+        channel.load_file(current)
+        channel.queue_file(queued)
+        channel.volume = 1.0
+        channel.playing = True
+        channel.set_position(seconds - crossfade - buffer_size / sample_rate)
+        _wait_for_decoder(channel.decoder, buffer_size)
+        _wait_for_decoder(channel._next_decoder, buffer_size)
+
+        out = pool.acquire()
+        channel.get_next_buffer(out=out)
+        allocations = pool.allocations
+
+        tracemalloc.start()
+        peaks = []
+        for _ in range(blocks):
+            tracemalloc.reset_peak()
+            current_bytes, _ = tracemalloc.get_traced_memory()
+            channel.get_next_buffer(out=out)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current_bytes)
+        tracemalloc.stop()
+
+        return {
+            'pool_allocations': pool.allocations - allocations,
+            'max_traced_bytes_per_block': max(peaks),
+            'block_bytes': out.nbytes
+        }
+    finally:
+        channel.close()
+        os.remove(current)
+        os.remove(queued)
+
+
+class ScaleEffect(CoreAudioEffect):
+    """
+    Writes the input times a gain to its own block, so the chain's own cost is what gets traced
+    """
+
+    def __init__(self, gain: float):
+        self.gain = gain
+        self._output = None
+
+    def process(self, data, sample_rate):
+        if self._output is None or self._output.shape != data.shape:
+            self._output = np.empty(data.shape, dtype=np.float32)
+        return np.multiply(data, self.gain, out=self._output)
+
+
+def run_chain(blocks=16, buffer_size=4096, sample_rate=44100):
+    """
+    Same check for an effect chain: partly wet nodes, one with its mix ramping
+    every block, and a parallel stage
+    :param blocks:
+    :param buffer_size:
+    :param sample_rate:
+    :return:
+    """
+    ramping = EffectNode(ScaleEffect(0.9), wet=0.5)
+    chain = EffectChain([EffectNode(ScaleEffect(0.5), wet=0.3), ramping])
+    chain.add_parallel([ScaleEffect(0.8), ScaleEffect(1.2)])
+    data = np.random.default_rng(0).standard_normal((buffer_size, 2)).astype(np.float32)
+
+    chain.process(data, sample_rate)
+    ramping.wet = 0.7
+    chain.process(data, sample_rate)
+
+    tracemalloc.start()
+    peaks = []
+    output = data
+    for index in range(blocks):
+        ramping.wet = 0.5 if index % 2 else 0.7
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        output = chain.process(data, sample_rate)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+
+    return {
+        'pool_allocations': 0,
+        'max_traced_bytes_per_block': max(peaks),
+        'block_bytes': data.nbytes,
+        'dtype': str(output.dtype)
+    }
+
+
+if __name__ == '__main__':
+    for name, result in (('playback', run()), ('crossfade', run_crossfade()), ('effect chain', run_chain())):
+        print(f"[{name}] Pool allocations: {result['pool_allocations']}")
+        print(f"[{name}] Peak traced bytes per block: {result['max_traced_bytes_per_block']} "
+              f"(a block is {result['block_bytes']} bytes)")
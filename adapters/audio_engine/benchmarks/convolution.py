@@ -0,0 +1,44 @@
+"""
+Real-time factor of the partitioned convolution reverb with a 3 second
+impulse response, for a few buffer sizes.
+
+    python -m adapters.audio_engine.benchmarks.convolution
+"""
+import os
+import time
+
+import numpy as np
+
+from adapters.audio_engine.benchmarks import make_impulse_response
+from adapters.audio_engine.effects.convolution import ConvolutionReverb
+
+
+def run(ir_seconds=3.0, buffer_sizes=(512, 2048, 4096), seconds=10.0, sample_rate=44100):
+    """
+    :param ir_seconds: impulse response length
+    :param buffer_sizes:
+    :param seconds: audio processed per buffer size
+    :param sample_rate:
+    :return: buffer size -> real-time factor
+    """
+    path = make_impulse_response(ir_seconds, sample_rate)
+    rng = np.random.default_rng(0)
+    results = {}
+    try:
+        for buffer_size in buffer_sizes:
+            effect = ConvolutionReverb(path, sample_rate=sample_rate, block_size=buffer_size)
+            data = (rng.standard_normal((buffer_size, 2)) * 0.1).astype(np.float32)
+            blocks = max(int(seconds * sample_rate / buffer_size), 1)
+            start = time.perf_counter()
+            for _ in range(blocks):
+                effect.process(data, sample_rate)
+            elapsed = time.perf_counter() - start
+            results[buffer_size] = elapsed / (blocks * buffer_size / sample_rate)
+    finally:
+        os.remove(path)
+    return results
+
+
+if __name__ == '__main__':
+    for buffer_size, rtf in run().items():
+        print(f"buffer {buffer_size:>5}: RTF {rtf:.4f}")
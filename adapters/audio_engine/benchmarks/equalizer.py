@@ -0,0 +1,41 @@
+"""
+Share of one core used by the 10 band parametric EQ, per buffer size.
+The budget is 2%.
+
+    python -m adapters.audio_engine.benchmarks.equalizer
+"""
+import time
+
+import numpy as np
+
+from adapters.audio_engine.effects.equalizer import ParametricEQ
+
+CORE_BUDGET = 0.02
+
+
+def run(buffer_sizes=(512, 2048, 4096), seconds=10.0, sample_rate=44100):
+    """
+    :param buffer_sizes:
+    :param seconds: audio processed per buffer size
+    :param sample_rate:
+    :return: buffer size -> processing time over audio time
+    """
+    rng = np.random.default_rng(0)
+    results = {}
+    for buffer_size in buffer_sizes:
+        eq = ParametricEQ(sample_rate=sample_rate)
+        eq.set_gains([6, 3, -2, 0, 1, -1, 2, 0, -3, 4])
+        data = (rng.standard_normal((buffer_size, 2)) * 0.1).astype(np.float32)
+        blocks = max(int(seconds * sample_rate / buffer_size), 1)
+        start = time.perf_counter()
+        for _ in range(blocks):
+            eq.process(data, sample_rate)
+        elapsed = time.perf_counter() - start
+        results[buffer_size] = elapsed / (blocks * buffer_size / sample_rate)
+    return results
+
+
+if __name__ == '__main__':
+    for buffer_size, share in run().items():
+        status = 'ok' if share < CORE_BUDGET else 'over budget'
+        print(f"buffer {buffer_size:>5}: {share * 100:.2f}% of a core ({status})")
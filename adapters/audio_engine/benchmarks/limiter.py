@@ -0,0 +1,47 @@
+"""
+Share of one core used by the output limiter, per buffer size, on a mix
+that keeps it limiting. The budget is 1%.
+
+    python -m adapters.audio_engine.benchmarks.limiter
+"""
+import time
+
+import numpy as np
+
+from adapters.audio_engine.effects.limiter import LookaheadLimiter
+
+CORE_BUDGET = 0.01
+
+
+def run(buffer_sizes=(256, 512, 2048, 4096), seconds=10.0, sample_rate=44100):
+    """
+    :param buffer_sizes:
+    :param seconds: audio processed per buffer size
+    :param sample_rate:
+    :return: buffer size -> (processing time over audio time, output peak)
+    """
+    rng = np.random.default_rng(0)
+    results = {}
+    for buffer_size in buffer_sizes:
+        limiter = LookaheadLimiter(sample_rate=sample_rate)
+        blocks = max(int(seconds * sample_rate / buffer_size), 1)
+        # peaks up to 4x over full scale, as summed channels give
+        data = [(rng.standard_normal((buffer_size, 2)) * 0.8).astype(np.float32) for _ in range(8)]
+        peak = 0.0
+        elapsed = 0.0
+        for i in range(blocks):
+            block = data[i % len(data)].copy()
+            start = time.perf_counter()
+            limiter.process(block, sample_rate)
+            elapsed += time.perf_counter() - start
+            peak = max(peak, float(np.abs(block).max()))
+        results[buffer_size] = (elapsed / (blocks * buffer_size / sample_rate), peak)
+    return results
+
+
+if __name__ == '__main__':
+    limiter = LookaheadLimiter()
+    print(f"latency {limiter.latency / limiter.sample_rate * 1000:.2f} ms, ceiling {limiter.ceiling:.4f}")
+    for buffer_size, (share, peak) in run().items():
+        status = 'ok' if share < CORE_BUDGET else 'over budget'
+        print(f"buffer {buffer_size:>5}: {share * 100:.2f}% of a core ({status}), output peak {peak:.4f}")
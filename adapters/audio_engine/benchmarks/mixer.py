@@ -0,0 +1,109 @@
+"""
+Mixer cost per block from 1 to 64 channels. The sources only copy a
+prepared block so the numbers are the mixing itself: the previous per
+channel loop against the send matrix product, then a reverb per channel
+against one reverb on a submix bus.
+
+    python -m adapters.audio_engine.benchmarks.mixer
+"""
+import time
+
+import numpy as np
+
+from adapters.audio_engine.core.mixer import CoreMixer
+from adapters.audio_engine.effects.chain import EffectChain
+from adapters.audio_engine.effects.reverb import UltraLightReverb
+
+
+class BlockSource:
+    """
+    Stands in for a channel, plays the same block forever
+    """
+
+    def __init__(self, block: np.ndarray, effects: EffectChain = None, sample_rate=44100):
+        self.block = block
+        self.effects = effects
+        self.sample_rate = sample_rate
+        self.playing = True
+        self.paused = False
+        self.on_playback_end = None
+
+    def get_next_buffer(self, out: np.ndarray):
+        np.copyto(out, self.block)
+        if self.effects:
+            np.copyto(out, self.effects.process(out, self.sample_rate))
+        return out
+
+    def close(self):
+        pass
+
+
+def loop_mix(sources, out, scratch):
+    """
+    The mixer before the send matrix, one add per channel
+    :param sources:
+    :param out:
+    :param scratch:
+    :return:
+    """
+    out.fill(0)
+    for source in sources:
+        if source.playing:
+            source.get_next_buffer(out=scratch)
+            np.add(out, scratch, out=out)
+    return np.clip(out, -1.0, 1.0, out=out)
+
+
+def _time(render, blocks):
+    render()
+    start = time.perf_counter()
+    for _ in range(blocks):
+        render()
+    return (time.perf_counter() - start) / blocks
+
+
+def run(channel_counts=(1, 2, 4, 8, 16, 32, 64), blocks=200, buffer_size=512, sample_rate=44100):
+    """
+    :param channel_counts:
+    :param blocks: blocks timed per case
+    :param buffer_size:
+    :param sample_rate:
+    :return: channel count -> dict of seconds per block
+    """
+    rng = np.random.default_rng(0)
+    results = {}
+    for count in channel_counts:
+        blocks_in = [(rng.standard_normal((buffer_size, 2)) * 0.01).astype(np.float32) for _ in range(count)]
+        out = np.empty((buffer_size, 2), dtype=np.float32)
+        scratch = np.empty_like(out)
+
+        sources = [BlockSource(block, sample_rate=sample_rate) for block in blocks_in]
+        mixer = CoreMixer(sample_rate, buffer_size)
+        for source in sources:
+            mixer.add_channel(source)
+        result = {
+            'loop': _time(lambda: loop_mix(sources, out, scratch), blocks),
+            'matrix': _time(lambda: mixer.get_next_buffer(out=out), blocks),
+        }
+
+        # a reverb on every channel, as channel effects
+        reverb_sources = [BlockSource(block, EffectChain([UltraLightReverb(sr=sample_rate)]), sample_rate)
+                          for block in blocks_in]
+        result['reverb_per_channel'] = _time(lambda: loop_mix(reverb_sources, out, scratch), blocks)
+
+        # the same channels sent to a bus with one reverb
+        bus = mixer.add_bus('reverb', EffectChain([UltraLightReverb(sr=sample_rate)]))
+        for source in sources:
+            mixer.route(source, bus)
+        result['reverb_bus'] = _time(lambda: mixer.get_next_buffer(out=out), blocks)
+        results[count] = result
+    return results
+
+
+if __name__ == '__main__':
+    block_time = 512 / 44100
+    print(f"{'channels':>8} {'loop':>9} {'matrix':>9} {'reverb/ch':>10} {'reverb bus':>10}  (us per block, "
+          f"a block is {block_time * 1e6:.0f} us)")
+    for count, result in run().items():
+        print(f"{count:>8} {result['loop'] * 1e6:>9.1f} {result['matrix'] * 1e6:>9.1f} "
+              f"{result['reverb_per_channel'] * 1e6:>10.1f} {result['reverb_bus'] * 1e6:>10.1f}")
@@ -0,0 +1,81 @@
+"""
+Time of the first seek into a freshly opened long VBR MP3, libsndfile's own
+seek against the scan time frame index.
+
+    python -m adapters.audio_engine.benchmarks.mp3_seek
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+from adapters.audio_engine.core.indexed_file import IndexedMP3File
+from core.utility.mp3_index import build_frame_index
+
+
+def make_mp3(minutes=60.0, sample_rate=44100, directory=None):
+    """
+    Write a VBR MP3 of a tone under changing noise, so frame sizes vary
+    :param minutes:
+    :param sample_rate:
+    :param directory:
+    :return: file path
+    """
+    fd, path = tempfile.mkstemp(suffix='.mp3', dir=directory)
+    os.close(fd)
+    rng = np.random.default_rng(0)
+    chunk = 10 * sample_rate
+    with sf.SoundFile(path, 'w', sample_rate, 2, format='MP3', subtype='MPEG_LAYER_III',
+                      bitrate_mode='VARIABLE') as out:
+        for start in range(0, int(minutes * 60 * sample_rate), chunk):
+            t = (start + np.arange(chunk)) / sample_rate
+            tone = 0.3 * np.sin(2 * np.pi * 440 * t)
+            noise = rng.uniform(0.0, 0.2) * rng.standard_normal(chunk)
+            out.write(np.repeat((tone + noise)[:, None], 2, axis=1).astype(np.float32))
+    return path
+
+
+def _first_seek(open_file, position, frames=4096):
+    audio_file = open_file()
+    try:
+        start = time.perf_counter()
+        audio_file.seek(position)
+        audio_file.read(frames, dtype='float32', always_2d=True)
+        return time.perf_counter() - start
+    finally:
+        audio_file.close()
+
+
+def run(minutes=60.0, positions=(0.1, 0.5, 0.9, 0.99)):
+    """
+    :param minutes: length of the generated file
+    :param positions: seek targets as fractions of the file
+    :return: dict with index build time and size, and position -> (libsndfile, indexed) seconds
+    """
+    path = make_mp3(minutes)
+    try:
+        start = time.perf_counter()
+        index = build_frame_index(path).to_bytes()
+        build = time.perf_counter() - start
+
+        with sf.SoundFile(path) as audio_file:
+            frames = audio_file.frames
+        seeks = {}
+        for fraction in positions:
+            target = int(frames * fraction)
+            seeks[fraction] = (_first_seek(lambda: sf.SoundFile(path), target),
+                               _first_seek(lambda: IndexedMP3File(path, index), target))
+        return {'build_seconds': build, 'index_bytes': len(index), 'file_bytes': os.path.getsize(path),
+                'seeks': seeks}
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    result = run()
+    print(f"index built in {result['build_seconds'] * 1000:.0f} ms, {result['index_bytes']} bytes "
+          f"for a {result['file_bytes'] / (1 << 20):.1f} MiB file")
+    for fraction, (plain, indexed) in result['seeks'].items():
+        print(f"seek to {fraction * 100:>4.0f}%: libsndfile {plain * 1000:8.2f} ms, indexed {indexed * 1000:6.2f} ms")
@@ -0,0 +1,93 @@
+"""
+Real-time factor of the render path without a sound card: a lone
+channel, the same channel through an EQ and a reverb, then a mixer of 8
+channels. Everything runs on one thread through the OfflineRenderer so the
+numbers repeat from run to run, and it can be profiled directly:
+
+    python -m adapters.audio_engine.benchmarks.offline_render
+    python -m cProfile -s cumtime -m adapters.audio_engine.benchmarks.offline_render
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+import soundfile as sf
+
+from adapters.audio_engine.benchmarks import make_test_file
+from adapters.audio_engine.core.engine import CoreEngine
+from adapters.audio_engine.core.output import OfflineRenderer, WavFileOutput
+from adapters.audio_engine.effects.equalizer import ParametricEQ
+from adapters.audio_engine.effects.reverb import UltraLightReverb
+
+
+def render(path, output=None, effects=False, channels=1, buffer_size=512, sample_rate=44100):
+    """
+    Render a file to the end
+    :param path:
+    :param output: OutputBackend, a NullOutput if not given
+    :param effects: add an EQ and a reverb to the engine's effects
+    :param channels: above 1 the file plays on that many mixer channels
+    :param buffer_size:
+    :param sample_rate:
+    :return: OfflineRenderer.render result
+    """
+    engine = CoreEngine(sample_rate, buffer_size, use_mixer=channels > 1, offline=True)
+    if effects:
+        engine.add_effect(ParametricEQ(sample_rate=sample_rate))
+        engine.add_effect(UltraLightReverb(sr=sample_rate))
+    if channels > 1:
+        for channel in range(channels):
+            engine._create_channel()
+            engine.load_file(path, channel=channel)
+    else:
+        engine.load_file(path)
+    engine.play()
+    try:
+        return OfflineRenderer(engine, output).render()
+    finally:
+        engine.stop(shutdown=True)
+        for channel in engine.mixer.channels if engine.mixer else [engine._channel]:
+            channel.close()
+
+
+def _digest(path):
+    # the samples, the file's PEAK chunk carries a timestamp
+    data, _ = sf.read(path, dtype='float32')
+    return hashlib.sha1(data.tobytes()).hexdigest()
+
+
+def run(seconds=60.0, buffer_size=512, sample_rate=44100):
+    """
+    :param seconds: length of the test file
+    :param buffer_size:
+    :param sample_rate:
+    :return: case -> render result, and whether two renders to WAV came out identical
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        path = make_test_file(seconds, sample_rate, directory=directory)
+        results = {
+            'channel': render(path, buffer_size=buffer_size, sample_rate=sample_rate),
+            'channel + effects': render(path, effects=True, buffer_size=buffer_size, sample_rate=sample_rate),
+            'mixer x8': render(path, channels=8, buffer_size=buffer_size, sample_rate=sample_rate),
+        }
+        digests = []
+        for i in range(2):
+            output = WavFileOutput(os.path.join(directory, f'render{i}.wav'), sample_rate, blocksize=buffer_size)
+            try:
+                render(path, output, effects=True, buffer_size=buffer_size, sample_rate=sample_rate)
+            finally:
+                output.close()
+            digests.append(_digest(output.path))
+        return results, digests[0] == digests[1]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    results, identical = run()
+    for case, result in results.items():
+        print(f"{case:>18}: {result['seconds']:.1f} s of audio in {result['elapsed'] * 1000:.0f} ms, "
+              f"{result['realtime_factor']:.0f}x real time")
+    print(f"two renders to WAV {'identical' if identical else 'DIFFER'}")
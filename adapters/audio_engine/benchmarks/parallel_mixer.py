@@ -0,0 +1,57 @@
+"""
+Mixer cost per block with the channels rendered on 0 to 3 extra threads.
+Every channel runs its own EQ and reverb so there is work to share out.
+The threads only run at once on a free-threaded build, run it there to
+see the scaling; with a GIL it shows what the handoff costs:
+
+    python3.13t -X gil=0 -m adapters.audio_engine.benchmarks.parallel_mixer
+"""
+import sys
+
+import numpy as np
+
+from adapters.audio_engine.benchmarks.mixer import BlockSource, _time
+from adapters.audio_engine.core.mixer import CoreMixer
+from adapters.audio_engine.effects.chain import EffectChain
+from adapters.audio_engine.effects.equalizer import ParametricEQ
+from adapters.audio_engine.effects.reverb import UltraLightReverb
+from adapters.audio_engine.utils.render_pool import FREE_THREADED
+
+
+def run(channel_counts=(4, 8, 16), worker_counts=(0, 1, 2, 3), blocks=200, buffer_size=512, sample_rate=44100):
+    """
+    :param channel_counts:
+    :param worker_counts: render threads besides the calling one
+    :param blocks: blocks timed per case
+    :param buffer_size:
+    :param sample_rate:
+    :return: channel count -> {workers: seconds per block}
+    """
+    rng = np.random.default_rng(0)
+    results = {}
+    for count in channel_counts:
+        blocks_in = [(rng.standard_normal((buffer_size, 2)) * 0.01).astype(np.float32) for _ in range(count)]
+        out = np.empty((buffer_size, 2), dtype=np.float32)
+        results[count] = {}
+        for workers in worker_counts:
+            mixer = CoreMixer(sample_rate, buffer_size, render_workers=workers)
+            for block in blocks_in:
+                effects = EffectChain([ParametricEQ(sample_rate=sample_rate), UltraLightReverb(sr=sample_rate)])
+                mixer.add_channel(BlockSource(block, effects, sample_rate))
+            results[count][workers] = _time(lambda: mixer.get_next_buffer(out=out), blocks)
+            if mixer.render_pool:
+                mixer.render_pool.close()
+    return results
+
+
+if __name__ == '__main__':
+    block_time = 512 / 44100
+    print(f"Python {sys.version.split()[0]}, {'free-threaded' if FREE_THREADED else 'GIL enabled'}")
+    results = run()
+    worker_counts = next(iter(results.values())).keys()
+    print(f"{'channels':>8} " + " ".join(f"{f'{w + 1} thr':>14}" for w in worker_counts)
+          + f"  (us per block and speedup, a block is {block_time * 1e6:.0f} us)")
+    for count, result in results.items():
+        base = result[0]
+        print(f"{count:>8} " + " ".join(f"{seconds * 1e6:>8.0f} {base / seconds:>4.1f}x"
+                                        for seconds in result.values()))
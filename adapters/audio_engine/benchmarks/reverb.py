@@ -0,0 +1,68 @@
+"""
+Real-time factor of the reverbs: processing time over the duration of the
+audio processed, on one core. Below 0.05 is needed to run them in production.
+
+    python -m adapters.audio_engine.benchmarks.reverb
+"""
+import time
+
+import numpy as np
+
+from adapters.audio_engine.effects.allpassrverb import AllpassReverb
+from adapters.audio_engine.effects.fdn_v2 import ReverbFilter
+from adapters.audio_engine.effects.reverb import UltraLightReverb, LiteReverb, ReverbEffect, OptimalReverb
+
+TARGET_RTF = 0.05
+
+
+def reverbs(sample_rate):
+    """
+    :param sample_rate:
+    :return: name -> effect
+    """
+    return {
+        'UltraLightReverb': UltraLightReverb(sr=sample_rate),
+        'LiteReverb': LiteReverb(sr=sample_rate),
+        'ReverbEffect': ReverbEffect(pre_delay=10, sr=sample_rate),
+        'ReverbFilter': ReverbFilter(sr=sample_rate),
+        'AllpassReverb': AllpassReverb(sample_rate=sample_rate, delay_ms=60),
+        'OptimalReverb': OptimalReverb(sample_rate=sample_rate),
+    }
+
+
+def measure(effect, blocks=50, buffer_size=4096, sample_rate=44100):
+    """
+    :param effect:
+    :param blocks: blocks timed after one warm up block
+    :param buffer_size:
+    :param sample_rate:
+    :return: real-time factor
+    """
+    rng = np.random.default_rng(0)
+    data = (rng.standard_normal((buffer_size, 2)) * 0.1).astype(np.float32)
+    # OptimalReverb's feedback grows without bound at its defaults, the
+    # overflow does not change the timing
+    with np.errstate(over='ignore', invalid='ignore'):
+        effect.process(data, sample_rate)
+        start = time.perf_counter()
+        for _ in range(blocks):
+            effect.process(data, sample_rate)
+        elapsed = time.perf_counter() - start
+    return elapsed / (blocks * buffer_size / sample_rate)
+
+
+def run(blocks=50, buffer_size=4096, sample_rate=44100):
+    """
+    :param blocks:
+    :param buffer_size:
+    :param sample_rate:
+    :return: name -> real-time factor
+    """
+    return {name: measure(effect, blocks, buffer_size, sample_rate)
+            for name, effect in reverbs(sample_rate).items()}
+
+
+if __name__ == '__main__':
+    for name, rtf in run().items():
+        status = 'ok' if rtf < TARGET_RTF else 'too slow'
+        print(f"{name:<18} RTF {rtf:.4f} ({status})")
@@ -0,0 +1,82 @@
+"""
+Time to first sample of a new track while another one plays, with the
+output stream kept open. Measured up to the new track's first block being
+in the output ring, the callback then picks it up within one block.
+The budget is 30 ms for a cached file.
+
+    python -m adapters.audio_engine.benchmarks.track_switch
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from adapters.audio_engine.benchmarks import make_test_file
+from adapters.audio_engine.core.engine import CoreEngine
+from adapters.audio_engine.utils.threads import AudioProcessorThread
+
+BUDGET = 0.03
+
+
+def _wait(condition, timeout=2.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("Render thread did not pick up the new track")
+        time.sleep(0.0001)
+
+
+def run(switches=20, cached=True, buffer_size=512, sample_rate=44100):
+    """
+    :param switches: track changes measured
+    :param cached: read the tracks from the PCM cache
+    :param buffer_size:
+    :param sample_rate:
+    :return: list of seconds from load_file to the first block rendered
+    """
+    directory = tempfile.mkdtemp()
+    paths = [make_test_file(seconds=30, sample_rate=sample_rate, directory=directory) for _ in range(2)]
+    engine = CoreEngine(sample_rate, buffer_size)
+    if cached:
+        cache = engine.enable_pcm_cache(os.path.join(directory, 'cache'))
+        for i, path in enumerate(paths):
+            cache.populate(str(i), path)
+    # the render thread without a device, the ring is drained by hand
+    engine.processor = AudioProcessorThread(engine, engine.ring_buffer, buffer_size, daemon=True)
+    engine.processor.start()
+    ring = engine.ring_buffer
+    try:
+        results = []
+        for i in range(switches + 1):
+            start = time.perf_counter()
+            engine.load_file(paths[i % 2], track_id=str(i % 2))
+            engine.play()
+            # the switch flushes the ring, then the new track's blocks fill it
+            _wait(lambda: not engine.swaps and ring.fill_level() >= buffer_size
+                  and engine.processor.channel is engine._channel)
+            elapsed = time.perf_counter() - start
+            if i:
+                results.append(elapsed)
+            # play some of it before switching again
+            out = engine.buffer_pool.acquire()
+            for _ in range(8):
+                ring.read_into(out)
+                engine.processor.signal()
+                time.sleep(buffer_size / sample_rate / 4)
+            engine.buffer_pool.release(out)
+        return results
+    finally:
+        engine.stop(shutdown=True)
+        if engine._channel:
+            engine._channel.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    for cached in (True, False):
+        results = sorted(run(cached=cached))
+        # worst case wait for the next callback after the block is ready
+        worst = results[-1] + 512 / 44100
+        status = 'ok' if worst < BUDGET else 'over budget'
+        print(f"{'cached' if cached else 'decoded'}: median {results[len(results) // 2] * 1000:.1f} ms, "
+              f"worst {results[-1] * 1000:.1f} ms, with one callback {worst * 1000:.1f} ms ({status})")
@@ -1,239 +1,507 @@
-import math
 import threading
 import soundfile as sf
 import numpy as np
-import scipy.signal as sps
-from fractions import Fraction
 
 from adapters.audio_engine.errors import AudioEngineError
+from adapters.audio_engine.core.decoder import ChannelDecoder
+from adapters.audio_engine.core.indexed_file import IndexedMP3File
+from adapters.audio_engine.utils.buffer_pool import BufferPool
+from adapters.audio_engine.utils.smoothing import SmoothedParameter
+from adapters.audio_engine.effects.chain import EffectChain
 from core import logger
+from core.utility.loudness import normalization_gain, REFERENCE_LUFS
+
+
+def equal_power_ramps(frames: int):
+    """
+    Gain curves for a crossfade, the summed power stays constant
+    :param frames: crossfade length
+    :return: (fade out, fade in) arrays of shape (frames, 2)
+    """
+    t = (np.arange(frames, dtype=np.float64) + 0.5) / max(frames, 1)
+    # one column per channel, a broadcast multiply would allocate ufunc buffers
+    fade_out = np.repeat(np.cos(0.5 * np.pi * t)[:, None], 2, axis=1).astype(np.float32)
+    fade_in = np.repeat(np.sin(0.5 * np.pi * t)[:, None], 2, axis=1).astype(np.float32)
+    return fade_out, fade_in
 
 
 class CoreAudioChannel:
-    def __init__(self, sample_rate=44100, buffer_size=512):
+    max_crossfade = 12.0  # seconds
+    gain_ramp_time = 0.02  # seconds a volume or pan change is spread over
+
+    def __init__(self, sample_rate=44100, buffer_size=512, lookahead=2.0, buffer_pool: BufferPool = None):
+        """
+        :param sample_rate:
+        :param buffer_size:
+        :param lookahead: seconds decoded ahead of the playhead
+        :param buffer_pool: scratch blocks for the render path, normally the engine's
+        """
         self.file_path = ""
         self.buffer_size = buffer_size
         self.sample_rate = sample_rate
-        self.audio_file = None  # Current audio file handle
-        self.next_audio_file = None  # Next audio file handle for gapless playback
+        self.lookahead = lookahead
+        # Decoding, mono widening and resampling happen on the decoder thread
+        self.decoder = ChannelDecoder(sample_rate, buffer_size, lookahead)
+        self.decoder.start()
+        self.buffer_pool = buffer_pool if buffer_pool else BufferPool(buffer_size, count=2)
         self.current_is_mono = False  # Track if current file is mono
-        self.next_is_mono = False  # Track if next file is mono
         self.resample_ratio = 1.0  # Target rate / file rate
-        self.up_factor = 1  # For resample_poly: numerator
-        self.down_factor = 1  # For resample_poly: denominator
+        self._position = 0  # Frames played since the start of the current file
         self.playing = False
         self.do_not_play = False
-        self.loop = False
-        self.volume = 0.5
-        self.effects = []
+        # per sample gains, set here and ramped on the render thread
+        self._volume = SmoothedParameter(0.5, self.gain_ramp_time, sample_rate, buffer_size)
+        self._pan = 0.0
+        self._pan_gains = (SmoothedParameter(1.0, self.gain_ramp_time, sample_rate, buffer_size),
+                           SmoothedParameter(1.0, self.gain_ramp_time, sample_rate, buffer_size))
+        self._fade_gain = SmoothedParameter(1.0, 0.0, sample_rate, buffer_size)
+        # loudness normalization from values measured at scan time
+        self.normalization = None  # None, 'track' or 'album'
+        self.reference_loudness = REFERENCE_LUFS
+        self._normalize = SmoothedParameter(1.0, self.gain_ramp_time, sample_rate, buffer_size)
+        self._loudness = None  # of the file being heard
+        self._file_loudness = {}  # SoundFile -> loudness of loaded and queued files
+        self.pcm_cache = None  # PCMCache, files are read from it when cached
+        self.effects = EffectChain()
         self.lock = threading.Lock()
-        self.pan = 0.0
         self.on_playback_end = None
         self.paused = False
-        self.fade_out_samples = 0 #(1500/1000) * sample_rate
-        self.fade_in_samples = 0 #(2000/1000) * sample_rate
-        self.fade_position = 0
-        self._fade = False
+        self._fade = False  # fade in files as they load
         self.fade_type = 'exponential' # linear, exponetial
         self.file_length = 0.1
         self.latency = self.buffer_size // self.sample_rate * 1000
 
+        # crossfade into the queued file, 0 keeps the gapless switch
+        self.crossfade_frames = 0
+        self._ramps = equal_power_ramps(0)
+        self._next_decoder = None  # decodes the head of the queued file
+        self._next_position = 0  # frames read from it
+        self._crossfade_start = 0  # playhead frame the fade starts at
+        self._crossfade_length = 0
+        self._crossfade_ramps = self._ramps
+
+    @property
+    def volume(self):
+        """
+        Gain 0-1, changes are ramped
+        :return:
+        """
+        return self._volume.target
+
+    @volume.setter
+    def volume(self, value):
+        self._volume.set(value)
+
+    @property
+    def pan(self):
+        """
+        -1 (left) to 1 (right)
+        :return:
+        """
+        return self._pan
+
+    @pan.setter
+    def pan(self, value):
+        value = min(max(float(value), -1.0), 1.0)
+        self._pan = value
+        # balance, the centre keeps both sides at unity
+        left, right = self._pan_gains
+        left.set(min(1.0, 1.0 - value))
+        right.set(min(1.0, 1.0 + value))
+
+    @property
+    def audio_file(self):
+        """
+        Current audio file handle, owned by the decoder
+        :return:
+        """
+        return self.decoder.audio_file
+
+    @property
+    def next_audio_file(self):
+        """
+        Next audio file handle for gapless playback
+        :return:
+        """
+        return self.decoder.next_audio_file
+
+    @property
+    def loop(self):
+        return self.decoder.loop
+
+    @loop.setter
+    def loop(self, value):
+        self.decoder.loop = value
+
     def add_effects(self, effects:list):
+        """
+        Append effects to the channel's chain, in series
+        :param effects: effects, EffectNodes or an EffectChain
+        :return:
+        """
         with self.lock:
             for effect in effects:
                 if effect not in self.effects:
                     self.effects.append(effect)
 
-    def load_file(self, file_path):
+    def _open(self, file_path, track_id=None, seek_index=None):
+        """
+        The cached PCM of a file if there is one, else the file itself. A miss
+        is cached in the background for the next time
+        :param file_path:
+        :param track_id: cache key, files without one are not cached
+        :param seek_index: MP3 frame index, seeks use it instead of scanning the file
+        :return: SoundFile, CachedPCMFile or IndexedMP3File
+        """
+        if self.pcm_cache is not None and track_id is not None:
+            cached = self.pcm_cache.open(track_id, file_path)
+            if cached is not None:
+                return cached
+            self.pcm_cache.prefetch([(track_id, file_path)])
+        if seek_index:
+            try:
+                return IndexedMP3File(file_path, seek_index)
+            except ValueError as e:
+                logger.warning(f"Ignoring the seek index of {file_path}: {e}")
+        return sf.SoundFile(file_path, 'r')
+
+    def load_file(self, file_path, loudness: dict = None, track_id: str = None, seek_index: bytes = None):
         """
         Load a new audio file for playback, closing any existing file
         :param file_path:
+        :param loudness: {'track': (LUFS, dBTP), 'album': (LUFS, dBTP)} measured by the scanner
+        :param track_id: key of the file in the PCM cache
+        :param seek_index: MP3 frame index built by the scanner
         :return:
         """
-        with self.lock:
-            try:
-                self.fade_in_samples = (2000/1000) * self.sample_rate if self._fade else 0
-                audio_file = sf.SoundFile(file_path, 'r')
-                if self.audio_file is not None:
-                    self.audio_file.close()
-                self.audio_file = audio_file
-                self.current_is_mono = self.audio_file.channels == 1
-                self.do_not_play = False
-                self.file_length = self.audio_file.frames // self.sample_rate
-
-                # Determine resampling factors if the file's sample rate doesn't match.
-                if self.audio_file.samplerate != self.sample_rate:
-                    ratio = self.sample_rate / self.audio_file.samplerate
-                    self.resample_ratio = ratio
-                    frac = Fraction(self.sample_rate, self.audio_file.samplerate).limit_denominator(1000)
-                    self.up_factor = frac.numerator
-                    self.down_factor = frac.denominator
-                    logger.info(
-                        f"Warning: File sample rate {self.audio_file.samplerate} doesn't match target {self.sample_rate}. "
-                        f"Resampling with ratio {self.resample_ratio:.5f} (up={self.up_factor}, down={self.down_factor})")
+        try:
+            # opening reads the file, done before taking the lock the render thread needs
+            audio_file = self._open(file_path, track_id, seek_index)
+            with self.lock:
+                if self._fade:
+                    self._fade_gain.set(1.0, int(2.0 * self.sample_rate), start=0.0)
                 else:
-                    self.resample_ratio = 1.0
-                    self.up_factor = 1
-                    self.down_factor = 1
-            except Exception as e:
-                error = f"Error loading file {e}"
-                self.do_not_play = True
-                # self.audio_file = None
-                logger.warning(error)
-                return [AudioEngineError.CHANNEL_LOAD_ERROR, error]
-
-    def queue_file(self, file_path):
+                    self._fade_gain.jump(1.0)
+                decoder = self.decoder
+                decoder.load(audio_file)
+                self._file_loudness = {audio_file: loudness}
+                self._set_current(audio_file, ramp=False)
+                self._position = 0
+                self._arm_crossfade()
+                self.do_not_play = False
+            if self.resample_ratio != 1.0:
+                logger.info(
+                    f"Warning: File sample rate {audio_file.samplerate} doesn't match target {self.sample_rate}. "
+                    f"Resampling with ratio {self.resample_ratio:.5f}")
+            # have the first block ready before the render thread asks for it, under the decoder's lock only
+            decoder.prime(self.buffer_size)
+        except Exception as e:
+            error = f"Error loading file {e}"
+            self.do_not_play = True
+            # self.audio_file = None
+            logger.warning(error)
+            return [AudioEngineError.CHANNEL_LOAD_ERROR, error]
+
+    def queue_file(self, file_path, loudness: dict = None, track_id: str = None, seek_index: bytes = None):
         """
         Queue the next file for gapless playback
         :param file_path:
+        :param loudness: see load_file
+        :param track_id: see load_file
+        :param seek_index: see load_file
         :return: error or None
         """
-        with self.lock:
-            try:
-                if self.next_audio_file is not None:
-                    self.next_audio_file.close()
-                self.next_audio_file = sf.SoundFile(file_path, 'r')
-                self.next_is_mono = self.next_audio_file.channels == 1
-                self.file_length = self.next_audio_file.frames // self.sample_rate
+        try:
+            # see load_file, the file is opened outside the lock
+            next_audio_file = self._open(file_path, track_id, seek_index)
+            with self.lock:
+                self._file_loudness[next_audio_file] = loudness
+                if self.crossfade_frames and not self.loop and self.audio_file is not None:
+                    self._queue_crossfade(next_audio_file)
+                else:
+                    self.decoder.queue(next_audio_file)
+                self.file_length = next_audio_file.frames // next_audio_file.samplerate
                 #print("[+] Next file queued for gapless playback")
                 return None
-            except Exception as e:
-                error = f"{AudioEngineError.CHANNEL_QUEUE_ERROR} Error queueing file: {e}"
-                logger.warning(error)
-                self.next_audio_file = None
-                return [AudioEngineError.CHANNEL_QUEUE_ERROR, error]
+        except Exception as e:
+            error = f"{AudioEngineError.CHANNEL_QUEUE_ERROR} Error queueing file: {e}"
+            logger.warning(error)
+            return [AudioEngineError.CHANNEL_QUEUE_ERROR, error]
+
+    def set_crossfade(self, seconds):
+        """
+        Crossfade length into queued files, 0 switches gaplessly
+        :param seconds: 0 to max_crossfade
+        :return:
+        """
+        with self.lock:
+            seconds = min(max(float(seconds), 0.0), self.max_crossfade)
+            self.crossfade_frames = int(seconds * self.sample_rate)
+            # ramp tables are built here so the render path never allocates them
+            self._ramps = equal_power_ramps(self.crossfade_frames)
+            self._arm_crossfade()
+
+    def _queue_crossfade(self, audio_file):
+        """
+        Start decoding the head of audio_file next to the current file
+        :param audio_file: open SoundFile
+        :return:
+        """
+        if self._crossfading():
+            # already fading into the previous queued file, play this one after it
+            self._next_decoder.queue(audio_file)
+            return
+        if self._next_decoder is None:
+            self._next_decoder = ChannelDecoder(self.sample_rate, self.buffer_size, self.lookahead)
+            self._next_decoder.start()
+        self._next_decoder.load(audio_file)
+        self._next_position = 0
+        self._arm_crossfade()
+
+    def _output_frames(self, audio_file):
+        """
+        Length of a file in frames at the channel rate
+        :param audio_file:
+        :return:
+        """
+        return int(audio_file.frames * self.sample_rate / audio_file.samplerate)
+
+    def _arm_crossfade(self):
+        """
+        Work out where the fade into the queued file starts and its ramps
+        :return:
+        """
+        if self._next_decoder is None or self._crossfading():
+            return
+        current, incoming = self.audio_file, self._next_decoder.audio_file
+        if current is None or incoming is None:
+            return
+        end = self._output_frames(current)
+        start = max(end - self.crossfade_frames, self._position)
+        length = max(min(end - start, self._output_frames(incoming)), 0)
+        self._crossfade_start = start
+        self._crossfade_length = length
+        self._crossfade_ramps = self._ramps if length == self.crossfade_frames else equal_power_ramps(length)
+
+    def _crossfading(self):
+        """
+        True once the queued file is being mixed in
+        :return:
+        """
+        return self._next_decoder is not None and self._next_position > 0
+
+    def _cancel_crossfade(self):
+        """
+        Drop the decoder of the queued file
+        :return:
+        """
+        if self._next_decoder is not None:
+            self._next_decoder.close()
+            self._next_decoder = None
+            self._next_position = 0
+
+    def _mix_next(self, output, start_position, read):
+        """
+        Fade the queued file in over the end of the current one, in place
+        :param output: block holding the current file's frames
+        :param start_position: playhead at the start of the block
+        :param read: frames of the current file in the block
+        :return: True once the fade is complete
+        """
+        frames = len(output)
+        # where the queued file comes in, or right after the current one if it ended early
+        offset = min(max(self._crossfade_start - start_position, 0), read)
+        length = self._crossfade_length
+        ramp_start = start_position + offset - self._crossfade_start
+        ramped = min(max(length - ramp_start, 0), frames - offset) if ramp_start >= 0 else 0
+
+        scratch = self.buffer_pool.acquire()
+        incoming = scratch[:frames - offset]
+        got = self._next_decoder.read_into(incoming)
+        incoming[got:].fill(0)
+        self._next_position += got
+        # the block gets the current file's normalization later, give the queued file its own
+        gain = self._normalization_gain(self._file_loudness.get(self._next_decoder.audio_file)) / self._normalize.target
+        if gain != 1.0:
+            np.multiply(incoming, gain, out=incoming)
+
+        if ramped:
+            fade_out, fade_in = self._crossfade_ramps
+            outgoing = output[offset:offset + ramped]
+            np.multiply(outgoing, fade_out[ramp_start:ramp_start + ramped], out=outgoing)
+            np.multiply(incoming[:ramped], fade_in[ramp_start:ramp_start + ramped], out=incoming[:ramped])
+        # past the ramp the current file is fully faded out
+        output[offset + ramped:].fill(0)
+        np.add(output[offset:], incoming, out=output[offset:])
+        self.buffer_pool.release(scratch)
+
+        return ramp_start < 0 or ramp_start + frames - offset >= length
+
+    def _switch_to_next(self):
+        """
+        Make the queued file's decoder the current one after a crossfade
+        :return:
+        """
+        # the worker closes the finished file, the render thread does no I/O
+        self.decoder.retire()
+        self.decoder = self._next_decoder
+        self._next_decoder = None
+        # its gain was applied while fading in, no ramp
+        self._set_current(self.decoder.audio_file, ramp=False)
+        self._position = self._next_position
+        self._next_position = 0
+
+    def _set_current(self, audio_file, ramp=True):
+        """
+        Update the playback info once a file becomes the one being heard
+        :param audio_file:
+        :param ramp: ramp to the file's normalization gain instead of jumping
+        :return:
+        """
+        self.current_is_mono = audio_file.channels == 1
+        self.file_length = audio_file.frames // audio_file.samplerate
+        self.resample_ratio = self.sample_rate / audio_file.samplerate
+        self._loudness = self._file_loudness.pop(audio_file, None)
+        gain = self._normalization_gain(self._loudness)
+        if ramp:
+            self._normalize.set(gain)
+        else:
+            self._normalize.jump(gain)
+
+    def _normalization_gain(self, loudness):
+        """
+        :param loudness: see load_file
+        :return: linear gain for the current mode
+        """
+        if not self.normalization or not loudness:
+            return 1.0
+        value, peak = loudness.get(self.normalization) or (None, None)
+        if value is None:
+            # album not measured, the track value is better than nothing
+            value, peak = loudness.get('track') or (None, None)
+        return normalization_gain(value, peak, self.reference_loudness)
+
+    def set_normalization(self, mode: str = None, reference: float = None):
+        """
+        Loudness normalization, costs a gain per block since nothing is measured while playing
+        :param mode: None (off), 'track' or 'album'
+        :param reference: target LUFS
+        :return:
+        """
+        if mode not in (None, 'track', 'album'):
+            raise ValueError(f"Unknown normalization mode: {mode}")
+        with self.lock:
+            self.normalization = mode
+            if reference is not None:
+                self.reference_loudness = reference
+            self._normalize.set(self._normalization_gain(self._loudness))
+
+    def _advance_position(self, frames):
+        """
+        Move the playhead by the frames just rendered, following the decoder's
+        markers when a queued file starts within them
+        :param frames:
+        :return:
+        """
+        self._position += frames
+        segments = self.decoder.segments
+        read_position = self.decoder.ring_buffer.read_position
+        while segments and segments[0][0] <= read_position:
+            start, audio_file = segments.popleft()
+            self._set_current(audio_file)
+            self._position = read_position - start
+
     def start_fade_out(self, fade_time_ms):
         """
+        Fade to silence, the channel stays silent until a fade in or a new file
         :param fade_time_ms:
         :return:
         """
-        with self.lock:
-            self.fade_out_samples = int(fade_time_ms * self.sample_rate / 1000)
-            self.fade_position = 0
+        self._fade_gain.set(0.0, int(fade_time_ms * self.sample_rate / 1000))
 
     def start_fade_in(self, fade_time_ms):
         """
         :param fade_time_ms:
         :return:
         """
-        with self.lock:
-            self.fade_in_samples = int(fade_time_ms * self.sample_rate / 1000)
-            self.fade_position = 0
+        self._fade_gain.set(1.0, int(fade_time_ms * self.sample_rate / 1000), start=0.0)
 
     def _apply_fade(self, data):
         """
-        Apply fade-in or fade-out to the audio data.
+        Apply fade-in or fade-out to the audio data, one gain per sample
         :param data: audio samples
         :return:
         """
-        
-        if self.fade_in_samples > 0 :
-            fade_scale = self.fade_position / self.fade_in_samples
-            if self.fade_type == 'exponential':
-                fade_scale = fade_scale ** 2
-            data *= fade_scale
-            self.fade_position += len(data)
-            if self.fade_position >= self.fade_in_samples:
-                self.fade_in_samples = 0
-                self.fade_position = 0
-            self._fade = False
-        elif self.fade_out_samples > 0:
-            fade_scale = 1.0 - (self.fade_position / self.fade_out_samples)
-            if self.fade_type == 'exponential':
-                fade_scale = fade_scale ** 2
-            data *= fade_scale
-            self.fade_position += len(data)
-            if self.fade_position >= self.fade_out_samples:
-                self.fade_out_samples = 0
-                self.fade_position = 0
-                # self.playing = False  # Stop playback after fade-out
+        gain = self._fade_gain.next_block(len(data))
+        if self.fade_type == 'exponential':
+            if isinstance(gain, float):
+                gain = gain * gain
+            else:
+                np.square(gain, out=gain)
+        return SmoothedParameter.apply(data, gain)
 
+    def _apply_gain(self, data):
+        """
+        Volume, normalization and pan, ramped per sample when they change
+        :param data: audio samples
+        :return:
+        """
+        frames = len(data)
+        SmoothedParameter.apply(data, self._volume.next_block(frames))
+        SmoothedParameter.apply(data, self._normalize.next_block(frames))
+        left, right = self._pan_gains
+        SmoothedParameter.apply(data, left.next_block(frames), 0)
+        SmoothedParameter.apply(data, right.next_block(frames), 1)
         return data
 
     def _apply_effects(self, data):
         """
+        Run the block through the effect chain, in place
         :param data: audio samples
         :return:
         """
         if self.effects:
-            out = np.zeros_like(data)
-            for effect in self.effects:
-                out += effect.process(data, self.sample_rate)
-            #print(f"Processed: {out} original: {data}")
-            return out
-        else:
-            return data
+            processed = self.effects.process(data, self.sample_rate)
+            if processed is not data:
+                np.copyto(data, processed)
+        return data
+
+    def _seeking(self):
+        # a decoder flushes its ring on its own thread while a seek is pending
+        next_decoder = self._next_decoder
+        return self.decoder.seek_pending or (next_decoder is not None and next_decoder.seek_pending)
 
-    def get_next_buffer(self):
+    def get_next_buffer(self, out: np.ndarray = None):
         """
         Return a buffer of self.buffer_size samples (at the target sample rate).
+        :param out: block to render into, a new one is allocated if not given
         :return:
         """
+        output = out if out is not None else np.empty((self.buffer_size, 2), dtype=np.float32)
         with self.lock:
-            if not self.playing or self.audio_file is None or self.paused:
-                return np.zeros((self.buffer_size, 2), dtype=np.float32)
-
-            chunks = []
-            total_output = 0
-
-            # Loop until we've accumulated enough output samples.
-            while total_output < self.buffer_size:
-                out_frames_needed = self.buffer_size - total_output
-                # If resampling, compute how many input frames are needed.
-                if self.resample_ratio != 1.0:
-                    in_frames_needed = int(math.ceil(out_frames_needed / self.resample_ratio))
-                else:
-                    in_frames_needed = out_frames_needed
-
-                try:
-                    data = self.audio_file.read(in_frames_needed, dtype='float32')
-                except ValueError:
-                    data = np.zeros((in_frames_needed, 2), dtype=np.float32)
-
-                if len(data) > 0:
-                    if self.current_is_mono:
-                        data = np.tile(data, (1, 2))
-                    # resample
-                    if self.resample_ratio != 1.0:
-                        data = sps.resample_poly(data, self.up_factor, self.down_factor, axis=0)
-                    chunks.append(data)
-                    total_output += len(data)
-                else:
-                    # End-of-file reached, switch to next file
-                    if self.loop:
-                        self.audio_file.seek(0)
-                    elif self.next_audio_file is not None:
-                        self.audio_file.close()
-                        self.audio_file = self.next_audio_file
-                        self.current_is_mono = self.next_is_mono
-                        if self.audio_file.samplerate != self.sample_rate:
-                            ratio = self.sample_rate / self.audio_file.samplerate
-                            self.resample_ratio = ratio
-                            frac = Fraction(self.sample_rate, self.audio_file.samplerate).limit_denominator(1000)
-                            self.up_factor = frac.numerator
-                            self.down_factor = frac.denominator
-                        else:
-                            self.resample_ratio = 1.0
-                            self.up_factor = 1
-                            self.down_factor = 1
-                        self.next_audio_file = None
-                        self.next_is_mono = False
-                    else:
-                        if self.audio_file:
-                            self.audio_file.close()
-                        self.audio_file = None
-                        self.playing = False
-                        # No more data: fill with silence.
-                        zeros_needed = self.buffer_size - total_output
-                        chunks.append(np.zeros((zeros_needed, 2), dtype=np.float32))
-                        total_output = self.buffer_size
-                        if self.on_playback_end:
-                            self.on_playback_end(self)
-                        break
-
-            # Concatenate chunks and trim to exactly buffer_size samples.
-            output = np.concatenate(chunks, axis=0)[:self.buffer_size]
-            output = output * self.volume
+            if not self.playing or self.audio_file is None or self.paused or self._seeking():
+                output.fill(0)
+                return output
+
+            read = self.decoder.read_into(output)
+            if read < self.buffer_size:
+                # underrun or end of file, pad with silence in place
+                output[read:].fill(0)
+            start_position = self._position
+            self._advance_position(read)
+
+            if self._next_decoder is not None and (
+                    start_position + self.buffer_size > self._crossfade_start or self.decoder.finished()):
+                if self._mix_next(output, start_position, read) and self.decoder.finished():
+                    self._switch_to_next()
+            elif read < self.buffer_size and self.decoder.finished():
+                # End-of-file reached and nothing queued, the rest stays silent
+                self.decoder.release()
+                self.playing = False
+                if self.on_playback_end:
+                    self.on_playback_end(self)
+
+            output = self._apply_gain(output)
 
             # Apply fades and effects.
             output = self._apply_fade(output)
@@ -242,24 +510,35 @@ class CoreAudioChannel:
 
     def set_volume(self, volume):
         """
-        :param volume:
+        :param volume: gain 0-1
         :return:
         """
-        with self.lock:
-            self.volume = float(volume / 100)
+        self.volume = float(volume)
+
+    def set_pan(self, pan):
+        """
+        :param pan: -1 (left) to 1 (right)
+        :return:
+        """
+        self.pan = pan
 
     def set_position(self, pos):
         """
-        :param pos:
+        Seek. The decoder threads do the I/O, the channel renders silence
+        until they have the new position decoded
+        :param pos: seconds
         :return:
         """
         with self.lock:
-            if self.audio_file is not None:
-                sample_pos = int(pos * self.sample_rate)
-                try:
-                    self.audio_file.seek(sample_pos)
-                except ValueError:
-                    pass
+            audio_file = self.audio_file
+            if audio_file is not None:
+                self.decoder.request_seek(int(pos * audio_file.samplerate))
+                self._position = int(pos * self.sample_rate)
+                if self._crossfading():
+                    # restart the queued file, the fade happens again
+                    self._next_decoder.request_seek(0)
+                    self._next_position = 0
+                self._arm_crossfade()
 
     def get_position(self):
         """
@@ -267,9 +546,23 @@ class CoreAudioChannel:
         """
         with self.lock:
             if self.audio_file is not None:
-                return self.audio_file.tell() / self.sample_rate
+                return self._position / self.sample_rate
             return 0.0
 
+    def prime(self, frames: int = None):
+        """
+        Decode on the calling thread until a block is buffered. Offline
+        rendering calls it before every block, a block then never comes out
+        short because a decoder thread fell behind
+        :param frames: defaults to one block
+        :return:
+        """
+        frames = frames or self.buffer_size
+        with self.lock:
+            self.decoder.prime(frames)
+            if self._next_decoder is not None:
+                self._next_decoder.prime(frames)
+
     def play(self):
         """
         :return:
@@ -285,10 +578,9 @@ class CoreAudioChannel:
         """
         with self.lock:
             self.playing = False
-            if self.audio_file is not None:
-                self.audio_file.seek(0)
-                self.audio_file.close()
-                self.audio_file = None
+            self.decoder.stop_file()
+            self._cancel_crossfade()
+            self._position = 0
 
     def pause(self):
         """
@@ -297,13 +589,23 @@ class CoreAudioChannel:
         with self.lock:
             self.paused = True
 
+    def retire(self):
+        """
+        Render side. Stop a channel that was swapped out without waiting on
+        its lock or on I/O, the decoders close their files on their own threads
+        :return:
+        """
+        self.playing = False
+        self.on_playback_end = None
+        self.decoder.retire()
+        if self._next_decoder is not None:
+            self._next_decoder.retire()
+
     def close(self):
         """
         Close any open file handles
         :return:
         """
         with self.lock:
-            if self.audio_file is not None:
-                self.audio_file.close()
-            if self.next_audio_file is not None:
-                self.next_audio_file.close()
+            self.decoder.close()
+            self._cancel_crossfade()
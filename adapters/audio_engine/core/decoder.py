@@ -0,0 +1,279 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+from adapters.audio_engine.utils.resampler import StreamingResampler, resample_factors
+from adapters.audio_engine.utils.ring_buffer import AudioRingBuffer
+from core import logger
+
+
+class ChannelDecoder(threading.Thread):
+    """
+    Decode-ahead worker for a CoreAudioChannel. Reads the file, widens mono to
+    stereo and resamples to the engine rate ahead of the playhead, so the render
+    thread only copies PCM out of the ring buffer.
+
+    File operations happen under self.lock, on this thread or on the control
+    thread (load/stop). The render thread only copies out of the ring. Seeks
+    are handed to this thread, the render side skips the ring while one is
+    pending so the ring can be flushed here.
+    """
+    idle_timeout = 1.0  # seconds
+
+    def __init__(self, sample_rate=44100, buffer_size=512, lookahead=2.0):
+        """
+        :param sample_rate: engine sample rate
+        :param buffer_size: frames decoded per step
+        :param lookahead: seconds of decoded audio kept ahead of the playhead
+        """
+        super().__init__(daemon=True, name="ChannelDecoder")
+        self.sample_rate = sample_rate
+        self.block_frames = buffer_size
+        capacity = max(int(lookahead * sample_rate), buffer_size * 4)
+        self.ring_buffer = AudioRingBuffer(capacity, channels=2, low_watermark=capacity // 2)
+        self.resampler = StreamingResampler(channels=2)
+        self.lock = threading.Lock()
+        self.running = True
+
+        self.audio_file = None
+        self.next_audio_file = None
+        self.is_mono = False
+        self.next_is_mono = False
+        self.loop = False
+        self.eof = False
+        # (stream frame, file) pairs marking where a queued file starts in the ring
+        self.segments = deque()
+
+        self._wake = threading.Event()
+        self._release = False
+        # seek handed over by the control thread, see request_seek
+        self.seek_pending = False
+        self._seek_frame = 0
+        self._seek_requests = 0
+
+    def _configure(self, audio_file):
+        """
+        :param audio_file:
+        :return:
+        """
+        up, down = resample_factors(self.sample_rate, audio_file.samplerate)
+        self.resampler.configure(up, down)
+
+    def load(self, audio_file):
+        """
+        Replace the current file, dropping everything decoded so far
+        :param audio_file: open SoundFile
+        :return:
+        """
+        with self.lock:
+            self._release = False
+            if self.audio_file is not None:
+                self.audio_file.close()
+            self.audio_file = audio_file
+            self.is_mono = audio_file.channels == 1
+            self._configure(audio_file)
+            self._flush()
+            # a seek requested in the previous file
+            self.seek_pending = False
+        self.wake()
+
+    def queue(self, audio_file):
+        """
+        Set the file decoded right after the current one, for gapless playback
+        :param audio_file: open SoundFile
+        :return:
+        """
+        with self.lock:
+            if self.next_audio_file is not None:
+                self.next_audio_file.close()
+            self.next_audio_file = audio_file
+            self.next_is_mono = audio_file.channels == 1
+            # the current file may already be fully decoded
+            self.eof = False
+        self.wake()
+
+    def request_seek(self, frame):
+        """
+        Ask the worker to flush and seek, without waiting for it. Until it has
+        a block decoded from the new position seek_pending stays set and the
+        render side must not read, the owning channel checks it under its lock
+        :param frame: position in file frames
+        :return:
+        """
+        self._seek_frame = frame
+        self._seek_requests += 1
+        self.seek_pending = True
+        self._wake.set()
+
+    def _take_seek(self):
+        """
+        Seek, flush and decode a block. Caller holds self.lock, the consumer
+        is not reading while seek_pending is set
+        :return:
+        """
+        request = self._seek_requests
+        frame = self._seek_frame
+        if self.audio_file is not None:
+            try:
+                self.audio_file.seek(frame)
+            except (ValueError, RuntimeError) as e:
+                logger.warning(f"[ChannelDecoder] Seek to frame {frame} failed: {e}")
+            self._flush()
+            while self.ring_buffer.fill_level() < self.block_frames and self._can_decode():
+                self._decode_block()
+        # a newer request keeps it pending, it is taken on the next pass
+        if request == self._seek_requests:
+            self.seek_pending = False
+
+    def stop_file(self):
+        """
+        Close the current and queued files and drop decoded audio
+        :return:
+        """
+        with self.lock:
+            self._close_files()
+            self._flush()
+            self.seek_pending = False
+
+    def release(self):
+        """
+        Render side. Let the worker close the files once playback has ended
+        :return:
+        """
+        self._release = True
+        self._wake.set()
+
+    def close(self):
+        """
+        Close files and end the thread
+        :return:
+        """
+        self.running = False
+        self.stop_file()
+        self._wake.set()
+
+    def retire(self):
+        """
+        Render side. End the thread, it closes its files on the way out
+        :return:
+        """
+        self.running = False
+        self._wake.set()
+
+    def _close_files(self):
+        if self.audio_file is not None:
+            self.audio_file.close()
+            self.audio_file = None
+        if self.next_audio_file is not None:
+            self.next_audio_file.close()
+            self.next_audio_file = None
+
+    def _flush(self):
+        """
+        Drop decoded audio. Caller holds self.lock and the consumer must not be
+        reading, the channel guarantees this by holding its own lock.
+        :return:
+        """
+        self.ring_buffer.clear()
+        self.resampler.reset()
+        self.segments.clear()
+        self.eof = False
+
+    def wake(self):
+        """
+        Ask the worker to top up the ring buffer
+        :return:
+        """
+        self._wake.set()
+
+    def prime(self, frames):
+        """
+        Decode on the calling thread until frames are buffered, so playback can
+        start without waiting for the worker
+        :param frames:
+        :return:
+        """
+        with self.lock:
+            if self.seek_pending:
+                self._take_seek()
+            while self.ring_buffer.fill_level() < frames and self._can_decode():
+                self._decode_block()
+
+    def finished(self):
+        """
+        True once the last file is fully decoded and played
+        :return:
+        """
+        return self.eof and self.ring_buffer.fill_level() == 0
+
+    def read_into(self, out: np.ndarray) -> int:
+        """
+        Render side. Copy decoded frames into out
+        :param out:
+        :return: frames read
+        """
+        read = self.ring_buffer.read_into(out)
+        if self.ring_buffer.below_low_watermark() and not self.eof:
+            self._wake.set()
+        return read
+
+    def _can_decode(self):
+        # leave room for the frames the resampler may produce beyond a block
+        margin = -(-self.resampler.up // self.resampler.down) + 1
+        return (self.audio_file is not None and not self.eof
+                and self.ring_buffer.free_space() >= self.block_frames + margin)
+
+    def _decode_block(self):
+        """
+        Decode one block into the ring buffer. Caller holds self.lock
+        :return:
+        """
+        frames = max(self.resampler.input_frames(self.block_frames), 1)
+        try:
+            data = self.audio_file.read(frames, dtype='float32', always_2d=True)
+        except (ValueError, RuntimeError):
+            data = np.zeros((0, 2), dtype=np.float32)
+
+        if len(data) > 0:
+            if self.is_mono:
+                data = np.broadcast_to(data, (len(data), 2))
+            self.ring_buffer.write(self.resampler.process(data))
+            return
+
+        # End-of-file reached, switch to next file
+        if self.loop:
+            self.audio_file.seek(0)
+        elif self.next_audio_file is not None:
+            self.audio_file.close()
+            self.audio_file = self.next_audio_file
+            self.is_mono = self.next_is_mono
+            self.next_audio_file = None
+            self.next_is_mono = False
+            # same ratio keeps the filter history so the join is seamless
+            self._configure(self.audio_file)
+            self.segments.append((self.ring_buffer.write_position, self.audio_file))
+        else:
+            self.eof = True
+
+    def run(self):
+        while self.running:
+            self._wake.wait(self.idle_timeout)
+            self._wake.clear()
+            if self._release:
+                with self.lock:
+                    if self._release:
+                        self._release = False
+                        self._close_files()
+                        self._flush()
+            while self.running:
+                with self.lock:
+                    if self.seek_pending:
+                        self._take_seek()
+                    if not self._can_decode():
+                        break
+                    self._decode_block()
+
+        # files are closed here so a retiring render side never waits on I/O
+        with self.lock:
+            self._close_files()
@@ -1,30 +1,61 @@
-import gc
-import time
-import queue
 import threading
+import time
+from collections import deque
 from typing import AnyStr, List
 
-import numpy as np
-import sounddevice as sd
-
 from adapters.audio_engine.errors import AudioEngineError
-from adapters.audio_engine.utils.threads import AudioProcessorThread, data_ready
+from adapters.audio_engine.utils.threads import AudioProcessorThread, PositionPublisher, StatsPublisher
+from adapters.audio_engine.utils.ring_buffer import AudioRingBuffer
+from adapters.audio_engine.utils.buffer_pool import BufferPool
+from adapters.audio_engine.utils.spectrum import SpectrumAnalyzer
+from adapters.audio_engine.utils.telemetry import TimingHistogram
 from adapters.audio_engine.core.mixer import CoreMixer
 from adapters.audio_engine.core.channel import CoreAudioChannel
+from adapters.audio_engine.core.pcm_cache import PCMCache
+from adapters.audio_engine.core.output import default_output
 from adapters.audio_engine.effects.effect import CoreAudioEffect
+from adapters.audio_engine.effects.chain import EffectChain, EffectNode
+from adapters.audio_engine.effects.limiter import LookaheadLimiter
 from core import logger
 
 
 # engine
 class CoreEngine:
 
-    def __init__(self, sample_rate=44100, buffer_size=512, use_mixer=False):
+    def __init__(self, sample_rate=44100, buffer_size=512, use_mixer=False, ring_blocks=8, low_watermark_blocks=2,
+                 lookahead=2.0, limiter_ceiling_db: float | None = -1.0, position_rate: float = 10.0, output=None,
+                 offline: bool = False, render_workers: int = None):
+        """
+        :param sample_rate:
+        :param buffer_size: frames rendered per block
+        :param use_mixer:
+        :param ring_blocks: output ring buffer size in blocks, tune per device
+        :param low_watermark_blocks: blocks left in the ring before the render thread is woken up
+        :param lookahead: seconds each channel decodes ahead of the playhead
+        :param limiter_ceiling_db: output limiter ceiling, None turns it off and the mixer hard clips
+        :param position_rate: position reports per second
+        :param output: OutputBackend class or factory, called as output(sample_rate, channels, blocksize,
+            callback, latency=...), defaults to the sound device
+        :param offline: never open a stream, blocks are pulled by an OfflineRenderer
+        :param render_workers: mixer threads rendering channels in parallel, see CoreMixer
+        """
         self.buffer_size = buffer_size
         self.sample_rate = sample_rate
         self.lock = threading.Lock()
-        self.mixer = CoreMixer(sample_rate, buffer_size, self.end_event_emitted) if use_mixer else None
+        # scratch blocks shared by the whole render path
+        self.buffer_pool = BufferPool(buffer_size, channels=2, count=8)
+        self.mixer = CoreMixer(sample_rate, buffer_size, self.end_event_emitted,
+                               buffer_pool=self.buffer_pool, render_workers=render_workers) if use_mixer else None
+        self.output = output or (None if offline else default_output())
+        self.offline = offline
         self.output_stream = None
         self.latency = (buffer_size / self.sample_rate) * 1000
+        self.limiter = None
+        self.set_limiter(limiter_ceiling_db)
+        self.lookahead = lookahead
+        self.crossfade = 0.0  # seconds, 0 for gapless
+        self.normalization = None  # None, 'track' or 'album'
+        self.pcm_cache = None
 
         self._sample_absolute = [0, 0]
         self._peak = 0
@@ -37,12 +68,38 @@ class CoreEngine:
                             0: 'play'
                             }
 
-        self.receive_audio_buffer = None
-        self.buffer_queue = queue.Queue(maxsize=8)
+        # analysis tap, the callback copies into it while set
+        self.spectrum = None
+        self.ring_buffer = AudioRingBuffer(buffer_size * ring_blocks, channels=2,
+                                           low_watermark=buffer_size * low_watermark_blocks)
         self.processor = None
+        self.position_rate = position_rate
+        self.position_publisher = None
+        # frames handed to the device, only the audio callback writes it
+        self.frames_played = 0
+        # telemetry, each counter has a single writer, see stats()
+        self.callback_times = TimingHistogram()
+        self.render_times = TimingHistogram()
+        self.underruns = 0
+        self.underrun_frames = 0
+        self.render_errors = 0
+        self._last_render_error = None
+        self.status_flags = {'output_underflow': 0, 'output_overflow': 0, 'priming_output': 0}
+        self.stats_interval = 10.0
+        self.stats_publisher = None
         self._output_latency = 'low'
-        self._startup_delay = 0.1
-        self.effects = []
+        # the stream and render thread stay up between tracks, a new channel
+        # is handed to the render thread here and taken at a block boundary
+        self.swaps = deque()
+        # bumped when a track is replaced in place, the render thread then
+        # drops the output it buffered from the previous one
+        self.flushes = 0
+        # effects every channel gets when it starts playing. With a mixer
+        # they run once on the master bus instead, channels rendered in
+        # parallel must not share an effect's state
+        self.effects = EffectChain()
+        if self.mixer:
+            self.mixer.buses[0].effects = self.effects
         # go ahead flag
         self.do_not_play = True
 
@@ -51,6 +108,7 @@ class CoreEngine:
         self.playback_event_handler = None
         self.position_event_handler = None
         self.error_event_handler = None
+        self.stats_event_handler = None
 
         self.errors = []
 
@@ -66,6 +124,17 @@ class CoreEngine:
     def register_error_event(self, handle):
         self.error_event_handler = handle
 
+    def register_stats_event(self, handle, interval: float = 10.0):
+        """
+        :param handle: called with stats() every interval while the stream is open
+        :param interval: seconds
+        :return:
+        """
+        self.stats_event_handler = handle
+        self.stats_interval = interval
+        if self.stats_publisher:
+            self.stats_publisher.interval = interval
+
     @property
     def sample_absolute_value(self):
         with self.lock:
@@ -76,10 +145,34 @@ class CoreEngine:
         with self.lock:
             return self._peak
     
-    def add_effect(self, effect: CoreAudioEffect):
-        self.effects.append(effect)
+    def add_effect(self, effect: CoreAudioEffect, wet: float = 1.0, bypass: bool = False) -> EffectNode:
+        """
+        Append an effect to the chain, after the ones already added
+        :param effect:
+        :param wet: 0-1 wet/dry mix of this effect
+        :param bypass:
+        :return: node to change wet/bypass later
+        """
+        node = self.effects.add(effect, wet, bypass)
         if self._channel:
-            self._channel.effects.append(effect)
+            self._channel.add_effects([node])
+        return node
+
+    def bypass_effect(self, effect, bypass: bool = True):
+        """
+        Skip an effect without removing it
+        :param effect: effect or the node returned by add_effect
+        :param bypass:
+        :return: False if the effect was not added
+        """
+        return self.effects.set_bypass(effect, bypass)
+
+    def effect_stats(self) -> list:
+        """
+        Per effect cost, microseconds per block
+        :return:
+        """
+        return self.effects.stats()
 
     def add_error(self, error: list):
         """
@@ -92,6 +185,24 @@ class CoreEngine:
         # keep only last 10
         self.errors = self.errors[:-10]
 
+    def render_failed(self, error: Exception):
+        """
+        Render thread side. The block being rendered was dropped and playback
+        goes on, an error repeating every block is reported once
+        :param error:
+        :return:
+        """
+        self.render_errors += 1
+        message = f"{type(error).__name__}: {error}"
+        if message == self._last_render_error:
+            return
+        self._last_render_error = message
+        logger.error(f"[AudioEngine] Render failed: {message}")
+        try:
+            self.add_error([AudioEngineError.RENDER_ERROR, message])
+        except Exception as e:
+            logger.warning(f"[AudioEngine] Error handler failed: {e}")
+
     def end_event_emitted(self, channel: CoreAudioChannel=None, value=False):
         """
         Used by mixer
@@ -115,24 +226,46 @@ class CoreEngine:
         with self.lock:
             return True if self._map_event(self._end_event) == "play" else False
 
-    def load_file(self, path, channel:int=None):
+    def load_file(self, path, channel:int=None, loudness: dict = None, track_id: str = None, seek_index: bytes = None):
         """
         :param path:
         :param channel: channel index if using mixer
+        :param loudness: scan time loudness, {'track': (LUFS, dBTP), 'album': (LUFS, dBTP)}
+        :param track_id: PCM cache key, the file is read from the cache when given
+        :param seek_index: MP3 frame index built by the scanner
         :return:
         """
         if self.mixer:
             if not self.mixer.channels:
                 channel = self._create_channel()
-            self.do_not_play = self.mixer.load_file_to_channel(channel, path)
+            self.do_not_play = self.mixer.load_file_to_channel(channel, path, loudness, track_id, seek_index)
+            self.flushes += 1
         else:
-            # use channel
-            channel = self._create_channel(True)
-            error = channel.load_file(path)
+            # load and prime a fresh channel while the current one keeps playing
+            channel = self._create_channel()
+            error = channel.load_file(path, loudness, track_id, seek_index)
             if error:
                 self.add_error(error)
 
             self.do_not_play = channel.do_not_play
+            self._swap_channel(channel)
+
+    def _swap_channel(self, channel: CoreAudioChannel):
+        """
+        Make channel the one played. The render thread switches to it between
+        two blocks and retires the previous one, without the stream stopping
+        :param channel:
+        :return:
+        """
+        previous = self._channel
+        self._channel = channel
+        if self.processor is None:
+            if previous is not None:
+                # nothing renders, stop its decoder thread and release the file handles now
+                previous.close()
+            return
+        self.swaps.append(channel)
+        self.processor.wake()
 
     def play(self, channel=None):
         """
@@ -145,17 +278,14 @@ class CoreEngine:
             self.add_error(err)
             return None
 
-        if self.is_playing():
-            self.shutdown()
-
-        # Start audio processing and streaming
+        # no-op while the stream is running, tracks are swapped into it
         self.start_stream()
+        self._last_render_error = None
 
         # Activate playback
         with self.lock:
             # check if mixer is initialized and channel is provided and play that channel
             if self.mixer and channel is not None:
-                self.mixer.add_effects(self.effects, channel)
                 self.mixer.play_channel(channel)
             elif self._channel:
                 self._channel.add_effects(self.effects)
@@ -165,61 +295,170 @@ class CoreEngine:
                 # mixer is initialized but channel index is set to None, play loaded channels only
                 channels = self.mixer.get_loaded_channels()
                 for channel in channels:
-                    channel.add_effects(self.effects)
                     channel.playing = True
             self._set_end_event(0)
+        self.wake_processor()
         return True
 
     def start_stream(self):
+        """
+        Open the output stream and the render thread, they then run until shutdown
+        :return:
+        """
+        if self.offline:
+            return
         if self.output_stream:
-            self.shutdown()
+            if self.processor is None or not self.processor.is_alive():
+                # the stream outlived its render thread, give it a new one
+                logger.warning("[AudioEngine] Render thread is gone, restarting it")
+                self._start_processor()
+            return
+
+        # Create and start processor first, it prefills the ring from the primed channel
+        self._start_processor()
+        self.position_publisher = PositionPublisher(self, self.position_rate)
+        self.position_publisher.start()
+        self.stats_publisher = StatsPublisher(self, self.stats_interval)
+        self.stats_publisher.start()
+
+        self.output_stream = self.output(self.sample_rate, 2, self.buffer_size, self._audio_callback,
+                                         latency=self._output_latency)
+        self.output_stream.start()
 
-        # Create and start processor first
-        self.processor = AudioProcessorThread(self, self.buffer_queue, self.buffer_size)
+    def _start_processor(self):
+        self.processor = AudioProcessorThread(self, self.ring_buffer, self.buffer_size)
         self.processor.start()
 
-        # Let buffer accumulate before starting output
-        time.sleep(self._startup_delay)
-
-        self.output_stream = sd.OutputStream(
-            samplerate=self.sample_rate,
-            channels=2,
-            blocksize=self.buffer_size,
-            callback=self._audio_callback,
-            dtype="float32",
-            latency=self._output_latency
-        )
-        self.output_stream.start()
+    def _audio_callback(self, outdata, frames, time_info, status):
+        start = time.perf_counter()
+        read = self.ring_buffer.read_into(outdata)
+        if read < frames:
+            # pad with silence in place, an underrun unless nothing is playing
+            outdata[read:].fill(0)
+            if self._end_event == 0 and self.processor and not self.processor.idle:
+                self.underruns += 1
+                self.underrun_frames += frames - read
+        if status:
+            self._count_status(status)
+        if self.processor and self.ring_buffer.below_low_watermark():
+            self.processor.signal()
+        spectrum = self.spectrum
+        if spectrum is not None:
+            # drops the block if the analyzer fell behind, never waits
+            spectrum.ring_buffer.write(outdata)
+
+        # the position is reported by the PositionPublisher thread
+        self.frames_played += read
+        self.callback_times.record(time.perf_counter() - start)
+
+    def _count_status(self, status):
+        """
+        Audio callback side. Count the flags the device reported
+        :param status: sounddevice CallbackFlags
+        :return:
+        """
+        for flag in self.status_flags:
+            if getattr(status, flag, False):
+                self.status_flags[flag] += 1
 
-    def _audio_callback(self, outdata, frames, time, status):
-        #with data_ready:
-        if not self.buffer_queue.empty():
-            data = self.buffer_queue.get_nowait()
-            outdata[:] = data
-        else:
-            logger.warning("Queue empty")
-            outdata[:] = np.zeros((self.buffer_size, 2), dtype=np.float32)
-        if self.receive_audio_buffer:
-            self.send_buffer(outdata)
+    def callback_stats(self) -> dict:
+        """
+        Time spent in the audio callback, it must stay well under a block
+        :return:
+        """
+        callback = self.callback_times.snapshot()
+        return {
+            'callbacks': callback['count'],
+            'mean_us': callback['mean_us'],
+            'max_us': callback['max_us'],
+            'block_us': self.buffer_size / self.sample_rate * 1e6
+        }
+
+    def stats(self) -> dict:
+        """
+        Snapshot of the engine's telemetry, safe to take from any thread while
+        playing. Counters are totals since the engine was created, the
+        difference of two snapshots covers the time between them
+        :return:
+        """
+        return {
+            'time': time.time(),
+            'block_us': self.buffer_size / self.sample_rate * 1e6,
+            'frames_played': self.frames_played,
+            'underruns': self.underruns,
+            'underrun_frames': self.underrun_frames,
+            'render_errors': self.render_errors,
+            'status_flags': dict(self.status_flags),
+            'callback': self.callback_times.snapshot(),
+            'render': self.render_times.snapshot(),
+            'buffer': self.buffer_stats()
+        }
+
+    def set_position_rate(self, rate: float):
+        """
+        :param rate: position reports per second
+        :return:
+        """
+        self.position_rate = rate
+        if self.position_publisher:
+            self.position_publisher.interval = 1.0 / rate
 
-        # send the position, will be using only channel no mixer here
-        if self.position_event_handler:
-            self.position_event_handler(self.get_pos(), self.get_file_length())
+    def buffer_stats(self) -> dict:
+        """
+        Output ring buffer fill statistics, used to size the ring per device
+        :return:
+        """
+        stats = self.ring_buffer.stats()
+        stats['render_wakeups'] = self.processor.wakeups if self.processor else 0
+        stats['pool_allocations'] = self.buffer_pool.allocations
+        return stats
+
+    def wake_processor(self):
+        """
+        Let the render thread know a source may have become active
+        :return:
+        """
+        if self.processor:
+            self.processor.wake()
 
-    def send_buffer(self, buffer):
-        self.receive_audio_buffer(buffer)
+    def enable_spectrum(self, handler, bands: int = 32, fps: float = 30.0, fft_size: int = 2048) -> SpectrumAnalyzer:
+        """
+        Start the spectrum analyzer tap on the output
+        :param handler: called from the analyzer thread with band levels in dB
+        :param bands: log spaced bands
+        :param fps: arrays per second
+        :param fft_size:
+        :return:
+        """
+        self.disable_spectrum()
+        spectrum = SpectrumAnalyzer(handler, self.sample_rate, fft_size, bands, fps)
+        spectrum.start()
+        self.spectrum = spectrum
+        return spectrum
 
-    def _create_channel(self, set_channel=False):
-        channel = CoreAudioChannel(self.sample_rate, self.buffer_size)
+    def disable_spectrum(self):
+        """
+        Remove the tap, the callback is back to not analysing anything. Safe from the handler
+        :return:
+        """
+        spectrum = self.spectrum
+        self.spectrum = None
+        if spectrum is not None:
+            spectrum.stop()
+
+    def _create_channel(self):
+        channel = CoreAudioChannel(self.sample_rate, self.buffer_size, self.lookahead, buffer_pool=self.buffer_pool)
+        if self.crossfade:
+            channel.set_crossfade(self.crossfade)
+        if self.normalization:
+            channel.set_normalization(self.normalization)
+        channel.pcm_cache = self.pcm_cache
         if self.mixer:
             self.mixer.add_channel(channel)
         else:
             channel.on_playback_end = self.handle_playback_end
-        # set channel if mixer is not initialized
-        if set_channel and not self.mixer:
-            self._channel = channel
 
-        self.set_volume(self._volume)
+        channel.set_volume(self._volume / 120)
         return channel
 
     def handle_playback_end(self, channel):
@@ -243,6 +482,23 @@ class CoreEngine:
         
         return self._channel.get_position()
 
+    def set_position(self, seconds: float, channel: int = None):
+        """
+        Seek, the blocks already rendered from the old position are dropped
+        :param seconds:
+        :param channel: channel index if using a mixer
+        :return:
+        """
+        if self.mixer:
+            target = self.mixer.channels[channel or 0] if self.mixer.channels else None
+        else:
+            target = self._channel
+        if target is None:
+            return
+        target.set_position(seconds)
+        self.flushes += 1
+        self.wake_processor()
+
     def get_file_length(self, channel:int=None):
         """
         Get the current file length
@@ -266,20 +522,91 @@ class CoreEngine:
                 self._channel.paused = True
                 self._set_end_event(1)
     
-    def queue_file(self, file, channel:CoreAudioChannel|int=None):
+    def queue_file(self, file, channel:CoreAudioChannel|int=None, loudness: dict = None, track_id: str = None,
+                   seek_index: bytes = None):
         """
         Queue next file for gapless playback
         :param file:
         :param channel:
+        :param loudness: see load_file
+        :param track_id: see load_file
+        :param seek_index: see load_file
         :return:
         """
         if self.mixer:
-            self.mixer.queue_to_channel(channel=channel, file=file)
+            self.mixer.queue_to_channel(channel=channel, file=file, loudness=loudness, track_id=track_id,
+                                        seek_index=seek_index)
         else:
-            error = self._channel.queue_file(file)
+            error = self._channel.queue_file(file, loudness, track_id, seek_index)
             if error:
                 self.add_error(error)
 
+    def set_crossfade(self, seconds: float):
+        """
+        Crossfade between a track and the queued one
+        :param seconds: 0 (gapless) to 12
+        :return:
+        """
+        self.crossfade = min(max(float(seconds), 0.0), CoreAudioChannel.max_crossfade)
+        if self.mixer:
+            self.mixer.set_crossfade(self.crossfade)
+        elif self._channel:
+            self._channel.set_crossfade(self.crossfade)
+
+    def enable_pcm_cache(self, directory: str, budget_bytes: int = 1 << 30, dtype: str = 'float32'):
+        """
+        Keep decoded PCM of played and upcoming tracks on disk, loads and seeks
+        of cached tracks are then memmap reads
+        :param directory:
+        :param budget_bytes:
+        :param dtype: float32 or int16
+        :return:
+        """
+        self.pcm_cache = PCMCache(directory, budget_bytes, self.sample_rate, dtype)
+        channels = self.mixer.channels if self.mixer else [self._channel] if self._channel else []
+        for channel in channels:
+            channel.pcm_cache = self.pcm_cache
+        return self.pcm_cache
+
+    def prefetch(self, items: list):
+        """
+        Decode upcoming tracks into the PCM cache in the background
+        :param items: (track_id, file_path) pairs in play order
+        :return:
+        """
+        if self.pcm_cache:
+            self.pcm_cache.prefetch(items)
+
+    def set_limiter(self, ceiling_db: float | None = -1.0, release_ms: float = 80.0):
+        """
+        Lookahead limiter as the last stage of the output, it adds up to 5 ms of latency
+        :param ceiling_db: output peak level, None removes the limiter
+        :param release_ms:
+        :return: the limiter
+        """
+        limiter = None
+        if ceiling_db is not None:
+            limiter = LookaheadLimiter(ceiling_db, release_ms=release_ms, sample_rate=self.sample_rate)
+        self.limiter = limiter
+        if self.mixer:
+            self.mixer.limiter = limiter
+        self.latency = (self.buffer_size + (limiter.latency if limiter else 0)) / self.sample_rate * 1000
+        return limiter
+
+    def set_normalization(self, mode: str = None):
+        """
+        Loudness normalization from the values measured when the library was scanned
+        :param mode: None (off), 'track' or 'album'
+        :return:
+        """
+        if mode not in (None, 'track', 'album'):
+            raise ValueError(f"Unknown normalization mode: {mode}")
+        self.normalization = mode
+        if self.mixer:
+            self.mixer.set_normalization(mode)
+        elif self._channel:
+            self._channel.set_normalization(mode)
+
     def resume(self, channel:int=None):
         if self.mixer:
             self.mixer.resume(channel)
@@ -288,15 +615,17 @@ class CoreEngine:
             if self._channel:
                 self._channel.paused = False
                 self._set_end_event(0)
+        self.wake_processor()
     
     def stop(self, shutdown=False):
         if self.mixer:
             self.mixer.stop()
-        else:
-            if self._channel.playing:
-                self._channel.playing = False
+        elif self._channel and self._channel.playing:
+            self._channel.playing = False
         if shutdown:
             self.shutdown()
+            if self.pcm_cache:
+                self.pcm_cache.close()
 
     def set_volume(self, volume, channel: CoreAudioChannel|int=None):
         """
@@ -305,17 +634,15 @@ class CoreEngine:
         :param channel:
         :return:
         """
-        if volume > 120:
-            volume = 120
-
-        volume /= 120
-
+        volume = min(max(volume, 0), 120)
+        # keep the 0-120 value, it is applied again to every new channel
         self._volume = volume
+        gain = volume / 120
         if self.mixer:
-            self.mixer.set_volume(volume, channel)
+            self.mixer.set_volume(gain, channel)
         else:
             if self._channel:
-                self._channel.set_volume(volume)
+                self._channel.set_volume(gain)
 
     def _set_end_event(self, val):
         self._end_event = val
@@ -337,14 +664,23 @@ class CoreEngine:
             self.output_stream.stop()
             self.output_stream.close()
             self.output_stream = None
+        if self.position_publisher:
+            self.position_publisher.stop()
+            self.position_publisher = None
+        if self.stats_publisher:
+            self.stats_publisher.stop()
+            self.stats_publisher = None
+        self.disable_spectrum()
         if self.processor:
             self.processor.stop()
-            # self.processor.join()
-
-        while not self.buffer_queue.empty():
-            try:
-                self.buffer_queue.get_nowait()
-            except queue.Empty:
-                break
-
-        gc.collect()
+            self.processor.join(timeout=1.0)
+            # channels swapped out but never taken by the render thread
+            retired = [self.processor.channel, *self.swaps]
+            self.swaps.clear()
+            for channel in retired:
+                if channel is not None and channel is not self._channel:
+                    channel.close()
+            self.processor = None
+
+        # both sides are stopped, safe to drop stale audio
+        self.ring_buffer.clear()
@@ -0,0 +1,132 @@
+import io
+import os
+
+import soundfile as sf
+
+from core.utility.mp3_index import FrameIndex
+
+
+class OffsetReader(io.RawIOBase):
+    """
+    A file seen from a byte offset on, optionally behind a prefix, so the
+    decoder starts at a frame boundary without reading what comes before it
+    """
+
+    def __init__(self, path: str, offset: int, prefix: bytes = b''):
+        """
+        :param path:
+        :param offset:
+        :param prefix: bytes presented before the data at offset
+        """
+        super().__init__()
+        self._file = open(path, 'rb')
+        self._prefix = prefix
+        self._offset = offset
+        self._length = len(prefix) + self._file.seek(0, io.SEEK_END) - offset
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        count = 0
+        if self._position < len(self._prefix):
+            head = self._prefix[self._position:self._position + len(view)]
+            view[:len(head)] = head
+            count = len(head)
+        if count < len(view):
+            self._file.seek(self._offset + self._position + count - len(self._prefix))
+            count += self._file.readinto(view[count:])
+        self._position += count
+        return count
+
+    def seek(self, position, whence=io.SEEK_SET):
+        base = (0, self._position, self._length)[whence]
+        self._position = max(base + position, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+class IndexedMP3File:
+    """
+    An MP3 opened with its precomputed frame index. Seeks start a decoder at
+    the indexed frame just before the target and drop the few frames up to
+    it, instead of letting libsndfile scan the stream. Reads and metadata go
+    through the SoundFile it wraps.
+    """
+    preroll = 2  # frames decoded before the target to fill the bit reservoir
+
+    def __init__(self, path: str, index: FrameIndex | bytes):
+        """
+        :param path:
+        :param index: FrameIndex or its stored bytes
+        """
+        self.name = path
+        self.index = FrameIndex.from_bytes(index) if isinstance(index, (bytes, bytearray, memoryview)) else index
+        self._file = sf.SoundFile(path, 'r')
+        self._reader = None
+        self.frames = self._file.frames
+        self.samplerate = self._file.samplerate
+        self.channels = self._file.channels
+        self._size = os.path.getsize(path)
+        self._base = 0  # frame of the stream self._file starts at
+        self.closed = False
+
+    def read(self, frames: int = -1, dtype: str = 'float32', always_2d: bool = True):
+        """
+        :param frames:
+        :param dtype:
+        :param always_2d:
+        :return:
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        # decoding from a cut stream does not trim the encoder padding at the end
+        remaining = self.frames - self.tell()
+        frames = remaining if frames < 0 else min(frames, remaining)
+        return self._file.read(frames, dtype=dtype, always_2d=always_2d)
+
+    def seek(self, frame: int, whence: int = 0):
+        """
+        :param frame:
+        :param whence: 0 from start, 1 from current, 2 from end
+        :return: new position
+        """
+        target = (0, self.tell(), self.frames)[whence] + frame
+        if not 0 <= target <= self.frames:
+            raise ValueError("Invalid seek position")
+
+        offset, skip = self.index.locate(target, self.preroll)
+        reader = OffsetReader(self.name, offset, self.index.stream_header(offset, self._size))
+        stream = sf.SoundFile(reader, 'r')
+        # decode forward from the frame boundary to the target
+        while skip > 0:
+            dropped = len(stream.read(min(skip, 1 << 16), dtype='float32'))
+            if not dropped:
+                break
+            skip -= dropped
+        self.close()
+        self._file, self._reader = stream, reader
+        self.closed = False
+        self._base = target - stream.tell()
+        return target
+
+    def tell(self):
+        return self._base + self._file.tell()
+
+    def close(self):
+        self._file.close()
+        if self._reader is not None:
+            # SoundFile does not close file objects it was given
+            self._reader.close()
+        self.closed = True
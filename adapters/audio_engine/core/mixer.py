@@ -1,26 +1,209 @@
 import threading
+from collections import deque
+
 import numpy as np
 from adapters.audio_engine.core.channel import CoreAudioChannel
+from adapters.audio_engine.effects.chain import EffectChain
+from adapters.audio_engine.utils.buffer_pool import BufferPool
+from adapters.audio_engine.utils.render_pool import RenderPool, default_render_workers
+from adapters.audio_engine.utils.smoothing import SmoothedParameter
+
+
+class MixBus:
+    """
+    A submix. The channels sent to it are summed first and its effects run
+    once on the sum, so a shared reverb costs the same for one channel or
+    sixty four. Bus 0 of a mixer is the master, the others feed into it.
+    """
+
+    def __init__(self, name: str, effects: EffectChain = None, gain: float = 1.0, sample_rate=44100,
+                 buffer_size=512):
+        """
+        :param name:
+        :param effects: run on the bus sum
+        :param gain: level into the master bus, ramped when changed
+        :param sample_rate:
+        :param buffer_size:
+        """
+        self.name = name
+        self.effects = effects if effects is not None else EffectChain()
+        self._gain = SmoothedParameter(gain, CoreAudioChannel.gain_ramp_time, sample_rate, buffer_size)
+        self.sample_rate = sample_rate
+
+    @property
+    def gain(self):
+        return self._gain.target
+
+    @gain.setter
+    def gain(self, value):
+        self._gain.set(float(value))
+
+    def process(self, data: np.ndarray) -> np.ndarray:
+        """
+        Gain then effects, in place
+        :param data: the bus sum
+        :return:
+        """
+        SmoothedParameter.apply(data, self._gain.next_block(len(data)))
+        if self.effects:
+            processed = self.effects.process(data, self.sample_rate)
+            if processed is not data:
+                np.copyto(data, processed)
+        return data
 
 
 class CoreMixer:
+    """
+    Renders every channel into a row of a preallocated (channels, frames, 2)
+    block and mixes the rows into the buses with one matrix product, gains
+    being a (buses, channels) send matrix. Volume, pan and fades stay per
+    channel where they are ramped per sample.
+
+    The channels of a block can render on a RenderPool, each into its own
+    row. A channel owns its decoder, effects and row, so the threads share
+    nothing until the product, which runs once they are all done. Channels
+    ending during the block are finished after it on the render thread.
+    """
 
-    def __init__(self, sample_rate=44100, buffer_size=512, end_event_reached=None):
+    def __init__(self, sample_rate=44100, buffer_size=512, end_event_reached=None, buffer_pool: BufferPool = None,
+                 render_workers: int = None):
+        """
+        :param sample_rate:
+        :param buffer_size:
+        :param end_event_reached: called with (channel, True) when a channel plays to its end
+        :param buffer_pool:
+        :param render_workers: threads rendering channels besides the render thread, None starts
+            some only on a free-threaded build, where they run in parallel
+        """
         self.buffer_size = buffer_size
         self.sample_rate = sample_rate
+        self.buffer_pool = buffer_pool if buffer_pool else BufferPool(buffer_size, count=2)
         self.channels = []
-        self.lock = threading.Lock()
+        self.buses = [MixBus('master', sample_rate=sample_rate, buffer_size=buffer_size)]
+        # reentrant, a channel ending inside get_next_buffer calls back into the mixer
+        self.lock = threading.RLock()
         self.end_event = 1  # 0 playing, 1 stopped, 2 paused
         self.emit_end_event = end_event_reached
+        # final stage, the mix is hard clipped without one
+        self.limiter = None
+        if render_workers is None:
+            render_workers = default_render_workers()
+        self.render_pool = RenderPool(render_workers, "MixerRender") if render_workers > 0 else None
+        # channels that reached their end during a block, from any render thread
+        self._ended = deque()
+
+        # send gain of each channel into each bus, a new channel goes to the master
+        self._sends = np.zeros((1, 0), dtype=np.float32)
+        self._rows = np.zeros((0, buffer_size, 2), dtype=np.float32)
+        self._bus_rows = np.zeros((1, buffer_size, 2), dtype=np.float32)
+        self._silent = []  # rows left at zero by channels that are not playing
+        self._bus_used = [True]
+        self._resize()
+
+    def _resize(self):
+        """
+        Reallocate the render rows and send matrix for the current channels
+        and buses, keeping the sends. Caller holds self.lock
+        :return:
+        """
+        channels, buses = len(self.channels), len(self.buses)
+        sends = np.zeros((buses, channels), dtype=np.float32)
+        kept_buses, kept_channels = min(buses, self._sends.shape[0]), min(channels, self._sends.shape[1])
+        sends[:kept_buses, :kept_channels] = self._sends[:kept_buses, :kept_channels]
+        sends[0, kept_channels:] = 1.0
+        self._sends = sends
+        self._rows = np.zeros((channels, self.buffer_size, 2), dtype=np.float32)
+        self._bus_rows = np.zeros((buses, self.buffer_size, 2), dtype=np.float32)
+        # flat views for the product, (channels, frames * 2) and (buses, frames * 2)
+        self._rows_flat = self._rows.reshape(channels, self.buffer_size * 2)
+        self._bus_flat = self._bus_rows.reshape(buses, self.buffer_size * 2)
+        self._silent = [True] * channels
+        self._update_bus_use()
+
+    def _update_bus_use(self):
+        # buses nothing is sent to are skipped, their effects included
+        self._bus_used = [index == 0 or bool(self._sends[index].any()) for index in range(len(self.buses))]
 
     def add_channel(self, channel):
         with self.lock:
             if channel not in self.channels:
                 self.channels.append(channel)
+                self._resize()
                 # Set the callback for playback end
                 channel.on_playback_end = self.handle_playback_end
 
+    def _channel_index(self, channel: CoreAudioChannel | int) -> int:
+        index = channel if isinstance(channel, int) else self.channels.index(channel)
+        if not 0 <= index < len(self.channels):
+            raise IndexError(f"Channel {channel} does not exist")
+        return index
+
+    def _bus_index(self, bus: MixBus | int) -> int:
+        index = bus if isinstance(bus, int) else self.buses.index(bus)
+        if not 0 <= index < len(self.buses):
+            raise IndexError(f"Bus {bus} does not exist")
+        return index
+
+    def add_bus(self, name: str, effects: EffectChain = None, gain: float = 1.0) -> MixBus:
+        """
+        Add a submix bus feeding the master
+        :param name:
+        :param effects: run once on the bus sum, e.g. a shared reverb
+        :param gain:
+        :return:
+        """
+        bus = MixBus(name, effects, gain, self.sample_rate, self.buffer_size)
+        with self.lock:
+            self.buses.append(bus)
+            self._resize()
+        return bus
+
+    def remove_bus(self, bus: MixBus | int):
+        """
+        Remove a submix bus, what was sent to it is lost. The master stays
+        :param bus:
+        :return:
+        """
+        with self.lock:
+            index = self._bus_index(bus)
+            if index == 0:
+                raise ValueError("The master bus cannot be removed")
+            self.buses.pop(index)
+            self._sends = np.delete(self._sends, index, axis=0)
+            self._resize()
+
+    def set_send(self, channel: CoreAudioChannel | int, bus: MixBus | int, gain: float):
+        """
+        Level of a channel into a bus, sends to other buses are kept
+        :param channel: channel or channel index
+        :param bus: bus or bus index, 0 is the master
+        :param gain: 0 removes the send
+        :return:
+        """
+        with self.lock:
+            self._sends[self._bus_index(bus), self._channel_index(channel)] = gain
+            self._update_bus_use()
+
+    def route(self, channel: CoreAudioChannel | int, bus: MixBus | int):
+        """
+        Send a channel to one bus only, at unity
+        :param channel:
+        :param bus:
+        :return:
+        """
+        with self.lock:
+            index = self._channel_index(channel)
+            self._sends[:, index] = 0.0
+            self._sends[self._bus_index(bus), index] = 1.0
+            self._update_bus_use()
+
     def add_effects(self, effects:list, channel:int=0):
+        """
+        Append effects to a channel's chain
+        :param effects: effects, EffectNodes or an EffectChain
+        :param channel: channel index
+        :return:
+        """
         with self.lock:
             if self.channels:
                 try:
@@ -28,6 +211,18 @@ class CoreMixer:
                     source.add_effects(effects)
                 except Exception as e:
                     print(f"[Mixer] Add effects to channel: {channel} failed, error: {e}")
+
+    def effect_stats(self, channel:int=0) -> list:
+        """
+        Per effect cost of a channel, microseconds per block
+        :param channel: channel index
+        :return:
+        """
+        with self.lock:
+            if 0 <= channel < len(self.channels):
+                return self.channels[channel].effects.stats()
+            return []
+
     def clear_channels(self):
         """
         Remove all channels
@@ -37,16 +232,51 @@ class CoreMixer:
             for channel in self.channels:
                 channel.close()
             self.channels.clear()
+            self._resize()
 
-    def get_next_buffer(self):
-        mix_buffer = np.zeros((self.buffer_size, 2), dtype=np.float32)
+    def get_next_buffer(self, out: np.ndarray = None):
+        """
+        Mix all playing channels into out, in place
+        :param out: block to render into, a new one is allocated if not given
+        :return:
+        """
+        mix_buffer = out if out is not None else np.empty((self.buffer_size, 2), dtype=np.float32)
         with self.lock:
-            for channel in self.channels:
-                if channel.playing:
-                    data = channel.get_next_buffer()
-                    mix_buffer += data
+            if self.render_pool is not None:
+                self.render_pool.run(self._render_channel, len(self.channels))
+            else:
+                for index in range(len(self.channels)):
+                    self._render_channel(index)
+            while self._ended:
+                self._finish_channel(self._ended.popleft())
+
+            # every bus sum in one product, (buses, channels) x (channels, frames * 2)
+            np.matmul(self._sends, self._rows_flat, out=self._bus_flat)
 
-        return np.clip(mix_buffer, -1.0, 1.0)
+            master = self._bus_rows[0]
+            for index in range(1, len(self.buses)):
+                if self._bus_used[index]:
+                    np.add(master, self.buses[index].process(self._bus_rows[index]), out=master)
+            self.buses[0].process(master)
+            np.copyto(mix_buffer, master)
+
+            if self.limiter is not None:
+                return self.limiter.process(mix_buffer)
+        return np.clip(mix_buffer, -1.0, 1.0, out=mix_buffer)
+
+    def _render_channel(self, index: int):
+        """
+        Render a channel into its row, may run on a RenderPool thread. Caller holds self.lock
+        :param index:
+        :return:
+        """
+        channel = self.channels[index]
+        if channel.playing:
+            channel.get_next_buffer(out=self._rows[index])
+            self._silent[index] = False
+        elif not self._silent[index]:
+            self._rows[index].fill(0)
+            self._silent[index] = True
 
     def get_active_channel(self):
         """
@@ -56,6 +286,14 @@ class CoreMixer:
         with self.lock:
             return [channel for channel in self.channels if channel.playing]
 
+    def has_audible_channel(self):
+        """
+        True if any channel is playing and not paused
+        :return:
+        """
+        with self.lock:
+            return any(channel.playing and not channel.paused for channel in self.channels)
+
     def get_loaded_channels(self):
         """
         :return:
@@ -64,6 +302,11 @@ class CoreMixer:
             return [channel for channel in self.channels if channel.audio_file]
 
     def handle_playback_end(self, channel):
+        # called by the channel from whichever thread rendered it, the end
+        # handler calls back into the mixer so it waits for the block to finish
+        self._ended.append(channel)
+
+    def _finish_channel(self, channel):
         channel.playing = False
         channel.position = 0
         print(f"[Mixer] Channel {self.channels.index(channel)} playback finished.")
@@ -114,21 +357,24 @@ class CoreMixer:
         else:
             return 0.0
 
-    def load_file_to_channel(self, channel:CoreAudioChannel|int, file):
+    def load_file_to_channel(self, channel:CoreAudioChannel|int, file, loudness: dict = None, track_id: str = None,
+                             seek_index: bytes = None):
         """
         :param channel: CorAudioChannel or channel index
         :param file:
+        :param loudness: scan time loudness, see CoreAudioChannel.load_file
+        :param track_id: PCM cache key
+        :param seek_index: MP3 frame index
         :return:
         """
         if isinstance(channel, CoreAudioChannel):
-            if channel not in self.channels:
-                self.channels.append(channel)
-            channel.load_file(file)
+            self.add_channel(channel)
+            channel.load_file(file, loudness, track_id, seek_index)
             return channel.do_not_play
         elif isinstance(channel, int):
             try:
                 source = self.channels[channel]
-                source.load_file(file)
+                source.load_file(file, loudness, track_id, seek_index)
                 return source.do_not_play
             except Exception as e:
                 print("[Mixer] Could not load channel: {} error: {}".format(channel, e))
@@ -164,18 +410,22 @@ class CoreMixer:
             print("[Mixer] Cannot play channel: {} Error: ".format(channel_index, e))
             return False
 
-    def queue_to_channel(self, channel:CoreAudioChannel|int, file):
+    def queue_to_channel(self, channel:CoreAudioChannel|int, file, loudness: dict = None, track_id: str = None,
+                         seek_index: bytes = None):
         """
         :param channel:
         :param file: str|StrPath
+        :param loudness:
+        :param track_id:
+        :param seek_index:
         :return:
         """
         if isinstance(channel, int):
             if 0 <= channel < len(self.channels):
                 channel = self.channels[channel]
-                channel.queue_file(file)
+                channel.queue_file(file, loudness, track_id, seek_index)
         elif isinstance(channel, CoreAudioChannel):
-            channel.queue_file(file)
+            channel.queue_file(file, loudness, track_id, seek_index)
 
     def remove_channel(self, channel:CoreAudioChannel|int):
         """
@@ -184,12 +434,14 @@ class CoreMixer:
         :return:
         """
         with self.lock:
-            if isinstance(channel, CoreAudioChannel):
-                if channel in self.channels:
-                    self.channels.remove(channel)
-            elif isinstance(channel, int):
-                if 0 <= channel < len(self.channels):
-                    self.channels.pop(channel)
+            if not isinstance(channel, int):
+                if channel not in self.channels:
+                    return
+                channel = self.channels.index(channel)
+            if 0 <= channel < len(self.channels):
+                self.channels.pop(channel)
+                self._sends = np.delete(self._sends, channel, axis=1)
+                self._resize()
 
     def resume(self, channel:int=None):
         """
@@ -207,6 +459,33 @@ class CoreMixer:
                     channel.resume()
                 print("[Mixer] All channels resumed")
     
+    def set_crossfade(self, seconds, channel:int=None):
+        """
+        Crossfade length into queued files
+        :param seconds:
+        :param channel: channel index, all channels if None
+        :return:
+        """
+        with self.lock:
+            if channel is None:
+                for source in self.channels:
+                    source.set_crossfade(seconds)
+            elif 0 <= channel < len(self.channels):
+                self.channels[channel].set_crossfade(seconds)
+
+    def set_normalization(self, mode: str = None, channel: int = None):
+        """
+        :param mode: None, 'track' or 'album'
+        :param channel: channel index, all channels if None
+        :return:
+        """
+        with self.lock:
+            if channel is None:
+                for source in self.channels:
+                    source.set_normalization(mode)
+            elif 0 <= channel < len(self.channels):
+                self.channels[channel].set_normalization(mode)
+
     def set_volume(self, volume, channel:CoreAudioChannel|int=None):
         """
         Set volume
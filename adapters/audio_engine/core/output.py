@@ -0,0 +1,280 @@
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+from core import logger
+
+try:
+    import sounddevice as sd
+except (ImportError, OSError):
+    # not installed, or PortAudio is missing on a headless machine
+    sd = None
+
+
+class OutputBackend:
+    """
+    Where the engine's audio goes. Started as a stream a backend calls
+    callback(outdata, frames, time_info, status) for every block, as a
+    sounddevice.OutputStream does, and the engine fills outdata. The
+    OfflineRenderer hands it blocks through write() instead.
+    """
+
+    def __init__(self, sample_rate=44100, channels=2, blocksize=512, callback=None, latency=None):
+        """
+        :param sample_rate:
+        :param channels:
+        :param blocksize: frames per callback
+        :param callback:
+        :param latency: device latency, backends without a device ignore it
+        """
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.callback = callback
+        self.latency = latency
+
+    @property
+    def active(self) -> bool:
+        return False
+
+    def start(self):
+        """
+        Start calling the callback, backends that are only written to have nothing to start
+        :return:
+        """
+        ...
+
+    def stop(self):
+        pass
+
+    def write(self, data: np.ndarray):
+        """
+        Offline rendering, one block of output
+        :param data: (frames, channels) float32
+        :return:
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not take written blocks")
+
+    def close(self):
+        self.stop()
+
+
+class SoundDeviceOutput(OutputBackend):
+    """
+    The default audio device, through sounddevice
+    """
+
+    def __init__(self, sample_rate=44100, channels=2, blocksize=512, callback=None, latency='low'):
+        super().__init__(sample_rate, channels, blocksize, callback, latency)
+        if sd is None:
+            raise RuntimeError("sounddevice is not available, use NullOutput or WavFileOutput")
+        self.stream = sd.OutputStream(samplerate=sample_rate, channels=channels, blocksize=blocksize,
+                                      callback=callback, dtype="float32", latency=latency)
+
+    @property
+    def active(self) -> bool:
+        return self.stream.active
+
+    def start(self):
+        self.stream.start()
+
+    def stop(self):
+        self.stream.stop()
+
+    def close(self):
+        self.stream.close()
+
+
+class NullOutput(OutputBackend):
+    """
+    Discards the audio, for machines without a sound card. As a stream a
+    thread calls the callback on a virtual clock, a block every block
+    period like a device, or back to back with realtime=False. The clock
+    only advances by the frames consumed so timings do not depend on the
+    machine.
+    """
+
+    def __init__(self, sample_rate=44100, channels=2, blocksize=512, callback=None, latency=None,
+                 realtime: bool = True):
+        """
+        :param sample_rate:
+        :param channels:
+        :param blocksize:
+        :param callback:
+        :param latency: unused
+        :param realtime: pace the callbacks to the wall clock
+        """
+        super().__init__(sample_rate, channels, blocksize, callback, latency)
+        self.realtime = realtime
+        self.frames = 0
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def time(self) -> float:
+        """
+        Seconds of audio consumed
+        :return:
+        """
+        return self.frames / self.sample_rate
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.active:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=type(self).__name__)
+        self._thread.start()
+
+    def _run(self):
+        block = np.zeros((self.blocksize, self.channels), dtype=np.float32)
+        period = self.blocksize / self.sample_rate
+        deadline = time.perf_counter()
+        while not self._stop_event.is_set():
+            try:
+                self.callback(block, self.blocksize, None, None)
+                self.write(block)
+            except Exception as e:
+                logger.error(f"[{type(self).__name__}] {e}")
+                return
+            if self.realtime:
+                deadline += period
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    self._stop_event.wait(delay)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def write(self, data: np.ndarray):
+        self.frames += len(data)
+
+
+class WavFileOutput(NullOutput):
+    """
+    Writes the audio to a file instead of a device, 32 bit float by default
+    so the engine's output is kept bit for bit
+    """
+
+    def __init__(self, path: str, sample_rate=44100, channels=2, blocksize=512, callback=None, latency=None,
+                 realtime: bool = True, subtype: str = 'FLOAT'):
+        """
+        :param path: overwritten
+        :param sample_rate:
+        :param channels:
+        :param blocksize:
+        :param callback:
+        :param latency: unused
+        :param realtime: see NullOutput
+        :param subtype: soundfile subtype
+        """
+        super().__init__(sample_rate, channels, blocksize, callback, latency, realtime)
+        self.path = path
+        self.file = sf.SoundFile(path, 'w', samplerate=sample_rate, channels=channels, subtype=subtype)
+
+    def write(self, data: np.ndarray):
+        self.file.write(data)
+        self.frames += len(data)
+
+    def close(self):
+        self.stop()
+        if not self.file.closed:
+            self.file.close()
+
+
+def default_output():
+    """
+    :return: the backend class the engine opens when none is given
+    """
+    if sd is None:
+        logger.warning("[AudioEngine] sounddevice is not available, audio goes to a null output")
+        return NullOutput
+    return SoundDeviceOutput
+
+
+class OfflineRenderer:
+    """
+    Runs the engine's render path on the calling thread as fast as it goes,
+    with no device, ring buffer or render thread, and writes every block to
+    an output. Channel decoders are topped up on this thread before each
+    block, so no block comes out short because a decoder thread fell behind
+    and two renders of the same input give the same samples.
+
+    The engine must be created with offline=True so play() does not open
+    a stream.
+    """
+
+    def __init__(self, engine, output: OutputBackend = None):
+        """
+        :param engine: CoreEngine
+        :param output: gets every block, a NullOutput by default
+        """
+        self.engine = engine
+        self.output = output or NullOutput(engine.sample_rate, 2, engine.buffer_size)
+        self.frames = 0
+        self.elapsed = 0.0
+
+    def _active_source(self):
+        """
+        The mixer or the lone channel, as the render thread picks them
+        :return: None if nothing is audible
+        """
+        mixer = self.engine.mixer
+        if mixer and mixer.has_audible_channel():
+            return mixer
+        channel = self.engine._channel
+        if channel and channel.playing and not channel.paused:
+            return channel
+        return None
+
+    def _prime(self, source):
+        channels = source.channels if source is self.engine.mixer else (source,)
+        for channel in channels:
+            if getattr(channel, 'playing', False) and hasattr(channel, 'prime'):
+                channel.prime()
+
+    def render(self, seconds: float = None) -> dict:
+        """
+        :param seconds: audio to render, None renders until nothing is audible
+        :return: {'frames', 'seconds', 'elapsed', 'realtime_factor'}, audio seconds per second taken
+        """
+        engine = self.engine
+        limit = None if seconds is None else int(seconds * engine.sample_rate)
+        buffer = engine.buffer_pool.acquire()
+        frames = 0
+        start = time.perf_counter()
+        try:
+            while limit is None or frames < limit:
+                source = self._active_source()
+                if source is None:
+                    break
+                self._prime(source)
+                block_start = time.perf_counter()
+                source.get_next_buffer(out=buffer)
+                if source is engine._channel and engine.limiter is not None:
+                    engine.limiter.process(buffer)
+                engine.render_times.record(time.perf_counter() - block_start)
+                count = len(buffer) if limit is None else min(len(buffer), limit - frames)
+                self.output.write(buffer[:count])
+                frames += count
+                engine.frames_played += count
+        finally:
+            engine.buffer_pool.release(buffer)
+        elapsed = time.perf_counter() - start
+        self.frames += frames
+        self.elapsed += elapsed
+        audio = frames / engine.sample_rate
+        return {
+            'frames': frames,
+            'seconds': audio,
+            'elapsed': elapsed,
+            'realtime_factor': audio / elapsed if elapsed else float('inf')
+        }
@@ -0,0 +1,248 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import soundfile as sf
+
+from adapters.audio_engine.utils.resampler import StreamingResampler, resample_factors
+from core import logger
+
+
+class CachedPCMFile:
+    """
+    Decoded PCM in the cache, read through a memmap. Has the part of the
+    SoundFile interface the decoder uses, reads are slices of the map and
+    seeks only move an index.
+    """
+
+    def __init__(self, path: str, samplerate: int, channels: int, dtype: str = 'float32'):
+        """
+        :param path: cache file
+        :param samplerate: rate the PCM was stored at, the engine rate
+        :param channels:
+        :param dtype: float32 or int16
+        """
+        self.name = path
+        self.samplerate = samplerate
+        self.channels = channels
+        self._data = np.memmap(path, dtype=dtype, mode='r').reshape(-1, channels)
+        self.frames = len(self._data)
+        self._position = 0
+        self.closed = False
+
+    def read(self, frames: int = -1, dtype: str = 'float32', always_2d: bool = True):
+        """
+        :param frames: -1 reads to the end
+        :param dtype: float32 only
+        :param always_2d: ignored, blocks are always (frames, channels)
+        :return: a view of the map for float32 storage
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        end = self.frames if frames < 0 else min(self._position + frames, self.frames)
+        block = self._data[self._position:end]
+        self._position = end
+        if block.dtype == np.int16:
+            return block.astype(np.float32) * (1.0 / 32768)
+        return np.asarray(block)
+
+    def seek(self, frame: int, whence: int = 0):
+        """
+        :param frame:
+        :param whence: 0 from start, 1 from current, 2 from end
+        :return: new position
+        """
+        base = (0, self._position, self.frames)[whence]
+        position = base + frame
+        if not 0 <= position <= self.frames:
+            raise ValueError("Invalid seek position")
+        self._position = position
+        return position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        # the map is dropped with the object, other readers may share the file
+        self.closed = True
+
+
+class PCMCache:
+    """
+    On-disk cache of files decoded to PCM at the engine sample rate, keyed by
+    track id and file mtime so an edited file is decoded again. Entries are
+    evicted least recently used first once the byte budget is exceeded, use
+    is tracked through the entry file's mtime.
+    """
+    extension = '.pcm'
+
+    def __init__(self, directory: str, budget_bytes: int = 1 << 30, sample_rate: int = 44100,
+                 dtype: str = 'float32', block_frames: int = 1 << 16):
+        """
+        :param directory:
+        :param budget_bytes: disk space the cache may use
+        :param sample_rate: engine sample rate
+        :param dtype: float32, or int16 for half the space
+        :param block_frames: frames decoded at a time when populating
+        """
+        if dtype not in ('float32', 'int16'):
+            raise ValueError(f"Unsupported cache dtype: {dtype}")
+        self.directory = directory
+        self.budget_bytes = budget_bytes
+        self.sample_rate = sample_rate
+        self.dtype = dtype
+        self.block_frames = block_frames
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self._pending = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="PCMCache")
+
+    def _entry_prefix(self, track_id: str, file_path: str):
+        mtime = os.stat(file_path).st_mtime_ns
+        return f"{track_id}-{mtime}-{self.sample_rate}-{self.dtype}-"
+
+    def _find(self, prefix: str):
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith(self.extension):
+                return name
+        return None
+
+    def open(self, track_id: str, file_path: str) -> CachedPCMFile | None:
+        """
+        :param track_id:
+        :param file_path: source file, its mtime is part of the key
+        :return: None on a miss
+        """
+        try:
+            name = self._find(self._entry_prefix(track_id, file_path))
+            if name is None:
+                return None
+            path = os.path.join(self.directory, name)
+            channels = int(name[:-len(self.extension)].rsplit('-', 1)[1])
+            # mark as recently used
+            os.utime(path)
+            return CachedPCMFile(path, self.sample_rate, channels, self.dtype)
+        except (OSError, ValueError) as e:
+            logger.warning(f"[PCM Cache] Cannot open cache entry of {file_path}: {e}")
+            return None
+
+    def contains(self, track_id: str, file_path: str) -> bool:
+        """
+        :param track_id:
+        :param file_path:
+        :return:
+        """
+        try:
+            return self._find(self._entry_prefix(track_id, file_path)) is not None
+        except OSError:
+            return False
+
+    def populate(self, track_id: str, file_path: str):
+        """
+        Decode file_path into the cache, on the calling thread
+        :param track_id:
+        :param file_path:
+        :return: cache file path
+        """
+        prefix = self._entry_prefix(track_id, file_path)
+        existing = self._find(prefix)
+        if existing:
+            return os.path.join(self.directory, existing)
+
+        with sf.SoundFile(file_path, 'r') as audio_file:
+            channels = audio_file.channels
+            path = os.path.join(self.directory, f"{prefix}{channels}{self.extension}")
+            partial = path + '.part'
+            resampler = StreamingResampler(*resample_factors(self.sample_rate, audio_file.samplerate),
+                                           channels=channels)
+            with open(partial, 'wb') as out:
+                for block in audio_file.blocks(blocksize=self.block_frames, dtype='float32', always_2d=True):
+                    block = resampler.process(block)
+                    if self.dtype == 'int16':
+                        block = (np.clip(block, -1.0, 32767 / 32768) * 32768).astype(np.int16)
+                    out.write(np.ascontiguousarray(block).tobytes())
+        # readers only ever see complete entries
+        os.replace(partial, path)
+        self.evict(keep=path)
+        return path
+
+    def prefetch(self, items: list):
+        """
+        Populate entries in the background, in order
+        :param items: (track_id, file_path) pairs, e.g. the next tracks in the queue
+        :return:
+        """
+        for track_id, file_path in items:
+            with self.lock:
+                if (track_id, file_path) in self._pending:
+                    continue
+                self._pending.add((track_id, file_path))
+            self._executor.submit(self._prefetch_one, track_id, file_path)
+
+    def _prefetch_one(self, track_id, file_path):
+        try:
+            self.populate(track_id, file_path)
+        except Exception as e:
+            logger.warning(f"[PCM Cache] Cannot cache {file_path}: {e}")
+        finally:
+            with self.lock:
+                self._pending.discard((track_id, file_path))
+
+    def size(self) -> int:
+        """
+        :return: bytes used by complete entries
+        """
+        return sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.extension):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def evict(self, keep: str = None):
+        """
+        Remove least recently used entries until the cache fits its budget
+        :param keep: entry that must stay, the one just written
+        :return: bytes freed
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        freed = 0
+        for _, path, size in entries:
+            if total - freed <= self.budget_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                freed += size
+            except OSError:
+                # still mapped on platforms that do not allow removing it
+                continue
+        return freed
+
+    def clear(self):
+        """
+        :return:
+        """
+        for _, path, _ in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def close(self):
+        """
+        Stop the background worker, pending entries are dropped
+        :return:
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
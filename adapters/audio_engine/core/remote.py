@@ -0,0 +1,396 @@
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from adapters.audio_engine.core.engine import CoreEngine
+from core import logger
+
+# shared block layout, float64 slots then the spectrum bands as float32.
+# Each section has one writer in the engine process and starts with a
+# sequence number, odd while the writer is in it
+_POSITION = slice(0, 3)  # sequence, elapsed, total
+_SPECTRUM_SEQUENCE = 3
+_HEADER_SLOTS = 4
+MAX_BANDS = 128
+CALL_TIMEOUT = 10.0  # seconds
+_READ_ATTEMPTS = 1000
+
+
+class SharedState:
+    """
+    Position and meter data of the engine process, in shared memory. The
+    engine process writes it from its publisher threads, the UI process
+    polls it, nothing goes through the pipe and neither side takes a lock.
+    """
+
+    def __init__(self, name: str = None):
+        """
+        :param name: block to attach to, a new one is created if None
+        """
+        size = _HEADER_SLOTS * 8 + MAX_BANDS * 4
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.header = np.ndarray(_HEADER_SLOTS, dtype=np.float64, buffer=self.memory.buf)
+        self.bands = np.ndarray(MAX_BANDS, dtype=np.float32, buffer=self.memory.buf, offset=_HEADER_SLOTS * 8)
+        if name is None:
+            self.header.fill(0)
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def write_position(self, elapsed: float, total: float):
+        header = self.header
+        header[0] += 1
+        header[1], header[2] = elapsed, total
+        header[0] += 1
+
+    def read_position(self):
+        """
+        :return: (sequence, elapsed, total), retried while the writer is in the section
+        """
+        header = self.header
+        for _ in range(_READ_ATTEMPTS):
+            sequence, elapsed, total = header[_POSITION]
+            if sequence % 2 == 0 and header[0] == sequence:
+                break
+        return sequence, float(elapsed), float(total)
+
+    def write_bands(self, bands: np.ndarray):
+        header = self.header
+        header[_SPECTRUM_SEQUENCE] += 1
+        self.bands[:len(bands)] = bands
+        header[_SPECTRUM_SEQUENCE] += 1
+
+    def read_bands(self, count: int):
+        """
+        :param count: bands the analyzer was started with
+        :return: (sequence, bands copy)
+        """
+        header = self.header
+        for _ in range(_READ_ATTEMPTS):
+            sequence = header[_SPECTRUM_SEQUENCE]
+            bands = self.bands[:count].copy()
+            if sequence % 2 == 0 and header[_SPECTRUM_SEQUENCE] == sequence:
+                break
+        return sequence, bands
+
+    def close(self, unlink: bool = False):
+        # the views hold the buffer, drop them first
+        self.header = self.bands = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+class EngineServer:
+    """
+    Engine process side. Runs a CoreEngine, answers the calls that come
+    through the pipe on its main thread and sends the engine's events back.
+    Position and spectrum go to the shared block instead.
+    """
+    overrides = ('register_stats_event', 'enable_spectrum', 'enable_pcm_cache')
+
+    def __init__(self, conn, state: SharedState, engine_kwargs: dict):
+        self.conn = conn
+        self.state = state
+        self._send_lock = threading.Lock()
+        self.engine = CoreEngine(**engine_kwargs)
+        self.engine.register_end_event(lambda value: self.send_event('end', value))
+        self.engine.register_playback_event(lambda value: self.send_event('playback', value))
+        self.engine.register_error_event(lambda error: self.send_event('error', error))
+        self.engine.register_position_event(state.write_position)
+
+    def send_event(self, name: str, *args):
+        with self._send_lock:
+            self.conn.send(('event', name, args))
+
+    def register_stats_event(self, interval: float):
+        self.engine.register_stats_event(lambda stats: self.send_event('stats', stats), interval)
+
+    def enable_spectrum(self, bands: int = 32, fps: float = 30.0, fft_size: int = 2048):
+        self.engine.enable_spectrum(self.state.write_bands, min(bands, MAX_BANDS), fps, fft_size)
+
+    def enable_pcm_cache(self, *args):
+        # the cache stays here, it does not pickle
+        self.engine.enable_pcm_cache(*args)
+
+    def handle(self, method: str, args, kwargs):
+        """
+        :param method: a method of this class overriding the engine's, or the engine's
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        target = getattr(self, method) if method in self.overrides else getattr(self.engine, method)
+        return target(*args, **kwargs)
+
+    def serve(self):
+        while True:
+            try:
+                call_id, method, args, kwargs = self.conn.recv()
+            except (EOFError, OSError):
+                # the UI process is gone
+                break
+            if method is None:
+                break
+            try:
+                reply = ('result', call_id, self.handle(method, args, kwargs))
+            except Exception as e:
+                reply = ('error', call_id, e)
+            with self._send_lock:
+                self.conn.send(reply)
+        self.engine.stop(shutdown=True)
+        self.state.close()
+
+
+def run_engine_process(conn, state_name: str, engine_kwargs: dict):
+    """
+    Entry point of the engine process
+    :param conn: its end of the pipe
+    :param state_name: SharedState block
+    :param engine_kwargs: CoreEngine arguments
+    :return:
+    """
+    EngineServer(conn, SharedState(state_name), engine_kwargs).serve()
+
+
+class EngineProcess:
+    """
+    Stands in for a CoreEngine hosted in a child process, so the audio
+    threads do not share a GIL with the UI, the scanner or the database.
+    Calls go through a pipe and wait for the engine's answer. Events come
+    back through it and are handled on a thread of their own, a handler
+    may call the engine again. Position and spectrum are polled from
+    shared memory.
+    """
+
+    def __init__(self, position_rate: float = 10.0, **engine_kwargs):
+        """
+        :param position_rate: position handler calls per second at most
+        :param engine_kwargs: CoreEngine arguments, they must pickle
+        """
+        self.position_rate = position_rate
+        self.state = SharedState()
+        # a fresh interpreter on every platform, not a fork of the UI's threads.
+        # It imports main.py again, which keeps the app behind its main guard
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        engine_kwargs['position_rate'] = position_rate
+        self.process = context.Process(target=run_engine_process, name="AudioEngine", daemon=True,
+                                       args=(child_conn, self.state.name, engine_kwargs))
+        self.process.start()
+        child_conn.close()
+
+        self.end_event_handler = None
+        self.playback_event_handler = None
+        self.position_event_handler = None
+        self.error_event_handler = None
+        self.stats_event_handler = None
+        self.spectrum = None  # handler while the analyzer runs
+        self._bands = 0
+        self._spectrum_interval = 1.0 / 30
+
+        self._ids = itertools.count()
+        self._send_lock = threading.Lock()
+        self._pending = {}  # call id -> [threading.Event, reply]
+        self._events = queue.Queue()
+        self._running = True
+        self._stop_event = threading.Event()
+        self._threads = [threading.Thread(target=target, daemon=True, name=name) for target, name in (
+            (self._receive, "EngineReceiver"), (self._dispatch, "EngineEvents"), (self._poll, "EnginePoller"))]
+        for thread in self._threads:
+            thread.start()
+
+    # plumbing
+    def call(self, method: str, *args, **kwargs):
+        """
+        Call a CoreEngine method in the engine process
+        :param method:
+        :param args: must pickle
+        :param kwargs:
+        :return: its return value, exceptions are raised here
+        """
+        call_id = next(self._ids)
+        waiter = [threading.Event(), None]
+        self._pending[call_id] = waiter
+        try:
+            with self._send_lock:
+                self.conn.send((call_id, method, args, kwargs))
+            if not waiter[0].wait(CALL_TIMEOUT):
+                raise TimeoutError(f"Audio engine process did not answer {method}")
+        finally:
+            self._pending.pop(call_id, None)
+        kind, value = waiter[1]
+        if kind == 'error':
+            raise value
+        return value
+
+    def _receive(self):
+        while self._running:
+            try:
+                kind, *message = self.conn.recv()
+            except (EOFError, OSError):
+                if self._running:
+                    logger.error("[EngineProcess] Audio engine process exited")
+                break
+            if kind == 'event':
+                self._events.put(message)
+                continue
+            call_id, value = message
+            waiter = self._pending.get(call_id)
+            if waiter is not None:
+                waiter[1] = (kind, value)
+                waiter[0].set()
+
+    def _dispatch(self):
+        handlers = {'end': 'end_event_handler', 'playback': 'playback_event_handler',
+                    'error': 'error_event_handler', 'stats': 'stats_event_handler'}
+        while True:
+            message = self._events.get()
+            if message is None:
+                break
+            name, args = message
+            handler = getattr(self, handlers[name])
+            if handler is None:
+                continue
+            try:
+                handler(*args)
+            except Exception as e:
+                logger.warning(f"[EngineProcess] {name} handler failed: {e}")
+
+    def _poll(self):
+        position_interval = 1.0 / self.position_rate
+        last_position = last_bands = 0
+        next_position = time.monotonic()
+        while not self._stop_event.wait(self._spectrum_interval if self.spectrum else position_interval):
+            try:
+                now = time.monotonic()
+                if now >= next_position:
+                    next_position = now + position_interval
+                    sequence, elapsed, total = self.state.read_position()
+                    if sequence != last_position and self.position_event_handler:
+                        last_position = sequence
+                        self.position_event_handler(elapsed, total)
+                handler = self.spectrum
+                if handler is not None:
+                    sequence, bands = self.state.read_bands(self._bands)
+                    if sequence != last_bands:
+                        last_bands = sequence
+                        handler(bands)
+            except Exception as e:
+                logger.warning(f"[EngineProcess] {e}")
+
+    # events
+    def register_end_event(self, handle):
+        self.end_event_handler = handle
+
+    def register_playback_event(self, handle):
+        self.playback_event_handler = handle
+
+    def register_position_event(self, handle):
+        self.position_event_handler = handle
+
+    def register_error_event(self, handle):
+        self.error_event_handler = handle
+
+    def register_stats_event(self, handle, interval: float = 10.0):
+        self.stats_event_handler = handle
+        self.call('register_stats_event', interval)
+
+    def enable_spectrum(self, handler, bands: int = 32, fps: float = 30.0, fft_size: int = 2048):
+        """
+        See CoreEngine.enable_spectrum, bands are read from shared memory at fps
+        """
+        self._bands = min(bands, MAX_BANDS)
+        self._spectrum_interval = 1.0 / fps
+        self.call('enable_spectrum', bands, fps, fft_size)
+        self.spectrum = handler
+        return handler
+
+    def disable_spectrum(self):
+        self.spectrum = None
+        if self._running:
+            self.call('disable_spectrum')
+
+    # CoreEngine
+    def is_playing(self):
+        return self.call('is_playing')
+
+    def load_file(self, path, channel: int = None, loudness: dict = None, track_id: str = None,
+                  seek_index: bytes = None):
+        return self.call('load_file', path, channel, loudness, track_id, seek_index)
+
+    def queue_file(self, file, channel: int = None, loudness: dict = None, track_id: str = None,
+                   seek_index: bytes = None):
+        return self.call('queue_file', file, channel, loudness, track_id, seek_index)
+
+    def play(self, channel=None):
+        return self.call('play', channel)
+
+    def pause(self, channel: int = None):
+        return self.call('pause', channel)
+
+    def resume(self, channel: int = None):
+        return self.call('resume', channel)
+
+    def set_position(self, seconds: float, channel: int = None):
+        return self.call('set_position', seconds, channel)
+
+    def get_pos(self, channel=None):
+        return self.state.read_position()[1] if channel is None else self.call('get_pos', channel)
+
+    def get_file_length(self, channel: int = None):
+        return self.state.read_position()[2] if channel is None else self.call('get_file_length', channel)
+
+    def set_volume(self, volume, channel: int = None):
+        return self.call('set_volume', volume, channel)
+
+    def set_normalization(self, mode: str = None):
+        return self.call('set_normalization', mode)
+
+    def set_crossfade(self, seconds: float):
+        return self.call('set_crossfade', seconds)
+
+    def enable_pcm_cache(self, directory: str, budget_bytes: int = 1 << 30, dtype: str = 'float32'):
+        # the cache object stays in the engine process
+        self.call('enable_pcm_cache', directory, budget_bytes, dtype)
+
+    def prefetch(self, items: list):
+        return self.call('prefetch', items)
+
+    def stats(self) -> dict:
+        return self.call('stats')
+
+    def stop(self, shutdown=False):
+        if not self._running:
+            return
+        self.call('stop')
+        if shutdown:
+            self.shutdown()
+
+    def shutdown(self):
+        """
+        End the engine process, it shuts its engine down on the way out
+        :return:
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._stop_event.set()
+        self.spectrum = None
+        try:
+            with self._send_lock:
+                self.conn.send((None, None, (), {}))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self._events.put(None)
+        self.conn.close()
+        self.state.close(unlink=True)
@@ -36,39 +36,16 @@ class AllpassReverb(CoreAudioEffect):
         if flat:
             return data
         
-        output = np.zeros_like(data)
-        """for channel in range(data.shape[1]):
-            # left channel
-            #delay_left = self.buffer_left[self.index_left]
-            output[i, 0] = data[i, 0] - self.feedback * self.buffer_left[self.index_left]#delay_left
-            self.buffer_left[self.index_left] = data[i, 0] + self.feedback * output[i, 0]
-            self.index_left = (self.index_left + 1) % self.delay_samples
-            # right channel
-            #delay_right = self.buffer_right[self.index_right]
-            output[i, 1] = data[i, 1] - self.feedback * self.buffer_right[self.index_right]#delay_right
-            self.buffer_right[self.index_right] = data[i, 1] + self.feedback * output[i, 1]
-            self.index_right = (self.index_right + 1) % self.delay_samples
-
-            self.feedback = max(self.feedback * self.decay, 0.05)
-            wet_left = data[i, 0] * self.mix
-            wet_right = data[i, 1] * self.mix
-            output[i, 0] = data[i, 0] * (1 - self.wet) + wet_left * self.wet
-            output[i, 1] = data[i, 0] * (1 - self.wet) + wet_right * self.wet
-            
-            output[:, channel] = np.array([self.tap_delay.process(data[n, channel]) for n in range(data.shape[0])], dtype=np.float32)
-            """
-        for n in range(data.shape[0]):
-            for channel in range(data.shape[1]):
-                sample = self.predelay.process(data[n, channel])
-                sample = sample * self.predelay_gain + sample * (1.0 - self.predelay_gain)
-                er = self.tap_delay.process(sample) * self.er_gain
-                out = 0
-                for comb in self.combs:
-                    out += comb.process(sample)
-                    #out += comb.process(out)
-
-                output[n, channel] = (er + out) * self.wet + sample * self.dry
-        return output
+        # Channels share the filter state, samples go through in interleaved order
+        sample = self.predelay.process(data.reshape(-1))
+        sample = sample * self.predelay_gain + sample * (1.0 - self.predelay_gain)
+        er = self.tap_delay.process(sample) * self.er_gain
+        out = 0
+        for comb in self.combs:
+            out = out + comb.process(sample)
+
+        output = (er + out) * self.wet + sample * self.dry
+        return output.reshape(data.shape).astype(data.dtype)
         
 
 
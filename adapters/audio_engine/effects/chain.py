@@ -0,0 +1,295 @@
+import time
+
+import numpy as np
+
+from .effect import CoreAudioEffect
+from adapters.audio_engine.utils.smoothing import SmoothedParameter
+
+
+class EffectNode:
+    """
+    An effect in a chain with its own wet/dry mix and bypass. Keeps timing
+    counters so the cost of each effect per block can be read back.
+    """
+
+    def __init__(self, effect: CoreAudioEffect, wet: float = 1.0, bypass: bool = False, name: str = None):
+        """
+        :param effect:
+        :param wet: 0-1, share of the effect output in the node output
+        :param bypass: skip the effect entirely, the input is passed through
+        :param name: shown in the stats, defaults to the effect class name
+        """
+        self.effect = effect
+        self._wet = SmoothedParameter(wet)
+        self.bypass = bypass
+        self.name = name if name else type(effect).__name__
+        self.reset_stats()
+
+    @property
+    def wet(self):
+        """
+        Wet/dry mix, changes are ramped over a few milliseconds
+        :return:
+        """
+        return self._wet.target
+
+    @wet.setter
+    def wet(self, value):
+        self._wet.set(value)
+
+    def reset_stats(self):
+        """
+        :return:
+        """
+        self.calls = 0
+        self.total_us = 0.0
+        self.last_us = 0.0
+        self.max_us = 0.0
+
+    def process(self, data: np.ndarray, sample_rate: int) -> np.ndarray:
+        """
+        :param data: block, left untouched
+        :param sample_rate:
+        :return: the input itself when bypassed or when the effect returned it, else the
+            effect's output block mixed with the input
+        """
+        if self.bypass:
+            return data
+
+        start = time.perf_counter_ns()
+        output = self.effect.process(data, sample_rate)
+        self._wet.sample_rate = sample_rate
+        wet = self._wet.next_block(len(data))
+        if output is not data:
+            # mixed in place on the effect's output, the input is left untouched
+            if isinstance(wet, float):
+                if wet < 1.0:
+                    np.subtract(output, data, out=output)
+                    np.multiply(output, wet, out=output)
+                    np.add(output, data, out=output)
+            else:
+                output = self._mix(data, output, wet)
+        elapsed = (time.perf_counter_ns() - start) / 1000
+
+        self.calls += 1
+        self.total_us += elapsed
+        self.last_us = elapsed
+        if elapsed > self.max_us:
+            self.max_us = elapsed
+        return output
+
+    @staticmethod
+    def _mix(dry, wet_block, wet):
+        """
+        dry + (wet - dry) * wet gain, per sample, in place on wet_block
+        :param dry:
+        :param wet_block: effect output, not dry
+        :param wet: (frames,) gains
+        :return: wet_block
+        """
+        np.subtract(wet_block, dry, out=wet_block)
+        for c in range(wet_block.shape[1]):
+            column = wet_block[:, c]
+            np.multiply(column, wet, out=column)
+        np.add(wet_block, dry, out=wet_block)
+        return wet_block
+
+    def stats(self) -> dict:
+        """
+        Microseconds spent per block
+        :return:
+        """
+        return {
+            'name': self.name,
+            'bypass': self.bypass,
+            'wet': self.wet,
+            'calls': self.calls,
+            'last_us': self.last_us,
+            'avg_us': self.total_us / self.calls if self.calls else 0.0,
+            'max_us': self.max_us
+        }
+
+
+class ParallelStage:
+    """
+    Branches fed the same input, their outputs summed. With normalize the sum
+    is divided by the branch count so identical branches keep the input level.
+    """
+
+    def __init__(self, branches: list, normalize: bool = True, bypass: bool = False):
+        """
+        :param branches: effects, nodes or chains, each becomes a serial chain
+        :param normalize:
+        :param bypass:
+        """
+        self.branches = [branch if isinstance(branch, EffectChain) else EffectChain([branch])
+                         for branch in branches]
+        self.normalize = normalize
+        self.bypass = bypass
+        # the sum, reallocated only when the block shape changes
+        self._output = None
+
+    def nodes(self):
+        """
+        :return: every node in the branches
+        """
+        return [node for branch in self.branches for node in branch.nodes()]
+
+    def process(self, data: np.ndarray, sample_rate: int) -> np.ndarray:
+        """
+        :param data:
+        :param sample_rate:
+        :return: the stage's own block, valid until the next call
+        """
+        branches = self.branches
+        if self.bypass or not branches:
+            return data
+
+        output = self._output
+        if output is None or output.shape != data.shape:
+            output = self._output = np.empty(data.shape, dtype=np.float32)
+        np.copyto(output, branches[0].process(data, sample_rate))
+        for branch in branches[1:]:
+            np.add(output, branch.process(data, sample_rate), out=output)
+        if self.normalize and len(branches) > 1:
+            np.multiply(output, 1.0 / len(branches), out=output)
+        return output
+
+
+class EffectChain(CoreAudioEffect):
+    """
+    Serial chain of effect nodes and parallel stages, itself an effect so
+    chains can be nested as branches.
+
+    The stage list is replaced rather than modified, so the render thread can
+    iterate it while the control thread adds or removes effects.
+    """
+
+    def __init__(self, stages: list = None):
+        """
+        :param stages: effects, nodes or parallel stages, in processing order
+        """
+        self._stages = ()
+        for stage in stages or []:
+            self.append(stage)
+
+    def __len__(self):
+        return len(self._stages)
+
+    def __iter__(self):
+        return iter(self._stages)
+
+    def __contains__(self, item):
+        return self.find(item) is not None
+
+    def append(self, item):
+        """
+        Add an effect, node or parallel stage at the end of the chain
+        :param item:
+        :return: the stage added
+        """
+        stage = item if isinstance(item, (EffectNode, ParallelStage)) else EffectNode(item)
+        self._stages = self._stages + (stage,)
+        return stage
+
+    def add(self, effect: CoreAudioEffect, wet: float = 1.0, bypass: bool = False, name: str = None) -> EffectNode:
+        """
+        Add an effect in series
+        :param effect:
+        :param wet:
+        :param bypass:
+        :param name:
+        :return: node controlling the effect
+        """
+        return self.append(EffectNode(effect, wet, bypass, name))
+
+    def add_parallel(self, branches: list, normalize: bool = True) -> ParallelStage:
+        """
+        Add a stage of effects fed the same input
+        :param branches: effects, nodes or chains
+        :param normalize:
+        :return:
+        """
+        return self.append(ParallelStage(branches, normalize))
+
+    def remove(self, item):
+        """
+        Remove a top level stage, by the stage itself or by its effect
+        :param item:
+        :return:
+        """
+        self._stages = tuple(stage for stage in self._stages
+                             if stage is not item and getattr(stage, 'effect', None) is not item)
+
+    def clear(self):
+        """
+        :return:
+        """
+        self._stages = ()
+
+    def find(self, item):
+        """
+        Node or stage holding item, searched through parallel branches too
+        :param item: effect, node or stage
+        :return: None if not found
+        """
+        for stage in self._stages:
+            if stage is item or getattr(stage, 'effect', None) is item:
+                return stage
+            if isinstance(stage, ParallelStage):
+                for node in stage.nodes():
+                    if node is item or node.effect is item:
+                        return node
+        return None
+
+    def set_bypass(self, item, bypass: bool = True):
+        """
+        :param item: effect, node or stage
+        :param bypass:
+        :return: False if item is not in the chain
+        """
+        stage = self.find(item)
+        if stage is None:
+            return False
+        stage.bypass = bypass
+        return True
+
+    def nodes(self):
+        """
+        :return: every node, parallel branches included, in processing order
+        """
+        nodes = []
+        for stage in self._stages:
+            if isinstance(stage, ParallelStage):
+                nodes.extend(stage.nodes())
+            else:
+                nodes.append(stage)
+        return nodes
+
+    def process(self, data: np.ndarray, sample_rate: int, flat=False):
+        """
+        :param data: block, left untouched
+        :param sample_rate:
+        :param flat: pass the input through
+        :return: the input itself if nothing ran
+        """
+        if flat:
+            return data
+        output = data
+        for stage in self._stages:
+            output = stage.process(output, sample_rate)
+        return output
+
+    def stats(self) -> list:
+        """
+        Per node timing, microseconds per block
+        :return:
+        """
+        return [node.stats() for node in self.nodes()]
+
+    def reset_stats(self):
+        """
+        :return:
+        """
+        for node in self.nodes():
+            node.reset_stats()
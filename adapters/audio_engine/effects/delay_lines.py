@@ -0,0 +1,90 @@
+import numpy as np
+
+
+class CircularDelay:
+    """
+    Circular delay line for block processing. Keeps the last `length` frames of
+    a stream, frames can be scalars (mono/interleaved) or arrays (stereo).
+
+    Feedback structures read and write in segments no longer than their delay:
+    every sample of such a segment only depends on samples written before it.
+    """
+
+    def __init__(self, length: int, shape=(), dtype=np.float64):
+        """
+        :param length: frames kept, the longest delay that can be read
+        :param shape: shape of one frame, () for a mono stream, (2,) for stereo
+        :param dtype:
+        """
+        self.length = max(int(length), 1)
+        self.buffer = np.zeros((self.length,) + tuple(shape), dtype=dtype)
+        self.index = 0  # where the next frame is written
+
+    def read(self, delay: int, frames: int) -> np.ndarray:
+        """
+        Frames written `delay` steps before each of the next `frames` writes
+        :param delay: 1 to length
+        :param frames: at most delay, later frames are not written yet
+        :return: copy of the frames
+        """
+        start = (self.index - delay) % self.length
+        stop = start + frames
+        if stop <= self.length:
+            return self.buffer[start:stop].copy()
+        return np.concatenate((self.buffer[start:], self.buffer[:stop - self.length]))
+
+    def history(self) -> np.ndarray:
+        """
+        The whole line, oldest frame first
+        :return:
+        """
+        return self.read(self.length, self.length)
+
+    def write(self, block: np.ndarray):
+        """
+        Append frames, overwriting the oldest ones
+        :param block:
+        :return:
+        """
+        frames = len(block)
+        if frames >= self.length:
+            # only the newest frames survive
+            self.buffer[:] = block[frames - self.length:]
+            self.index = 0
+            return
+        start = self.index
+        first = min(frames, self.length - start)
+        self.buffer[start:start + first] = block[:first]
+        if first < frames:
+            self.buffer[:frames - first] = block[first:]
+        self.index = (start + frames) % self.length
+
+    def delay(self, block: np.ndarray, delay: int) -> np.ndarray:
+        """
+        Feed-forward delay of a block of any length
+        :param block:
+        :param delay: 0 to length
+        :return: block delayed by delay frames
+        """
+        if delay <= 0:
+            self.write(block)
+            return block.copy()
+        frames = len(block)
+        output = np.empty((frames,) + self.buffer.shape[1:], dtype=self.buffer.dtype)
+        head = min(frames, delay)
+        output[:head] = self.read(delay, head)
+        output[head:] = block[:frames - head]
+        self.write(block)
+        return output
+
+
+def segments(frames: int, size: int):
+    """
+    Split a block into (start, stop) pairs of at most size frames
+    :param frames:
+    :param size:
+    :return:
+    """
+    size = max(int(size), 1)
+    for start in range(0, frames, size):
+        yield start, min(start + size, frames)
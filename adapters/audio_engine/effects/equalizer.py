@@ -0,0 +1,167 @@
+import numpy as np
+from scipy.signal import sosfilt
+
+from .effect import CoreAudioEffect
+
+
+LOW_SHELF = 'low_shelf'
+PEAK = 'peak'
+HIGH_SHELF = 'high_shelf'
+
+
+def biquad_section(kind: str, freq: float, gain_db: float, q: float, sample_rate: int) -> np.ndarray:
+    """
+    One second order section (RBJ audio EQ cookbook), normalized for sosfilt
+    :param kind: LOW_SHELF, PEAK or HIGH_SHELF
+    :param freq: centre or corner frequency in Hz
+    :param gain_db:
+    :param q:
+    :param sample_rate:
+    :return: [b0, b1, b2, 1, a1, a2]
+    """
+    freq = min(freq, 0.45 * sample_rate)
+    a = 10 ** (gain_db / 40)
+    w0 = 2 * np.pi * freq / sample_rate
+    cs = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+
+    if kind == PEAK:
+        b = [1 + alpha * a, -2 * cs, 1 - alpha * a]
+        den = [1 + alpha / a, -2 * cs, 1 - alpha / a]
+    elif kind == LOW_SHELF:
+        sq = 2 * np.sqrt(a) * alpha
+        b = [a * ((a + 1) - (a - 1) * cs + sq), 2 * a * ((a - 1) - (a + 1) * cs), a * ((a + 1) - (a - 1) * cs - sq)]
+        den = [(a + 1) + (a - 1) * cs + sq, -2 * ((a - 1) + (a + 1) * cs), (a + 1) + (a - 1) * cs - sq]
+    elif kind == HIGH_SHELF:
+        sq = 2 * np.sqrt(a) * alpha
+        b = [a * ((a + 1) + (a - 1) * cs + sq), -2 * a * ((a - 1) + (a + 1) * cs), a * ((a + 1) + (a - 1) * cs - sq)]
+        den = [(a + 1) - (a - 1) * cs + sq, 2 * ((a - 1) - (a + 1) * cs), (a + 1) - (a - 1) * cs - sq]
+    else:
+        raise ValueError(f"Unknown band type: {kind}")
+
+    return np.array(b + den) / den[0]
+
+
+class EQBand:
+
+    def __init__(self, kind: str, freq: float, gain_db: float = 0.0, q: float = 1.0):
+        """
+        :param kind: LOW_SHELF, PEAK or HIGH_SHELF
+        :param freq: Hz
+        :param gain_db:
+        :param q:
+        """
+        self.kind = kind
+        self.freq = freq
+        self.gain_db = gain_db
+        self.q = q
+
+
+class ParametricEQ(CoreAudioEffect):
+    """
+    Multi-band EQ as one cascade of biquads run by sosfilt over both channels,
+    with the filter state carried between blocks. Coefficients are only
+    recomputed when a band changes.
+    """
+    graphic_frequencies = (31, 62, 125, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+    def __init__(self, bands: list = None, sample_rate=44100, preamp_db=0.0):
+        """
+        :param bands: EQBand list, defaults to a 10 band graphic EQ
+        :param sample_rate:
+        :param preamp_db: gain applied before the bands
+        """
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.bands = bands if bands is not None else self.graphic_bands()
+        self.preamp_db = preamp_db
+        self.sos = None
+        self.zi = None
+        self._flat = True
+        self._update_filters()
+
+    @classmethod
+    def graphic_bands(cls, q=1.41):
+        """
+        Shelves at both ends and peaking bands in between, all flat
+        :param q:
+        :return:
+        """
+        last = len(cls.graphic_frequencies) - 1
+        return [EQBand(LOW_SHELF if i == 0 else HIGH_SHELF if i == last else PEAK, freq, 0.0,
+                       0.707 if i in (0, last) else q)
+                for i, freq in enumerate(cls.graphic_frequencies)]
+
+    def _update_filters(self):
+        """
+        Rebuild the cascade, keeping the filter state when the band count is unchanged
+        :return:
+        """
+        sos = np.array([biquad_section(band.kind, band.freq, band.gain_db, band.q, self.sample_rate)
+                        for band in self.bands]).reshape(-1, 6)
+        if self.zi is None or len(self.zi) != len(sos):
+            self.zi = np.zeros((len(sos), 2, 2))
+        self._preamp = 10 ** (self.preamp_db / 20)
+        self._flat = self.preamp_db == 0 and all(band.gain_db == 0 for band in self.bands)
+        # single assignment, the render thread sees the old or the new cascade
+        self.sos = sos
+
+    def set_band(self, index: int, freq: float = None, gain_db: float = None, q: float = None, kind: str = None):
+        """
+        Change one band
+        :param index:
+        :param freq:
+        :param gain_db:
+        :param q:
+        :param kind:
+        :return:
+        """
+        band = self.bands[index]
+        if freq is not None:
+            band.freq = freq
+        if gain_db is not None:
+            band.gain_db = gain_db
+        if q is not None:
+            band.q = q
+        if kind is not None:
+            band.kind = kind
+        self._update_filters()
+
+    def set_gains(self, gains_db: list):
+        """
+        Set every band gain at once, a single coefficient update
+        :param gains_db: one value per band
+        :return:
+        """
+        for band, gain_db in zip(self.bands, gains_db):
+            band.gain_db = gain_db
+        self._update_filters()
+
+    def set_preamp(self, preamp_db: float):
+        """
+        :param preamp_db:
+        :return:
+        """
+        self.preamp_db = preamp_db
+        self._update_filters()
+
+    def reset(self):
+        """
+        Clear the filter state, on seek or a new track
+        :return:
+        """
+        self.zi = np.zeros_like(self.zi)
+
+    def process(self, data, sample_rate, flat=False):
+        if flat or self._flat:
+            return data
+
+        if sample_rate != self.sample_rate:
+            self.sample_rate = sample_rate
+            self._update_filters()
+
+        sos = self.sos
+        output, self.zi = sosfilt(sos, data, axis=0, zi=self.zi)
+        if self._preamp != 1.0:
+            output *= self._preamp
+        return output.astype(data.dtype)
@@ -1,7 +1,8 @@
-import random
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor
-from effects.effect import CoreAudioEffect
+from scipy.signal import lfilter
+
+from .effect import CoreAudioEffect
+from .delay_lines import CircularDelay, segments
 
 
 class EffectsData:
@@ -16,112 +17,81 @@ class EffectsData:
     allpass_gains = [0.55, 0.55, 0.55, 0.55]
 
 
+# The filters below work on whole blocks of a mono stream (1-D arrays). The
+# reverbs feed them the interleaved stereo stream, like the per-sample versions did.
+
+
 class PreDelay:
 
     def __init__(self, sample_rate=44100, delay_ms=1000):
         self.delay_samples = int(sample_rate * (delay_ms / 1000))
-        self.buffer = np.zeros(self.delay_samples, dtype=np.float32)
-        self.index = 0
+        self.line = CircularDelay(self.delay_samples)
 
     def process(self, data):
-        output = self.buffer[self.index]
-        self.buffer[self.index] = data
-        self.index = (self.index + 1) % self.delay_samples
-        return output
-    
-
-"""class TapDelayLine:
+        return self.line.delay(data, self.delay_samples)
 
-    def __init__(self, tap_delays, tap_gains):
-        self.tap_delays = np.array(tap_delays)
-        self.tap_gains = np.array(tap_gains)
-        self.buffer_index = 0
-        self.delay_length = max(self.tap_delays) + 1
-        self.buffer = np.zeros(self.delay_length, dtype=np.float32)
 
-    def process(self, data):
-        output = 0
-        self.buffer[self.buffer_index] = data
-        for delay, gain in zip(self.tap_delays, self.tap_gains):
-            delay_index = (self.buffer_index - delay) % self.delay_length
-            output += gain * self.buffer[delay_index]
-        self.buffer_index = (self.buffer_index + 1) % self.delay_length
-        return output
-"""
 class TapDelayLine:
+
     def __init__(self, tap_delays, tap_gains):
         self.delay_length = max(tap_delays)
-        self.buffer = np.zeros(self.delay_length, dtype=np.float32)
         self.tap_delays = tap_delays
         self.tap_gains = tap_gains
-        self.pos = 0
+        # the line only holds delay_length samples, so the longest tap wraps
+        # around to the current sample
+        self._offsets = [delay % self.delay_length for delay in tap_delays]
+        self.line = CircularDelay(self.delay_length)
 
     def process(self, x):
-        y = 0
-        self.buffer[self.pos] = x
-        for i, delay in enumerate(self.tap_delays):
-            gain = self.tap_gains[i]
-            delay_idx = self.pos - delay
-            if delay_idx < 0:
-                delay_idx += self.delay_length
-            y += gain * self.buffer[delay_idx]
-        
-        self.pos = self.pos + 1
-        if self.pos >= self.delay_length:
-            self.pos = self.pos - self.delay_length
+        frames = len(x)
+        extended = np.concatenate((self.line.history(), x))
+        y = np.zeros(frames)
+        for offset, gain in zip(self._offsets, self.tap_gains):
+            start = self.delay_length - offset
+            y += gain * extended[start:start + frames]
+        self.line.write(x)
         return y
-    
-
-class Delay:
-
-    def __init__(self, delay_length):
-        self.buffer = np.zeros(delay_length, dtype=np.float32)
-        self.pos = 0
-        self.length = delay_length
-
-    def front(self):
-        return self.buffer[self.pos]
-    
-    def push(self, x):
-        self.buffer[self.pos] = x
-        self.pos = (self.pos + 1) % self.length
-        
-    def go_back(self, idx):
-        return self.buffer[(self.pos - idx) % self.length]
 
 
 class AllpassFilter:
 
     def __init__(self, delay_length, feedback):
         self.feedback = feedback
-        self.delay = Delay(delay_length)
-    
+        self.delay_length = delay_length
+        self.line = CircularDelay(delay_length)
+
     def process(self, data):
-        v_delay = self.delay.front()
-        v = self.feedback * v_delay + data
-        output = v_delay - self.feedback * v
-        self.delay.push(output)
+        # y[n] = (1 - g^2) * y[n - L] - g * x[n]
+        output = np.empty(len(data))
+        gain = 1.0 - self.feedback * self.feedback
+        for start, stop in segments(len(data), self.delay_length):
+            output[start:stop] = gain * self.line.read(self.delay_length, stop - start) - self.feedback * data[start:stop]
+            self.line.write(output[start:stop])
         return output
-    
+
 
 class ModulatedCombFilter:
 
     def __init__(self, delay_length, feedback, damp):
         self.base_delay_length = delay_length
-        self.buffer = np.zeros(delay_length, dtype=np.float32)
+        self.line = CircularDelay(delay_length)
         self.feedback = feedback
         self.damp1 = damp
         self.damp2 = 1.0 - damp
-        self.last = 0
-        self.index = 0
+        # one-pole damping in the loop, lfilter state carries `last` across blocks
+        self._b = np.array([self.damp2])
+        self._a = np.array([1.0, -self.damp1])
+        self._zi = np.zeros(1)
 
     def process(self, data):
-        output = self.buffer[self.index]
-        self.last = output * self.damp2 + self.last * self.damp1
-        self.buffer[self.index] = data + self.last * self.feedback
-        self.index = (self.index + 1) % len(self.buffer)
+        output = np.empty(len(data))
+        for start, stop in segments(len(data), self.base_delay_length):
+            delayed = self.line.read(self.base_delay_length, stop - start)
+            last, self._zi = lfilter(self._b, self._a, delayed, zi=self._zi)
+            self.line.write(data[start:stop] + last * self.feedback)
+            output[start:stop] = delayed
         return output
-    
+
 
 class ReverbFilter(CoreAudioEffect):
     episilion = 1e-8  # Prevent floating-point issues
@@ -156,53 +126,30 @@ class ReverbFilter(CoreAudioEffect):
         self.predelay_line = PreDelay(self.sample_rate, self.predelay)
         self.er_line = TapDelayLine(EffectsData.tap_delays[:self.limit_filters_num], EffectsData.tap_gains[:self.limit_filters_num])
 
-        self.combs = [ModulatedCombFilter(int(length * (scale + .5)), feedback, hdamp) 
+        self.combs = [ModulatedCombFilter(int(length * (scale + .5)), feedback, hdamp)
                       for length in EffectsData.comb_lengths[:self.limit_filters_num]]
 
         self.allpass = [AllpassFilter(int(length + .5), 0.55) for length in EffectsData.allpass_lengths[:self.limit_filters_num]]
 
-    def process_single_sample(self, data):
+    def process_block(self, data):
+        """
+        Process a block of the interleaved stream
+        :param data: 1-D samples
+        :return:
+        """
         input_ = self.predelay_line.process(data)
         input_ = input_ * self.predelay_gain + input_ * (1.0 - self.predelay_gain)
         er = self.er_line.process(input_) * self.er_gain
 
         output = sum(comb.process(input_) for comb in self.combs)
-        output += sum(allpass.process(output) for allpass in self.allpass)
+        output = output + sum(allpass.process(output) for allpass in self.allpass)
+
+        return (er + output) * self.wet + input_ * self.dry
 
-        return (er+output) * self.wet + input_ * self.dry
-    
     def process(self, data: np.ndarray, sample_rate: int, flat=False):
         if flat:
             return data
-        
-        output = np.zeros_like(data, dtype=np.float32)
-        for n in range(data.shape[0]):
-            for channel in range(data.shape[1]):
-                output[n, channel] = self.process_single_sample(data[n, channel])
-        """for channel in range(data.shape[1]):
-            output[:, channel] = np.array([self.process_single_sample(data[n, channel]) for n in range(data.shape[0])], dtype=np.float32)"""
-        """num_chunks = data.shape[0] // 512
-        for chunk_idx in range(num_chunks):
-            chunk_start = chunk_idx * 512
-            chunk_end = (chunk_idx + 1) * 512
-            chunk_data = data[chunk_start:chunk_end]
-            for channel in range(data.shape[1]):
-                output[chunk_start:chunk_end, channel] = np.array([self.process_single_sample(chunk_data[n, channel]) for n in range(chunk_data.shape[0])])
-        """
-        """with ThreadPoolExecutor() as executor:
-            # process channel in parallel
-            futures = [executor.submit(self.process_channel, data, channel_idx) for channel_idx in range(data.shape[1])]
-            # wait results
-            for channel_idx, future in enumerate(futures):
-                output[:, channel_idx] = future.result()"""
-
-        return output
 
-    def process_channel(self, data, channel_idx):
-        out_channel = np.zeros(data.shape[0], dtype=np.float32)
-        #print(out_channel)
-        for n in range(data.shape[0]):
-            out_channel[n] = self.process_single_sample(data[n, channel_idx])
-        
-        return out_channel
-    
+        # Channels share the filter state, samples go through in interleaved order
+        output = self.process_block(data.reshape(-1))
+        return output.reshape(data.shape).astype(np.float32)
@@ -0,0 +1,143 @@
+import numpy as np
+from scipy.signal import lfilter, lfilter_zi
+
+from .effect import CoreAudioEffect
+
+MAX_LOOKAHEAD_MS = 5.0
+
+
+class LookaheadLimiter(CoreAudioEffect):
+    """
+    Brickwall limiter working a block at a time. The output is delayed by
+    the lookahead so the gain is already down when a peak comes out:
+
+    - required gain per frame, ceiling over the frame's peak
+    - held at its minimum over the lookahead window, a sliding min over
+      window sized strides (van Herk/Gil-Werman, O(frames) however long the window)
+    - attack, a moving average over the same window from a running sum, which
+      never rises above the gain a frame needs since every window it averages
+      contains that frame
+    - release, a one-pole run by lfilter on the held gain with its state
+      carried between blocks, the final gain is the lower of the two
+    """
+
+    def __init__(self, ceiling_db: float = -1.0, lookahead_ms: float = MAX_LOOKAHEAD_MS, release_ms: float = 80.0,
+                 sample_rate: int = 44100, channels: int = 2):
+        """
+        :param ceiling_db: output peak level
+        :param lookahead_ms: delay added to the output, at most MAX_LOOKAHEAD_MS
+        :param release_ms: time constant of the gain coming back up
+        :param sample_rate:
+        :param channels:
+        """
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.ceiling_db = ceiling_db
+        self.ceiling = 10 ** (ceiling_db / 20)
+        self.lookahead = max(int(min(lookahead_ms, MAX_LOOKAHEAD_MS) * sample_rate / 1000), 1)
+        self.release_ms = release_ms
+
+        pole = np.exp(-1.0 / (release_ms * sample_rate / 1000))
+        self._release = ([1.0 - pole], [1.0, -pole])
+        self._frames = 0
+        self.reset()
+
+    @property
+    def latency(self) -> int:
+        """
+        Frames the output is delayed by
+        :return:
+        """
+        return self.lookahead
+
+    def reset(self):
+        """
+        Forget the signal so far, e.g. when a new track starts
+        :return:
+        """
+        self._delay = np.zeros((self.lookahead, self.channels), dtype=np.float32)
+        # required and held gains of the last lookahead frames, the windows reach back into them
+        self._required = np.ones(self.lookahead)
+        self._held_tail = np.ones(self.lookahead)
+        # starts settled at unity gain
+        self._release_zi = lfilter_zi(*self._release)
+        self.gain_reduction_db = 0.0
+
+    def _allocate(self, frames: int):
+        # per block scratch, reallocated only when the block size changes
+        self._frames = frames
+        lookahead, window = self.lookahead, self.lookahead + 1
+        self._input = np.empty((frames + lookahead, self.channels), dtype=np.float32)
+        self._peaks = np.empty(frames, dtype=np.float32)
+        # gains padded to whole windows, the padding never lowers a minimum
+        rows = -(-(frames + lookahead) // window)
+        self._windows = np.full((rows, window), np.inf)
+        self._gains = self._windows.reshape(-1)[:frames + lookahead]
+        self._prefix = np.empty_like(self._windows)
+        self._suffix = np.empty_like(self._windows)
+        self._held = np.empty(frames + lookahead)
+        self._sums = np.empty(frames + lookahead + 1)
+        self._sums[0] = 0.0
+        self._attack = np.empty(frames)
+
+    def _sliding_min(self, out: np.ndarray):
+        """
+        Minimum of every lookahead + 1 window of self._gains
+        :param out: frames values
+        :return:
+        """
+        window = self.lookahead + 1
+        np.minimum.accumulate(self._windows, axis=1, out=self._prefix)
+        np.minimum.accumulate(self._windows[:, ::-1], axis=1, out=self._suffix[:, ::-1])
+        # a window starting at i is the suffix of i's row and the prefix of the next one
+        prefix, suffix = self._prefix.reshape(-1), self._suffix.reshape(-1)
+        np.minimum(suffix[:len(out)], prefix[window - 1:window - 1 + len(out)], out=out)
+
+    def process(self, data: np.ndarray, sample_rate: int = None, flat=False) -> np.ndarray:
+        """
+        Limit a block in place
+        :param data: (frames, channels) float32
+        :param sample_rate: unused, set in the constructor
+        :param flat:
+        :return: data, delayed by self.latency frames
+        """
+        frames = len(data)
+        if frames != self._frames:
+            self._allocate(frames)
+        lookahead = self.lookahead
+
+        # delay line, the block's own frames come out lookahead frames later
+        signal = self._input
+        signal[:lookahead] = self._delay
+        signal[lookahead:] = data
+        self._delay[:] = signal[frames:]
+
+        np.max(np.abs(data), axis=1, out=self._peaks)
+        np.maximum(self._peaks, 1e-9, out=self._peaks)
+        gains = self._gains
+        gains[:lookahead] = self._required
+        np.divide(self.ceiling, self._peaks, out=gains[lookahead:])
+        np.minimum(gains[lookahead:], 1.0, out=gains[lookahead:])
+        self._required[:] = gains[frames:]
+
+        held = self._held
+        held[:lookahead] = self._held_tail
+        self._sliding_min(held[lookahead:])
+        self._held_tail[:] = held[frames:]
+
+        # moving average of the held gain over lookahead + 1 frames
+        sums = self._sums
+        np.cumsum(held, out=sums[1:])
+        attack = self._attack
+        np.subtract(sums[lookahead + 1:], sums[:frames], out=attack)
+        np.multiply(attack, 1.0 / (lookahead + 1), out=attack)
+
+        release, self._release_zi = lfilter(*self._release, held[lookahead:], zi=self._release_zi)
+        gain = np.minimum(attack, release, out=attack)
+
+        np.multiply(signal[:frames], gain[:, None], out=data, casting='unsafe')
+        # guard against rounding in the filters
+        np.clip(data, -self.ceiling, self.ceiling, out=data)
+        self.gain_reduction_db = float(-20 * np.log10(max(gain.min(), 1e-9)))
+        return data
@@ -1,5 +1,7 @@
 from .effect import CoreAudioEffect
+from .delay_lines import CircularDelay, segments
 import numpy as np
+from scipy.signal import lfilter, ss2tf
 
 
 class UltraLightReverb(CoreAudioEffect):
@@ -15,19 +17,21 @@ class UltraLightReverb(CoreAudioEffect):
         self.pre_delay = pre_delay  # Milliseconds
         self.damping = damping  # 0-1 (high-frequency attenuation)
 
-        # Fixed delay line size (stereo)
+        # Fixed delay line size (stereo), read half way back
         self.delay_samples = int(decay_time * sr)  # Max delay time
-        self.delay_buffer = np.zeros((2, self.delay_samples))
-        self.delay_ptr = 0
+        self.feedback_delay = self.delay_samples // 2 or self.delay_samples
+        self.delay_line = CircularDelay(self.feedback_delay, shape=(2,))
+        self.feedback = 0.97 ** (1 / self.decay_time)
 
-        # Pre-delay buffer (stereo)
+        # Pre-delay line (stereo)
         self.pre_delay_samples = int(pre_delay * (sr/1000))
-        self.pre_delay_buf = np.zeros((2, self.pre_delay_samples))
-        self.pre_delay_ptr = 0
+        self.pre_delay_line = CircularDelay(self.pre_delay_samples, shape=(2,))
 
         # Damping filter (simple 1-pole lowpass)
         self.damping_filter = damping
-        self.z = np.zeros(2)  # Filter state
+        self._b = np.array([damping])
+        self._a = np.array([1.0, damping - 1.0])
+        self.z = np.zeros((1, 2))  # Filter state
 
     def process(self, data, sample_rate, flat=False):
         if flat or self.wet < 0.01:
@@ -35,37 +39,18 @@ class UltraLightReverb(CoreAudioEffect):
 
         wet = self.wet
         dry = 1 - wet
-        output = np.zeros_like(data)
+        delayed_in = self.pre_delay_line.delay(data, self.pre_delay_samples)
+        tail = np.empty(data.shape)
 
-        # Process each sample in block
-        for i in range(data.shape[0]):
-            # Input with pre-delay
-            in_sample = data[i]
+        # Segments no longer than the loop delay only read what is already written
+        for start, stop in segments(len(data), self.feedback_delay):
+            delayed = self.delay_line.read(self.feedback_delay, stop - start)
+            delayed, self.z = lfilter(self._b, self._a, delayed, axis=0, zi=self.z)
+            self.delay_line.write(delayed_in[start:stop] + delayed * self.feedback)
+            tail[start:stop] = delayed
 
-            # Write to pre-delay buffer
-            self.pre_delay_buf[:, self.pre_delay_ptr] = in_sample
-            delayed_in = self.pre_delay_buf[:,
-                         (self.pre_delay_ptr - self.pre_delay_samples) % self.pre_delay_samples
-                         ]
-            self.pre_delay_ptr = (self.pre_delay_ptr + 1) % self.pre_delay_samples
-
-            # Read from delay line
-            read_ptr = (self.delay_ptr - self.delay_samples // 2) % self.delay_samples
-            delayed = self.delay_buffer[:, read_ptr]
-
-            # Apply damping filter
-            for c in range(data.shape[1]):
-                delayed[c] = self.damping_filter * delayed[c] + (1 - self.damping_filter) * self.z[c]
-                self.z[c] = delayed[c]
-
-            # Write to delay line
-            self.delay_buffer[:, self.delay_ptr] = delayed_in + delayed * (0.97 ** (1 / self.decay_time))
-            self.delay_ptr = (self.delay_ptr + 1) % self.delay_samples
-
-            # Mix dry/wet
-            output[i] = in_sample * dry + delayed * wet
-
-        return output
+        # Mix dry/wet
+        return (data * dry + tail * wet).astype(data.dtype)
 
 
 class LiteReverb(CoreAudioEffect):
@@ -85,80 +70,66 @@ class LiteReverb(CoreAudioEffect):
         self._init_buffers()
 
     def _init_buffers(self):
-        # Pre-delay buffer (stereo)
+        # Pre-delay line (stereo)
         self.pre_delay_samples = int(self.pre_delay * (self.sample_rate/1000))
-        self.pre_delay_buf = np.zeros((2, self.pre_delay_samples))
-        self.pre_delay_ptr = 0
+        self.pre_delay_line = CircularDelay(self.pre_delay_samples, shape=(2,))
 
         # Comb filters (parallel)
-        self.comb_buffers = [
-            np.zeros((2, int(t * (self.sample_rate/1000))))
-            for t in self.comb_times
-        ]
-        self.comb_ptrs = [0] * 4
-
-        # All-pass filters (series)
-        self.allpass_buffers = [
-            np.zeros((2, int(t * (self.sample_rate/1000))))
-            for t in self.allpass_times
-        ]
-        self.allpass_ptrs = [0] * 2
+        self.comb_lengths = [int(t * (self.sample_rate/1000)) for t in self.comb_times]
+        self.comb_lines = [CircularDelay(length, shape=(2,)) for length in self.comb_lengths]
+
+        # All-pass filters (series). The read tap is placed for 44.1kHz, at that
+        # rate it lands on the slot being written and reads the new value back
+        self.allpass_lengths = [int(t * (self.sample_rate/1000)) for t in self.allpass_times]
+        self.allpass_delays = [int(t * 44.1) % length or length
+                               for t, length in zip(self.allpass_times, self.allpass_lengths)]
+        self.allpass_lines = [CircularDelay(length, shape=(2,)) for length in self.allpass_lengths]
 
         # Feedback coefficients
         self.comb_feedback = 0.93 ** (1 / (self.decay_time * 4))
 
+    def _allpass(self, n, data):
+        """
+        :param n: all-pass index
+        :param data: block of the stage input
+        :return:
+        """
+        line = self.allpass_lines[n]
+        delay = self.allpass_delays[n]
+        reads_back = delay == line.length
+        output = np.empty(data.shape)
+        for start, stop in segments(len(data), delay):
+            delayed = line.read(delay, stop - start)
+            ap = delayed - data[start:stop]
+            written = ap * self.diffusion + delayed * (1 - self.diffusion)
+            line.write(written)
+            output[start:stop] = (written if reads_back else delayed) + ap * self.diffusion
+        return output
+
     def process(self, data, sample_rate, flat=False):
         if flat or self.wet < 0.01:
             return data
 
         wet = self.wet
         dry = 1 - wet
-        output = np.zeros_like(data)
-        # Process each sample in block
-        for i in range(data.shape[0]):
-            # Input with pre-delay
-            in_sample = data[i]
-
-            # Write to pre-delay buffer
-            self.pre_delay_buf[:, self.pre_delay_ptr] = in_sample
-            delayed_in = self.pre_delay_buf[:,
-                         (self.pre_delay_ptr - self.pre_delay_samples) % self.pre_delay_samples
-                         ]
-            self.pre_delay_ptr = (self.pre_delay_ptr + 1) % self.pre_delay_samples
-
-            # Parallel comb filters
-            comb_sum = np.zeros(2)
-            for n in range(4):
-                buf = self.comb_buffers[n]
-                ptr = self.comb_ptrs[n]
-
-                # Read delayed sample
-                delayed = buf[:, ptr]
-
-                # Write to buffer
-                buf[:, ptr] = delayed_in + delayed * self.comb_feedback
-                self.comb_ptrs[n] = (ptr + 1) % buf.shape[1]
-
-                comb_sum += delayed
-
-            # Series all-pass filters
-            ap = comb_sum
-            for n in range(2):
-                buf = self.allpass_buffers[n]
-                ptr = self.allpass_ptrs[n]
-                read_ptr = (ptr - int(self.allpass_times[n] * 44.1)) % buf.shape[1]
-
-                delayed = buf[:, read_ptr]
-                ap = -ap + delayed
-                buf[:, ptr] = ap * self.diffusion + delayed * (1 - self.diffusion)
-
-                self.allpass_ptrs[n] = (ptr + 1) % buf.shape[1]
-                ap = delayed + ap * self.diffusion
-
-            # Mix dry/wet
-            output[i] = in_sample * dry + ap * wet
-        return output
-    
+        delayed_in = self.pre_delay_line.delay(data, self.pre_delay_samples)
+
+        # Parallel comb filters, each one sums the value it writes back
+        comb_sum = np.zeros(data.shape)
+        for line, length in zip(self.comb_lines, self.comb_lengths):
+            for start, stop in segments(len(data), length):
+                written = delayed_in[start:stop] + line.read(length, stop - start) * self.comb_feedback
+                line.write(written)
+                comb_sum[start:stop] += written
+
+        # Series all-pass filters
+        ap = comb_sum
+        for n in range(len(self.allpass_lines)):
+            ap = self._allpass(n, ap)
+
+        # Mix dry/wet
+        return (data * dry + ap * wet).astype(data.dtype)
+
 
 class ReverbEffect(CoreAudioEffect):
     def __init__(self, decay_time=2.0, pre_delay=0.0, damping=0.5, diffusion=0.7,
@@ -178,17 +149,25 @@ class ReverbEffect(CoreAudioEffect):
 
         # Delay line configuration (FDN with 4 delay lines)
         self.delay_times = np.array([37, 87, 181, 271])  # Prime numbers for FDN
-        self.delay_buffers = [np.zeros((2, int(t))) for t in self.delay_times * room_size]  # Stereo buffers
+        self.delay_lengths = [max(int(t), 1) for t in self.delay_times * room_size]
+        self.delay_lines = [CircularDelay(length, shape=(2,)) for length in self.delay_lengths]
         self.delay_idx = [0] * 4
 
-        # Pre-delay buffer
+        # Feedback loops run at the unmodulated delay, the read pointer trails
+        # the write pointer by the delay time wrapped onto the line
+        self.feedback = 0.25 * np.sqrt(1 / self.decay_time)
+        self.feedback_delays = [int(t) % length or length
+                                for t, length in zip(self.delay_times, self.delay_lengths)]
+        self._loops = []
+        for delay in self.feedback_delays:
+            a = np.zeros(delay + 1)
+            a[0], a[-1] = 1.0, -self.feedback
+            self._loops.append(a)
+        self._loop_state = [np.zeros((delay, 2)) for delay in self.feedback_delays]
+
+        # Pre-delay line
         self.pre_delay_samples = int(pre_delay * (sr/1000))
-        self.pre_delay_buffer = np.zeros((2, self.pre_delay_samples))
-        self.pre_delay_idx = 0
-
-        # All-pass filters for diffusion
-        self.allpass_buffers = [np.zeros((2, 105)), np.zeros((2, 337))]  # Stereo buffers
-        self.allpass_idx = [0, 0]
+        self.pre_delay_line = CircularDelay(self.pre_delay_samples, shape=(2,))
 
         # Modulation
         self.mod_phase = 0.0
@@ -196,8 +175,7 @@ class ReverbEffect(CoreAudioEffect):
 
         # Damping filter coefficients
         self.damping_filter = self._create_lowpass(damping)
-        self.z = np.zeros((2, 2))  # Filter state (2 channels, 2 states)
-        
+
     def _create_lowpass(self, cutoff):
         """Create a first-order lowpass filter coefficient"""
         freq = 20000 * (1 - cutoff) + 100  # 100Hz to 20kHz
@@ -210,67 +188,51 @@ class ReverbEffect(CoreAudioEffect):
         if flat:
             return data
 
-        processed = np.zeros_like(data)
-        for i in range(data.shape[0]):
-            # Pre-delay
-            pre_delayed = np.zeros(2)
-            for c in range(2):
-                self.pre_delay_buffer[c, self.pre_delay_idx] = data[i, c]
-                pre_delayed[c] = self.pre_delay_buffer[c, (
-                                                                  self.pre_delay_idx - self.pre_delay_samples) % self.pre_delay_samples]
-            self.pre_delay_idx = (self.pre_delay_idx + 1) % self.pre_delay_samples
-
-            # Input diffusion (stereo all-pass filters)
-            #diffused = pre_delayed.copy()
-            """for ap_idx in range(2):
-                buf = self.allpass_buffers[ap_idx]
-                idx = self.allpass_idx[ap_idx]
-                buf_len = buf.shape[1]
-
-                for c in range(2):  # Process each channel
-                    delayed = buf[c, (idx - 5) % buf_len]
-                    diffused[c] = diffused[c] * -self.diffusion + delayed
-                    buf[c, idx] = pre_delayed[c] + diffused[c] * self.diffusion
-                self.allpass_idx[ap_idx] = (idx + 1) % buf_len"""
-
-            # FDN processing with modulation
-            fdn_out = np.zeros(2)
-            for dly in range(4):
-                # Modulate delay time
-                mod = self.modulation_depth * np.sin(2 * np.pi * self.mod_phase)
-                mod_phase_inc = self.lfo_rates[dly] / sample_rate
-                self.mod_phase = (self.mod_phase + mod_phase_inc) % 1.0
-
-                # Read modulated delay
-                read_idx = int((self.delay_idx[dly] - self.delay_times[dly] *
-                                (1 + mod)) % len(self.delay_buffers[dly][0]))
-
-                # Get delayed sample
-                delayed = self.delay_buffers[dly][:, read_idx]
-
-                # Apply damping filter
-                """for c in range(2):  # Process each channel
-                    filtered = self.damping_filter * delayed[c] + (1 - self.damping_filter) * self.z[dly % 2, c]
-                    self.z[dly % 2, c] = filtered
-                    delayed[c] = filtered"""
-
-                # Feedback matrix (Hadamard)
-                feedback = delayed * (0.25 * np.sqrt(1 / self.decay_time))
-
-                # Write to delay line
-                self.delay_buffers[dly][:, self.delay_idx[dly]] = pre_delayed + feedback
-                self.delay_idx[dly] = (self.delay_idx[dly] + 1) % len(self.delay_buffers[dly][0])
-
-                # Sum outputs
-                fdn_out += delayed
-
-            # Mix dry/wet
-            processed[i] = data[i] * (1 - self.wet) + fdn_out * self.wet
-
-        return processed
+        frames = len(data)
+        pre_delayed = self.pre_delay_line.delay(data, self.pre_delay_samples)
+        steps = np.arange(frames)
+
+        # The LFO phase advances by every line's rate on each sample
+        increments = np.array(self.lfo_rates) / sample_rate
+        offsets = np.concatenate(([0.0], np.cumsum(increments)[:-1]))
+        base_phase = self.mod_phase + steps * increments.sum()
+
+        fdn_out = np.zeros(data.shape)
+        for dly, line in enumerate(self.delay_lines):
+            length = line.length
+            # Delay line contents for the block
+            written, self._loop_state[dly] = lfilter([1.0], self._loops[dly], pre_delayed,
+                                                     axis=0, zi=self._loop_state[dly])
+
+            # Modulated read. A read landing on the slot being written gets the
+            # new value, so delays run from 0 to the line length - 1
+            mod = self.modulation_depth * np.sin(2 * np.pi * ((base_phase + offsets[dly]) % 1.0))
+            write_idx = (self.delay_idx[dly] + steps) % length
+            read_idx = np.floor((write_idx - self.delay_times[dly] * (1 + mod)) % length).astype(np.int64)
+            delay = (write_idx - read_idx) % length
+
+            extended = np.concatenate((line.history(), written))
+            fdn_out += extended[length + steps - delay]
+            line.write(written)
+            self.delay_idx[dly] = (self.delay_idx[dly] + frames) % length
+
+        self.mod_phase = (self.mod_phase + frames * increments.sum()) % 1.0
+
+        # Mix dry/wet
+        return (data * (1 - self.wet) + fdn_out * self.wet).astype(data.dtype)
 
 
 class OptimalReverb(CoreAudioEffect):
+    """
+    Three coupled feedback lines. Each step the lines' newest left-channel
+    values feed the early reflections and the feedback, and the summed lines
+    are heard half the line length later, a single stereo component spread to
+    both channels.
+
+    Only the newest and the oldest slot of each line are ever read, so the
+    feedback runs as a 3rd order recursion (lfilter with carried state), and
+    one circular delay holds the summed signal until it reaches the output.
+    """
 
     def __init__(self, sample_rate=44100, wet=0.5, dry=0.5, predelay=.02, room_size=.6,
                  early_reflection=.2, damping=.5, diffusion=.5, decay=1.5):
@@ -287,49 +249,53 @@ class OptimalReverb(CoreAudioEffect):
         self.max_delay = int(sample_rate * (decay + predelay))
         #print("Max delay: ", self.max_delay)
 
-        self.delay_line_1 = np.zeros(self.max_delay)
-        self.delay_line_2 = np.zeros(self.max_delay)
-        self.delay_line_3 = np.zeros(self.max_delay)
-        #print(self.delay_line_1)
         self.reflection_feedback = 0.3 * self.room_size
         self.reverb_feedback = 0.7 * self.room_size
 
         self.damping_factor = np.exp(-self.damping/self.sample_rate)
         self.decay_factor = np.exp(-1.0/self.decay)
 
-    def shift_delay_line(self, delay_line, new_sample: np.ndarray):
-        """if isinstance(new_sample, np.ndarray):
-            new_sample = new_sample.item()
-        delay_line[:-1] = delay_line[1:]
-        delay_line[-1] = new_sample"""
-        sample_length = new_sample.shape[0]
-        delay_line = np.roll(delay_line,shift=sample_length)
-        delay_line[:sample_length] = new_sample
-        return delay_line
+        # The lines hold interleaved stereo samples and the output reads the
+        # last slot: the right channel of the sample (max_delay - 2) / 2 steps
+        # back for an even length, the left one (max_delay - 1) / 2 back for odd
+        self.output_channel = 1 if self.max_delay % 2 == 0 else 0
+        self.output_delay = max((self.max_delay - 1) // 2, 0)
+        self.output_line = CircularDelay(self.output_delay)
+        self._init_feedback()
+
+    def _init_feedback(self):
+        """
+        Transfer function from the left input to the sum of the three lines
+        :return:
+        """
+        er = self.er
+        rf = self.reflection_feedback
+        vf = self.reverb_feedback
+        # state: newest left value of each line
+        reverb_out = np.array([rf * er + vf, rf * er, rf * er])
+        transition = np.array([
+            [rf * er + self.damping_factor, rf * er, rf * er],
+            vf * reverb_out,
+            self.difussion * reverb_out,
+        ])
+        drive = np.ones((3, 1))
+        total = np.ones((1, 3))
+        b, a = ss2tf(transition, drive, total @ transition, total @ drive)
+        self._b = b[0]
+        self._a = a
+        self._zi = np.zeros(3)
 
     def process(self, data, sample_rate, flat=False):
         if flat:
             return data
-        
-        output = np.zeros_like(data)
-        dry_signal = self.dry * data
-        wet_signal = np.zeros_like(dry_signal)
-
-        for i in range(len(data)):
-            samples = data[i,:]
-            
-            er = self.er * (self.delay_line_1[0] + self.delay_line_2[0] + self.delay_line_3[0])
-            reverb_out = self.reflection_feedback * er + self.reverb_feedback * self.delay_line_1[0]
-            #print(self.reflection_feedback)
-            # difussion
-            
-            self.delay_line_1 = self.shift_delay_line(self.delay_line_1, samples + self.reflection_feedback * er + self.damping_factor * self.delay_line_1[0])
-            self.delay_line_2 = self.shift_delay_line(self.delay_line_2, samples + self.reverb_feedback * reverb_out)
-            self.delay_line_3 = self.shift_delay_line(self.delay_line_3, samples + self.difussion * reverb_out)
-            # decay & damping
-            wet_signal[i] = self.wet * (self.decay_factor * (self.delay_line_1[-1] + self.delay_line_2[-1] + self.delay_line_3[-1]))
-        
-        output = dry_signal + wet_signal
 
+        left = data[:, 0].astype(np.float64)
+        lines, self._zi = lfilter(self._b, self._a, left, zi=self._zi)
+        if self.output_channel:
+            # the right values differ from the left ones only by the input
+            lines = lines + 3 * (data[:, 1] - left)
 
-        return output
+        delayed = self.output_line.delay(lines, self.output_delay)
+        # decay & damping
+        wet_signal = self.wet * self.decay_factor * delayed
+        return (self.dry * data + wet_signal[:, None]).astype(data.dtype)
@@ -5,3 +5,4 @@ class AudioEngineError(Enum):
     CHANNEL_QUEUE_ERROR = "channel.queue_file.error"
     CHANNEL_LOAD_ERROR = "channel.load_file.error"
     PLAYBACK_ERROR = "engine.play.error"
+    RENDER_ERROR = "engine.render.error"
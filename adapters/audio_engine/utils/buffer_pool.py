@@ -0,0 +1,61 @@
+import threading
+
+import numpy as np
+
+
+class BufferPool:
+    """
+    Preallocated (frames, channels) float32 blocks for the render path.
+    acquire() only allocates when the pool runs dry, which is counted in
+    allocations so steady-state playback can be checked to allocate nothing.
+    Mixer render threads share it: taking and returning a block are single
+    list operations, only growing the pool takes a lock.
+    """
+
+    def __init__(self, frames: int, channels: int = 2, count: int = 8):
+        """
+        :param frames: frames per block
+        :param channels:
+        :param count: blocks allocated up front
+        """
+        self.frames = frames
+        self.channels = channels
+        self._free = [self._new_buffer() for _ in range(count)]
+        self.size = count
+        self.allocations = 0
+        self._grow_lock = threading.Lock()
+
+    def _new_buffer(self):
+        return np.zeros((self.frames, self.channels), dtype=np.float32)
+
+    def acquire(self) -> np.ndarray:
+        """
+        Take a block from the pool. Contents are undefined
+        :return:
+        """
+        try:
+            return self._free.pop()
+        except IndexError:
+            # pool exhausted, grow it so the next block is served from it
+            with self._grow_lock:
+                self.allocations += 1
+                self.size += 1
+            return self._new_buffer()
+
+    def release(self, buffer: np.ndarray):
+        """
+        Give a block back to the pool
+        :param buffer:
+        :return:
+        """
+        self._free.append(buffer)
+
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            'size': self.size,
+            'free': len(self._free),
+            'allocations': self.allocations
+        }
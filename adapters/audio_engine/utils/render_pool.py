@@ -0,0 +1,104 @@
+import os
+import sys
+import threading
+
+# True on a free-threaded build (3.13t and later) running without the GIL,
+# the only case where rendering channels on several threads runs them at once
+FREE_THREADED = not getattr(sys, '_is_gil_enabled', lambda: True)()
+
+
+def default_render_workers(limit: int = 3) -> int:
+    """
+    :param limit: most threads to start
+    :return: render threads to add besides the render thread, 0 with a GIL
+    """
+    if not FREE_THREADED:
+        return 0
+    return max(0, min((os.cpu_count() or 1) - 1, limit))
+
+
+class RenderPool:
+    """
+    Threads rendering a block's jobs together with the thread that asks
+    for them. Job i always runs on the same thread, i modulo the number
+    of threads, so a channel is only ever rendered by one thread and its
+    own lock and effect state are never contended. Each block is handed
+    over with one event per thread both ways, nothing is queued or
+    allocated per block.
+    """
+
+    def __init__(self, workers: int, name: str = "RenderWorker"):
+        """
+        :param workers: threads started besides the calling one
+        :param name: thread name prefix
+        """
+        self.workers = workers
+        self._job = None
+        self._count = 0
+        self._errors = [None] * workers
+        self._go = [threading.Event() for _ in range(workers)]
+        self._done = [threading.Event() for _ in range(workers)]
+        self._running = True
+        self._threads = [threading.Thread(target=self._work, args=(slot,), daemon=True, name=f"{name}-{slot}")
+                         for slot in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def run(self, job, count: int):
+        """
+        Call job(index) for every index below count and wait for all of them
+        :param job: called from several threads at once, with distinct indexes
+        :param count:
+        :return:
+        """
+        if count < 2 or not self._running:
+            for index in range(count):
+                job(index)
+            return
+        self._job, self._count = job, count
+        busy = min(self.workers, count - 1)
+        for slot in range(busy):
+            self._go[slot].set()
+        stride = self.workers + 1
+        try:
+            for index in range(0, count, stride):
+                job(index)
+        finally:
+            for slot in range(busy):
+                self._done[slot].wait()
+                self._done[slot].clear()
+            self._job = None
+        for slot in range(busy):
+            error, self._errors[slot] = self._errors[slot], None
+            if error is not None:
+                raise error
+
+    def _work(self, slot: int):
+        go, done = self._go[slot], self._done[slot]
+        stride = self.workers + 1
+        while True:
+            go.wait()
+            go.clear()
+            if not self._running:
+                done.set()
+                break
+            try:
+                job = self._job
+                for index in range(slot + 1, self._count, stride):
+                    job(index)
+            except Exception as e:
+                self._errors[slot] = e
+            finally:
+                done.set()
+
+    def close(self):
+        """
+        Stop the threads, run() then renders on the calling thread alone
+        :return:
+        """
+        self._running = False
+        for event in self._go:
+            event.set()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=1.0)
@@ -0,0 +1,156 @@
+from fractions import Fraction
+from functools import lru_cache
+
+import numpy as np
+import scipy.signal as sps
+
+
+def resample_factors(target_rate: int, source_rate: int):
+    """
+    Get the (up, down) factors to go from source_rate to target_rate
+    :param target_rate:
+    :param source_rate:
+    :return:
+    """
+    frac = Fraction(target_rate, source_rate).limit_denominator(1000)
+    return frac.numerator, frac.denominator
+
+
+@lru_cache(maxsize=16)
+def filter_taps(up: int, down: int):
+    """
+    Design the anti-aliasing filter the same way resample_poly does, cached per
+    (up, down) ratio so the design cost is paid once per file rate.
+    :param up:
+    :param down:
+    :return: (taps, filter half length)
+    """
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    taps = sps.firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0)) * up
+    taps = taps.astype(np.float32)
+    taps.setflags(write=False)
+    return taps, half_len
+
+
+@lru_cache(maxsize=256)
+def shifted_taps(up: int, down: int, shift: int):
+    """
+    Filter taps delayed by shift upsampled samples. upfirdn only produces outputs
+    on multiples of down, the shift moves that grid onto the stream's phase.
+    :param up:
+    :param down:
+    :param shift:
+    :return:
+    """
+    taps, _ = filter_taps(up, down)
+    if not shift:
+        return taps
+    shifted = np.concatenate((np.zeros(shift, dtype=np.float32), taps))
+    shifted.setflags(write=False)
+    return shifted
+
+
+class StreamingResampler:
+    """
+    Polyphase resampler that keeps its input history between blocks, so a
+    stream can be fed in arbitrary chunk sizes without edge artifacts.
+    The output is aligned like scipy's resample_poly (filter delay removed).
+    """
+
+    def __init__(self, up: int = 1, down: int = 1, channels: int = 2):
+        """
+        :param up:
+        :param down:
+        :param channels:
+        """
+        self.channels = channels
+        self.up = None
+        self.down = None
+        self.configure(up, down)
+
+    @property
+    def passthrough(self):
+        return self.up == self.down
+
+    def configure(self, up: int, down: int):
+        """
+        Switch to a new ratio. Keeps the history if the ratio is unchanged so
+        consecutive files at the same rate join seamlessly.
+        :param up:
+        :param down:
+        :return:
+        """
+        if (up, down) == (self.up, self.down):
+            return
+        self.up = up
+        self.down = down
+        if up == down:
+            self._width, self._half_len = 1, 0
+        else:
+            taps, self._half_len = filter_taps(up, down)
+            # input frames the filter spans
+            self._width = -(-len(taps) // up)
+        self.reset()
+
+    def reset(self):
+        """
+        Drop the history, used on seek and on a new stream
+        :return:
+        """
+        width = self._width
+        self._history = np.zeros((width - 1, self.channels), dtype=np.float32)
+        # position of the next output sample on the upsampled time axis,
+        # relative to the first sample of the history
+        self._t = (width - 1) * self.up + self._half_len
+
+    def output_frames(self, input_frames: int) -> int:
+        """
+        Number of frames the next call to process will return for input_frames
+        :param input_frames:
+        :return:
+        """
+        if self.passthrough:
+            return input_frames
+        last = (len(self._history) + input_frames) * self.up - 1
+        if self._t > last:
+            return 0
+        return (last - self._t) // self.down + 1
+
+    def input_frames(self, output_frames: int) -> int:
+        """
+        Minimum number of input frames needed to produce output_frames
+        :param output_frames:
+        :return:
+        """
+        if self.passthrough:
+            return output_frames
+        last_t = self._t + (output_frames - 1) * self.down
+        return max(0, last_t // self.up + 1 - len(self._history))
+
+    def process(self, data: np.ndarray) -> np.ndarray:
+        """
+        Resample the next chunk of the stream
+        :param data: array of shape (frames, channels)
+        :return: resampled frames, may be empty for very short chunks
+        """
+        if self.passthrough:
+            return data
+
+        width = self._width
+        extended = np.concatenate((self._history, data), axis=0)
+        count = self.output_frames(len(data))
+
+        if count:
+            shift = -self._t % self.down
+            first = (self._t + shift) // self.down
+            output = sps.upfirdn(shifted_taps(self.up, self.down, shift), extended,
+                                 self.up, self.down, axis=0)[first:first + count]
+        else:
+            output = np.zeros((0, self.channels), dtype=np.float32)
+
+        # advance the time axis by the frames that leave the history
+        consumed = len(extended) - (width - 1)
+        self._t += count * self.down - consumed * self.up
+        self._history = extended[consumed:].copy()
+        return output.astype(np.float32, copy=False)
@@ -0,0 +1,184 @@
+import numpy as np
+
+
+class AudioRingBuffer:
+    """
+    Preallocated single-producer/single-consumer ring buffer for float32 PCM.
+
+    The producer only ever advances ``_write_index`` and the consumer only ever
+    advances ``_read_index``. Both indices grow monotonically and are wrapped on
+    access, so each side can read the other's index without a lock (a single
+    attribute store is atomic in CPython).
+
+    The producer drops what it wrote so far with flush(), which only moves a
+    producer owned marker. The consumer skips up to it on its next read, so a
+    flush is safe while both sides are running.
+    """
+
+    def __init__(self, capacity: int, channels: int = 2, low_watermark: int = None, high_watermark: int = None):
+        """
+        :param capacity: size of the buffer in frames
+        :param channels:
+        :param low_watermark: fill level in frames at which the consumer asks for more data
+        :param high_watermark: fill level in frames the producer refills up to
+        """
+        self.capacity = int(capacity)
+        self.channels = channels
+        self.low_watermark = self.capacity // 4 if low_watermark is None else int(low_watermark)
+        self.high_watermark = self.capacity if high_watermark is None else min(int(high_watermark), self.capacity)
+        self.buffer = np.zeros((self.capacity, channels), dtype=np.float32)
+        self._write_index = 0
+        self._read_index = 0
+        self._flush_index = 0  # frames before it are stale, set by the producer
+
+
+        # stats, each written by one side only
+        self._frames_written = 0
+        self._frames_read = 0
+        self._frames_flushed = 0
+        self._short_reads = 0
+        self._min_fill = self.capacity
+        self._max_fill = 0
+
+    @property
+    def write_position(self) -> int:
+        """
+        Total frames written since creation
+        :return:
+        """
+        return self._write_index
+
+    @property
+    def read_position(self) -> int:
+        """
+        Total frames read since creation
+        :return:
+        """
+        return self._read_index
+
+    def _start(self) -> int:
+        # first frame the consumer will read, flushed frames count as read
+        return max(self._read_index, self._flush_index)
+
+    def fill_level(self) -> int:
+        """
+        Frames available to the consumer
+        :return:
+        """
+        return self._write_index - self._start()
+
+    def below_low_watermark(self) -> bool:
+        """
+        :return:
+        """
+        return self._write_index - self._start() <= self.low_watermark
+
+    def free_space(self) -> int:
+        """
+        Frames the producer can write without overwriting unread data
+        :return:
+        """
+        return self.capacity - (self._write_index - self._start())
+
+    def write(self, data: np.ndarray) -> int:
+        """
+        Producer side. Copy as many frames of data as fit into the buffer.
+        Mono data with a single column is broadcast to all channels.
+        :param data: array of shape (frames, channels) or (frames, 1)
+        :return: frames written
+        """
+        write_index = self._write_index
+        frames = min(len(data), self.capacity - (write_index - self._start()))
+        if frames <= 0:
+            return 0
+
+        start = write_index % self.capacity
+        first = min(frames, self.capacity - start)
+        self.buffer[start:start + first] = data[:first]
+        if first < frames:
+            self.buffer[:frames - first] = data[first:frames]
+
+        # publish only after the copy is complete
+        self._write_index = write_index + frames
+        self._frames_written += frames
+        fill = self._write_index - self._start()
+        if fill > self._max_fill:
+            self._max_fill = fill
+        return frames
+
+    def read_into(self, out: np.ndarray) -> int:
+        """
+        Consumer side. Copy up to len(out) frames into out without allocating.
+        Frames that could not be served are left untouched.
+        :param out: array of shape (frames, channels)
+        :return: frames read
+        """
+        read_index = self._read_index
+        flush_index = self._flush_index
+        if read_index < flush_index:
+            # skip what the producer flushed
+            self._frames_flushed += flush_index - read_index
+            read_index = self._read_index = flush_index
+        available = self._write_index - read_index
+        if available < self._min_fill:
+            self._min_fill = available
+
+        frames = min(len(out), available)
+        if frames < len(out):
+            self._short_reads += 1
+        if frames <= 0:
+            return 0
+
+        start = read_index % self.capacity
+        first = min(frames, self.capacity - start)
+        out[:first] = self.buffer[start:start + first]
+        if first < frames:
+            out[first:frames] = self.buffer[:frames - first]
+
+        self._read_index = read_index + frames
+        self._frames_read += frames
+        return frames
+
+    def flush(self):
+        """
+        Producer side. Drop everything written so far, the consumer skips it
+        on its next read instead of playing it
+        :return:
+        """
+        self._flush_index = self._write_index
+
+    def clear(self):
+        """
+        Drop all buffered data. Only safe while neither side is reading or writing
+        :return:
+        """
+        self._read_index = self._write_index
+
+    def reset_stats(self):
+        """
+        :return:
+        """
+        self._frames_written = 0
+        self._frames_read = 0
+        self._frames_flushed = 0
+        self._short_reads = 0
+        self._min_fill = self.fill_level()
+        self._max_fill = self.fill_level()
+
+    def stats(self) -> dict:
+        """
+        Snapshot of the buffer fill statistics
+        :return:
+        """
+        return {
+            'capacity': self.capacity,
+            'low_watermark': self.low_watermark,
+            'high_watermark': self.high_watermark,
+            'fill': self.fill_level(),
+            'min_fill': self._min_fill,
+            'max_fill': self._max_fill,
+            'frames_written': self._frames_written,
+            'frames_read': self._frames_read,
+            'frames_flushed': self._frames_flushed,
+            'short_reads': self._short_reads
+        }
@@ -0,0 +1,141 @@
+import numpy as np
+
+
+class SmoothedParameter:
+    """
+    A value set from the control thread and read per sample on the render
+    thread. A change becomes a linear ramp over ramp_frames instead of a step
+    at the next block, which is what causes zipper noise.
+
+    The ramp for a block is one multiply-add over a precomputed index table
+    into a preallocated buffer, so there is no per-sample Python work and no
+    allocation. Updates are published as a single tuple assignment, the
+    render side picks up the latest one at the start of each block.
+    """
+
+    def __init__(self, value: float = 0.0, ramp_time: float = 0.02, sample_rate: int = 44100,
+                 block_size: int = 512):
+        """
+        :param value: initial value
+        :param ramp_time: seconds a change takes by default
+        :param sample_rate:
+        :param block_size: largest block expected, larger ones grow the tables once
+        """
+        self.ramp_time = ramp_time
+        self.sample_rate = sample_rate
+        self._index = np.arange(1, block_size + 1, dtype=np.float32)
+        self._ramp = np.empty(block_size, dtype=np.float32)
+
+        self._current = float(value)
+        self._target = float(value)
+        self._step = 0.0
+        self._remaining = 0
+        # (start or None, target, ramp frames), written by the control thread only
+        self._update = (None, float(value), 0)
+        self._applied = self._update
+
+    @property
+    def target(self) -> float:
+        """
+        Value the parameter is heading to
+        :return:
+        """
+        return self._update[1]
+
+    @property
+    def value(self) -> float:
+        """
+        Value at the end of the last rendered block
+        :return:
+        """
+        return self._current
+
+    def is_smoothing(self) -> bool:
+        """
+        :return:
+        """
+        return self._remaining > 0 or self._update is not self._applied
+
+    def set(self, value: float, ramp_frames: int = None, start: float = None):
+        """
+        Control side. Ramp to value
+        :param value:
+        :param ramp_frames: ramp length, defaults to ramp_time, 0 jumps
+        :param start: jump to this value first, the ramp starts from it
+        :return:
+        """
+        if ramp_frames is None:
+            ramp_frames = int(self.ramp_time * self.sample_rate)
+        self._update = (None if start is None else float(start), float(value), int(ramp_frames))
+
+    def jump(self, value: float):
+        """
+        Control side. Set the value with no ramp
+        :param value:
+        :return:
+        """
+        self.set(value, 0)
+
+    def _grow(self, frames):
+        self._index = np.arange(1, frames + 1, dtype=np.float32)
+        self._ramp = np.empty(frames, dtype=np.float32)
+
+    def next_block(self, frames: int):
+        """
+        Render side. Values for the next frames samples
+        :param frames:
+        :return: a float when the value is steady, else a (frames,) array
+            that is only valid until the next call
+        """
+        update = self._update
+        if update is not self._applied:
+            self._applied = update
+            start, target, ramp_frames = update
+            if start is not None:
+                self._current = start
+            self._target = target
+            if ramp_frames > 0 and target != self._current:
+                self._step = (target - self._current) / ramp_frames
+                self._remaining = ramp_frames
+            else:
+                self._current = target
+                self._remaining = 0
+
+        if not self._remaining:
+            return self._current
+
+        if frames > len(self._index):
+            self._grow(frames)
+        count = min(frames, self._remaining)
+        ramp = self._ramp[:frames]
+        np.multiply(self._index[:count], self._step, out=ramp[:count])
+        np.add(ramp[:count], self._current, out=ramp[:count])
+        if count < frames:
+            ramp[count:].fill(self._target)
+
+        self._remaining -= count
+        self._current = self._target if not self._remaining else self._current + self._step * count
+        return ramp
+
+    @staticmethod
+    def apply(data: np.ndarray, gain, channel: int = None):
+        """
+        Multiply data by a value from next_block, in place
+        :param data: (frames, channels) block
+        :param gain: float or (frames,) array
+        :param channel: only this channel
+        :return:
+        """
+        if isinstance(gain, float):
+            if gain == 1.0:
+                return data
+            target = data if channel is None else data[:, channel]
+            np.multiply(target, gain, out=target)
+            return data
+        # one column at a time, broadcasting (frames,) against (frames, channels)
+        # would allocate ufunc buffers
+        channels = range(data.shape[1]) if channel is None else (channel,)
+        for c in channels:
+            column = data[:, c]
+            np.multiply(column, gain, out=column)
+        return data
@@ -0,0 +1,116 @@
+import threading
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from adapters.audio_engine.utils.ring_buffer import AudioRingBuffer
+from core import logger
+
+
+class SpectrumAnalyzer(threading.Thread):
+    """
+    Analysis tap on the output. The audio callback only copies its block into
+    a lock-free ring, this thread drains it at the UI frame rate and runs one
+    windowed rfft over every hop position it got since the last frame. Bins
+    are summed into log spaced bands and the levels fall back slowly, like a
+    meter. The handler gets one band array per UI frame.
+    """
+
+    def __init__(self, handler, sample_rate=44100, fft_size=2048, bands=32, fps=30.0, min_freq=30.0,
+                 max_freq=16000.0, floor_db=-90.0, falloff_db=24.0):
+        """
+        :param handler: called with a (bands,) float32 array of dB levels
+        :param sample_rate:
+        :param fft_size: frames per spectrum
+        :param bands:
+        :param fps: arrays published per second
+        :param min_freq: lower edge of the first band, Hz
+        :param max_freq: upper edge of the last band, Hz
+        :param floor_db: level of silence
+        :param falloff_db: dB per second a band falls back by
+        """
+        super().__init__(daemon=True, name="SpectrumAnalyzer")
+        self.handler = handler
+        self.sample_rate = sample_rate
+        self.fft_size = fft_size
+        self.hop = fft_size // 2
+        self.interval = 1.0 / fps
+        self.floor_db = floor_db
+        self._falloff = falloff_db * self.hop / sample_rate  # per hop
+
+        # a second of audio, the callback drops blocks if the worker falls behind
+        self.ring_buffer = AudioRingBuffer(max(sample_rate, fft_size * 4), channels=2)
+        self._block = np.empty((self.ring_buffer.capacity, 2), dtype=np.float32)
+        # mono history, the last fft_size - hop frames stay for the next batch
+        self._history = np.zeros(self.ring_buffer.capacity + fft_size, dtype=np.float32)
+        self._kept = fft_size - self.hop
+        self._window = np.hanning(fft_size).astype(np.float32)
+        # the power of a full scale sine, summed over the bins it leaks into, comes out at 0 dB
+        self._scale = 4.0 / (fft_size * np.square(self._window, dtype=np.float64).sum())
+
+        bins = fft_size // 2 + 1
+        edges = np.geomspace(min_freq, min(max_freq, sample_rate / 2), bands + 1) * fft_size / sample_rate
+        edges = np.clip(np.round(edges).astype(np.int64), 1, bins - 1)
+        # bands narrower than a bin get one bin each
+        self.edges = np.minimum(np.maximum(edges, np.arange(bands + 1) + edges[0]), bins)
+        self.levels = np.full(bands, floor_db, dtype=np.float32)
+        self._stop_event = threading.Event()
+
+    def _drain(self) -> int:
+        """
+        Move what the callback wrote into the mono history
+        :return: frames of history
+        """
+        read = self.ring_buffer.read_into(self._block)
+        history = self._history
+        kept = self._kept
+        np.add(self._block[:read, 0], self._block[:read, 1], out=history[kept:kept + read])
+        np.multiply(history[kept:kept + read], 0.5, out=history[kept:kept + read])
+        return kept + read
+
+    def analyze(self, frames: int):
+        """
+        Spectra of every hop in history[:frames], folded into self.levels
+        :param frames:
+        :return: hops analyzed
+        """
+        if frames < self.fft_size:
+            self._kept = frames
+            return 0
+        # every hop position in one batch, (hops, fft_size) strided windows
+        windows = sliding_window_view(self._history[:frames], self.fft_size)[::self.hop]
+        spectra = np.fft.rfft(windows * self._window, axis=1)
+        power = np.square(spectra.real) + np.square(spectra.imag)
+        bands = np.add.reduceat(power[:, :self.edges[-1]], self.edges[:-1], axis=1)
+        with np.errstate(divide='ignore'):
+            levels = 10 * np.log10(bands * self._scale)
+        np.maximum(levels, self.floor_db, out=levels)
+
+        current = self.levels
+        for hop_levels in levels:
+            np.maximum(hop_levels, current - self._falloff, out=current)
+
+        # keep the tail the next window starts in
+        used = len(windows) * self.hop
+        self._kept = frames - used
+        self._history[:self._kept] = self._history[used:frames]
+        return len(windows)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                hops = self.analyze(self._drain())
+                if not hops:
+                    # nothing played, let the bands fall
+                    np.maximum(self.levels - self._falloff * self.interval * self.sample_rate / self.hop,
+                               self.floor_db, out=self.levels)
+                self.handler(self.levels.copy())
+            except Exception as e:
+                logger.warning(f"[SpectrumAnalyzer] {e}")
+
+    def stop(self):
+        """
+        Safe to call from the handler, the thread ends after the current frame
+        :return:
+        """
+        self._stop_event.set()
@@ -0,0 +1,60 @@
+from bisect import bisect_right
+
+
+class TimingHistogram:
+    """
+    Durations counted in power of two microsecond buckets, from under 16 us
+    to over 131 ms. One thread records, any thread may take a snapshot:
+    record() takes no lock and does not allocate, a snapshot copies the
+    counts and may be off by the one duration being recorded.
+    """
+    # upper edges of the buckets in seconds, the last bucket has none
+    edges = tuple(2 ** k * 1e-6 for k in range(4, 18))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.edges) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        """
+        :param seconds:
+        :return:
+        """
+        self.counts[bisect_right(self.edges, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, counts: list, fraction: float) -> float:
+        """
+        Upper edge of the bucket the fraction falls in
+        :param counts: from a snapshot
+        :param fraction: 0-1
+        :return: microseconds, inf when it falls in the last bucket
+        """
+        target = fraction * sum(counts)
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if count and seen >= target:
+                return self.edges[index] * 1e6 if index < len(self.edges) else float('inf')
+        return 0.0
+
+    def snapshot(self) -> dict:
+        """
+        :return: counts per bucket with their upper edges in us, and summary values in us
+        """
+        counts = list(self.counts)
+        count, total = self.count, self.total
+        return {
+            'count': count,
+            'mean_us': total / count * 1e6 if count else 0.0,
+            'max_us': self.max * 1e6,
+            'p50_us': self.percentile(counts, 0.5),
+            'p99_us': self.percentile(counts, 0.99),
+            'edges_us': [round(edge * 1e6) for edge in self.edges],
+            'counts': counts
+        }
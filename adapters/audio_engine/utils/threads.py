@@ -1,42 +1,220 @@
-import time
 import threading
-import numpy as np
-import queue
+import time
+
+from adapters.audio_engine.utils.ring_buffer import AudioRingBuffer
+from core import logger
 
 
 data_ready = threading.Condition()
 
 
 class AudioProcessorThread(threading.Thread):
-    def __init__(self, engine, buffer_queue: queue.Queue, buffer_size, *args, **kwargs):
+    """
+    Render thread driven by consumption. It sleeps until the audio callback
+    reports that the ring buffer dropped to its low watermark, then renders
+    blocks until the ring reaches its high watermark. With nothing to play it
+    goes idle and only wakes up when the engine calls wake().
+
+    It lives as long as the output stream. A new track reaches it as a
+    channel the engine hands over through engine.swaps, taken between two
+    blocks, so the previous channel is never seen half loaded.
+    """
+    idle_timeout = 1.0  # safety net while idle, seconds
+
+    def __init__(self, engine, ring_buffer: AudioRingBuffer, buffer_size, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.engine = engine
-        self.buffer_queue = buffer_queue
+        self.ring_buffer = ring_buffer
         self.buffer_size = buffer_size
         self.running = True
+        self.idle = False
+        self.wakeups = 0
+        self.refill = threading.Event()
+        # render side view of the engine's channel, changed only by _take_swaps
+        self.channel = engine._channel
+        self._flushes = engine.flushes
+        # time the callback needs to drain the ring from high to low watermark,
+        # used as a safety timeout in case a signal is missed
+        drain = max(ring_buffer.high_watermark - ring_buffer.low_watermark, buffer_size)
+        self._refill_timeout = drain / engine.sample_rate
+        # prefill as soon as the thread starts
+        self.refill.set()
+
+    def signal(self):
+        """
+        Called from the audio callback when the ring is at its low watermark
+        :return:
+        """
+        if not self.idle and not self.refill.is_set():
+            self.refill.set()
+
+    def wake(self):
+        """
+        Called by the engine when a source may have become active
+        :return:
+        """
+        self.idle = False
+        self.refill.set()
+
+    def _take_swaps(self):
+        """
+        Switch to the channel the engine handed over, at a block boundary.
+        What was rendered from the previous one is flushed, not played
+        :return:
+        """
+        swaps = self.engine.swaps
+        if not swaps:
+            return
+        while swaps:
+            channel = swaps.popleft()
+            if self.channel is not None and self.channel is not channel:
+                self.channel.retire()
+            self.channel = channel
+        self._flushes = self.engine.flushes
+        self.ring_buffer.flush()
+        self._reset_limiter()
+
+    def _reset_limiter(self):
+        # its delay line holds the end of the previous track
+        if self.engine.limiter is not None:
+            self.engine.limiter.reset()
+
+    def _take_flush(self):
+        """
+        Drop rendered output when the engine replaced a track in place, as the mixer does
+        :return:
+        """
+        flushes = self.engine.flushes
+        if flushes != self._flushes:
+            self._flushes = flushes
+            self.ring_buffer.flush()
+            self._reset_limiter()
+
+    def _active_source(self):
+        """
+        Get the source to render from, None if there is nothing audible
+        :return:
+        """
+        mixer = self.engine.mixer
+        if mixer and mixer.has_audible_channel():
+            return mixer
+        channel = self.channel
+        if channel and channel.playing and not channel.paused:
+            return channel
+        return None
+
+    def _render(self):
+        """
+        Render blocks until the ring is at its high watermark or nothing is audible
+        :return:
+        """
+        high = self.ring_buffer.high_watermark
+        pool = self.engine.buffer_pool
+        while self.running:
+            self._take_swaps()
+            source = self._active_source()
+            if source is None:
+                # nothing to render, callback outputs silence until wake()
+                self.idle = True
+                return
+            if self.ring_buffer.fill_level() + self.buffer_size > high:
+                return
+            start = time.perf_counter()
+            buffer = pool.acquire()
+            try:
+                source.get_next_buffer(out=buffer)
+                limiter = self.engine.limiter
+                if source is self.channel and limiter is not None:
+                    # the mixer runs it as its last stage, a lone channel gets it here
+                    limiter.process(buffer)
+                # a block rendered while a track was replaced may be the old one,
+                # a stale block is better than dropping the new track's first
+                self._take_flush()
+                self.ring_buffer.write(buffer)
+            finally:
+                pool.release(buffer)
+            self.engine.render_times.record(time.perf_counter() - start)
 
     def run(self):
         while self.running:
+            self.refill.wait(self.idle_timeout if self.idle else self._refill_timeout)
+            self.refill.clear()
+            self.wakeups += 1
             try:
-                # Get active audio source
-                if self.engine.mixer and self.engine.mixer.get_active_channel():
-                    buffer = self.engine.mixer.get_next_buffer()
-                elif self.engine._channel and self.engine._channel.playing:
-                    buffer = self.engine._channel.get_next_buffer()
-                else:
-                    buffer = np.zeros((self.buffer_size, 2), dtype=np.float32)
-                #print("Queue before put: ", self.buffer_queue.qsize())
-                #if self.buffer_queue.qsize() < 4:
-                self.buffer_queue.put(buffer)
-                    #print("Queue after put: ", self.buffer_queue.qsize())
-                    
-                time.sleep(min(self.engine.latency, 0.01))
+                self._render()
             except Exception as e:
-                print(f"Audio processing error: {e}")
-                break
+                # the block is dropped, the next wakeup renders again
+                self.engine.render_failed(e)
 
     def stop(self):
         self.running = False
+        self.refill.set()
+
+
+class PositionPublisher(threading.Thread):
+    """
+    Reports the playback position at a fixed rate, off the audio callback.
+    The callback only advances engine.frames_played, this thread reads it
+    and calls the position handler when it moved, so nothing is published
+    while paused or stopped.
+    """
+
+    def __init__(self, engine, rate: float = 10.0):
+        """
+        :param engine:
+        :param rate: reports per second
+        """
+        super().__init__(daemon=True, name="PositionPublisher")
+        self.engine = engine
+        self.interval = 1.0 / rate
+        self._stop_event = threading.Event()
+        self._last_frames = None
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frames = self.engine.frames_played
+            handler = self.engine.position_event_handler
+            if frames == self._last_frames or handler is None:
+                continue
+            self._last_frames = frames
+            try:
+                handler(self.engine.get_pos(), self.engine.get_file_length())
+            except Exception as e:
+                logger.warning(f"[PositionPublisher] Position report failed: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class StatsPublisher(threading.Thread):
+    """
+    Hands engine.stats() to the engine's stats handler at a fixed interval,
+    the snapshot is taken here so neither the callback nor the render thread
+    does any of the work
+    """
+
+    def __init__(self, engine, interval: float = 10.0):
+        """
+        :param engine:
+        :param interval: seconds
+        """
+        super().__init__(daemon=True, name="StatsPublisher")
+        self.engine = engine
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            handler = self.engine.stats_event_handler
+            if handler is None:
+                continue
+            try:
+                handler(self.engine.stats())
+            except Exception as e:
+                logger.warning(f"[StatsPublisher] Stats report failed: {e}")
+
+    def stop(self):
+        self._stop_event.set()
 
 
 class CustomThread(threading.Thread):
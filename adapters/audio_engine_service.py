@@ -3,8 +3,9 @@ from core import logger
 from core.event_bus import EventBus
 from domain.models.song import Track
 from .audio_engine.core.engine import CoreEngine
+from .audio_engine.core.remote import EngineProcess
 from adapters.audio_engine.errors import AudioEngineError
-from core.constants.events import PlaybackEngineEvent, PlaybackCommandEvent
+from core.constants.events import PlaybackEngineEvent, PlaybackCommandEvent, QueueEvent
 
 
 class AudioServiceState(Enum):
@@ -14,17 +15,34 @@ class AudioServiceState(Enum):
 
 class AudioEngineService:
 
-    def __init__(self, event_bus: EventBus, buffer_size=4096, samplerate=44100):
+    def __init__(self, event_bus: EventBus, buffer_size=4096, samplerate=44100, cache_dir: str = None,
+                 cache_budget: int = 1 << 30, repo=None, position_rate: float = 5.0,
+                 stats_interval: float = 10.0, isolated: bool = False):
         """
         :param event_bus:
         :param buffer_size:
         :param samplerate:
+        :param cache_dir: decoded PCM cache location, no cache if None
+        :param cache_budget: bytes the PCM cache may use
+        :param repo: MusicRepository, MP3 seek indexes are read from it
+        :param position_rate: PLAYBACK_PROGRESS events per second, the bus throttles them to 5
+        :param stats_interval: seconds between PLAYBACK_ENGINE_STATS events
+        :param isolated: run the engine in a child process, away from the UI's GIL
         """
-        self.__engine = CoreEngine(buffer_size=buffer_size, sample_rate=samplerate)
+        self.repo = repo
+        if isolated:
+            self.__engine = EngineProcess(buffer_size=buffer_size, sample_rate=samplerate,
+                                          position_rate=position_rate)
+        else:
+            self.__engine = CoreEngine(buffer_size=buffer_size, sample_rate=samplerate, position_rate=position_rate)
+        if cache_dir:
+            self.__engine.enable_pcm_cache(cache_dir, cache_budget)
         self.__engine.register_end_event(self.handle_song_end_event)
         self.__engine.register_playback_event(self.handle_playback_events)
         self.__engine.register_position_event(self.receive_playback_pos)
         self.__engine.register_error_event(self.handle_error_event)
+        self.__engine.register_stats_event(self.receive_engine_stats, stats_interval)
+        self._last_stats = None
 
         self.bus = event_bus
         self._current_track: Track | None = None
@@ -35,8 +53,15 @@ class AudioEngineService:
         self.bus.subscribe(PlaybackCommandEvent.PLAYBACK_PAUSE, lambda _: self.__engine.pause())
         self.bus.subscribe(PlaybackCommandEvent.PLAYBACK_RESUME, lambda _: self.__engine.resume())
         self.bus.subscribe(PlaybackCommandEvent.PLAYBACK_STOP, lambda _: self.__engine.stop())
+        self.bus.subscribe(PlaybackCommandEvent.PLAYBACK_SEEK, self.__engine.set_position)
         self.bus.subscribe(PlaybackEngineEvent.KILL, self.receive_engine_termination)
         self.bus.subscribe(PlaybackEngineEvent.PLAYBACK_ENGINE_VOLUME, self.__engine.set_volume)
+        self.bus.subscribe(PlaybackEngineEvent.PLAYBACK_ENGINE_NORMALIZATION, self.__engine.set_normalization)
+        # the analyzer only runs while something shows the spectrum
+        self.bus.watch_subscribers(PlaybackEngineEvent.PLAYBACK_SPECTRUM, self.handle_spectrum_subscribers)
+        if self.bus.has_subscribers(PlaybackEngineEvent.PLAYBACK_SPECTRUM):
+            self.handle_spectrum_subscribers(1)
+        self.bus.subscribe(QueueEvent.QUEUE_UPCOMING, self.receive_upcoming_tracks)
     @property
     def state(self):
         return AudioServiceState.ACTIVE if self.__engine.is_playing() else AudioServiceState.DORMANT
@@ -89,6 +114,46 @@ class AudioEngineService:
             'track_id': self._current_track.id if self._current_track else None
         })
 
+    def receive_engine_stats(self, stats: dict):
+        """
+        Publish the engine's telemetry and log the dropouts since the last
+        snapshot, so they line up with whatever else was logged then
+        :param stats: CoreEngine.stats()
+        :return:
+        """
+        last, self._last_stats = self._last_stats, stats
+        if last is not None:
+            underruns = stats['underruns'] - last['underruns']
+            underflows = stats['status_flags']['output_underflow'] - last['status_flags']['output_underflow']
+            dropped = stats['render_errors'] - last['render_errors']
+            if underruns or underflows or dropped:
+                logger.warning(f"[AudioService] {underruns} underruns, {underflows} device underflows, "
+                               f"{dropped} blocks dropped on render errors in the last "
+                               f"{stats['time'] - last['time']:.0f}s, callback max {stats['callback']['max_us']:.0f}us, "
+                               f"render p99 {stats['render']['p99_us']:.0f}us")
+        self.bus.publish(PlaybackEngineEvent.PLAYBACK_ENGINE_STATS, stats)
+
+    def handle_spectrum_subscribers(self, count: int):
+        """
+        :param count: PLAYBACK_SPECTRUM subscribers
+        :return:
+        """
+        if count and self.__engine.spectrum is None:
+            self.__engine.enable_spectrum(self.receive_spectrum)
+        elif not count:
+            self.__engine.disable_spectrum()
+
+    def receive_spectrum(self, bands):
+        """
+        :param bands: band levels in dB
+        :return:
+        """
+        if not self.bus.has_subscribers(PlaybackEngineEvent.PLAYBACK_SPECTRUM):
+            # subscribers that were garbage collected do not unsubscribe
+            self.__engine.disable_spectrum()
+            return
+        self.bus.publish(PlaybackEngineEvent.PLAYBACK_SPECTRUM, bands)
+
     def receive_track_request(self, track: Track):
         """
         :param track:
@@ -96,7 +161,11 @@ class AudioEngineService:
         """
         self._current_track = track
         # will save the track to current track and feed it to the engine for playback
-        self.__engine.load_file(track.file_path)
+        seek_index = track.seek_index
+        if seek_index is None and self.repo:
+            seek_index = self.repo.get_seek_index(track.id)
+        self.__engine.load_file(track.file_path, loudness=track.loudness_info(), track_id=track.id,
+                                seek_index=seek_index)
         # start playback
         self.__engine.play()
         if self.__engine.is_playing():
@@ -104,6 +173,14 @@ class AudioEngineService:
         # events will update automatically
         logger.info(f"[AudioService] Start playback")
 
+    def receive_upcoming_tracks(self, tracks: list):
+        """
+        Decode the next tracks into the PCM cache ahead of time
+        :param tracks: Track list in play order
+        :return:
+        """
+        self.__engine.prefetch([(track.id, track.file_path) for track in tracks])
+
     def receive_engine_termination(self, exit_code):
         """
         :param exit_code:
@@ -1,18 +1,82 @@
+import multiprocessing
 import os
 import uuid
 from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import soundfile as sf
 from core import logger
 from domain.models.song import Track
 from core.utility.tag_reader import TagReader
+from core.utility.loudness import LoudnessMeter, integrated_loudness
+from core.utility.mp3_index import build_frame_index
+from core.utility.waveform import WaveformBuilder
 from domain.enums.media_scanner import ScannerState, ScannerScanMode
 from core.constants.events import MediaScannerEvent
 
 
+def analyze_track(path: str, loudness: bool = True, seek_index: bool = True, waveform: bool = True,
+                  block_seconds: float = 10.0) -> dict:
+    """
+    Worker process side of the scan. The file is decoded once, the loudness
+    meter and the waveform builder are fed the same blocks.
+    :param path:
+    :param loudness: measure loudness, see LoudnessMeter.result
+    :param seek_index: build the frame index of MP3 files
+    :param waveform: build the waveform peaks
+    :param block_seconds: decoded at a time
+    :return: {'loudness': LoudnessMeter result or None, 'seek_index': bytes or None, 'waveform': bytes or None}
+    """
+    result = {'loudness': None, 'seek_index': None, 'waveform': None}
+    if loudness or waveform:
+        try:
+            with sf.SoundFile(path, 'r') as audio_file:
+                meter = LoudnessMeter(audio_file.samplerate, audio_file.channels) if loudness else None
+                builder = WaveformBuilder(audio_file.frames) if waveform else None
+                for block in audio_file.blocks(blocksize=int(block_seconds * audio_file.samplerate),
+                                               always_2d=True, dtype='float32'):
+                    if meter:
+                        meter.process(block)
+                    if builder:
+                        builder.process(block)
+            if meter:
+                result['loudness'] = meter.result()
+            if builder:
+                peaks = builder.result()
+                result['waveform'] = peaks.to_bytes() if peaks else None
+        except Exception as e:
+            logger.warning(f"[Media Scanner] Analysis failed for {path}: {e}")
+    if seek_index and path.lower().endswith('.mp3'):
+        try:
+            index = build_frame_index(path)
+            result['seek_index'] = index.to_bytes() if index else None
+        except Exception as e:
+            logger.warning(f"[Media Scanner] Frame index failed for {path}: {e}")
+    return result
+
+
 class MediaScanner:
     extensions = ["mp4", "mp3"]
 
-    def __init__(self, event_bus, extensions: List[str] = None, music_directories: List[str] = None, scheduler=None):
+    def __init__(self, event_bus, extensions: List[str] = None, music_directories: List[str] = None, scheduler=None,
+                 analyze_loudness: bool = True, build_seek_index: bool = True, build_waveform: bool = True,
+                 analysis_workers: int = None):
+        """
+        :param event_bus:
+        :param extensions:
+        :param music_directories:
+        :param scheduler:
+        :param analyze_loudness: measure loudness and true peak of scanned files
+        :param build_seek_index: index the frames of MP3 files for fast seeks
+        :param build_waveform: store waveform peaks for the seek bar
+        :param analysis_workers: analysis processes, defaults to the cpu count
+        """
         self.bus = event_bus
+        self.analyze_loudness = analyze_loudness
+        self.build_seek_index = build_seek_index
+        self.build_waveform = build_waveform
+        self.analysis_workers = analysis_workers
         self.status: ScannerState = ScannerState.STOP
         self.bus.subscribe(MediaScannerEvent.SCANNER_START, self.receive_scan_events)
 
@@ -128,8 +192,17 @@ class MediaScanner:
                 if directory in self._to_be_scanned:
                     self._to_be_scanned.remove(directory)
             logger.info("[Media Scanner] Finished scanning")
+            # the library gets the tracks now, their analysis follows
             self.bus.publish(MediaScannerEvent.SCANNER_FINISHED, scanned)
 
+            if self.analyze_loudness or self.build_seek_index or self.build_waveform:
+                try:
+                    self.analyze(scanned)
+                except Exception as e:
+                    # optional data, tracks analyzed before the failure keep theirs
+                    logger.error(f"[Media Scanner] Analysis failed: {e}")
+                self.bus.publish(MediaScannerEvent.SCANNER_ANALYZED, scanned)
+
         except Exception as e:
             logger.error(f"[Media Scanner] Scan failed: {e}")
             self.status = ScannerState.STOP
@@ -138,6 +211,48 @@ class MediaScanner:
         finally:
             self.status = ScannerState.COMPLETE
 
+    def analyze(self, tracks: List[Track]):
+        """
+        Fill in track and album loudness, the MP3 seek indexes and the waveform
+        peaks, files are decoded and measured in a pool of worker processes
+        :param tracks:
+        :return:
+        """
+        if not tracks:
+            return
+
+        logger.info(f"[Media Scanner] Analyzing {len(tracks)} files")
+        albums = {}
+        worker = partial(analyze_track, loudness=self.analyze_loudness, seek_index=self.build_seek_index,
+                         waveform=self.build_waveform)
+        # spawned, forking would copy the audio and UI threads' locks into the workers
+        with ProcessPoolExecutor(max_workers=self.analysis_workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = executor.map(worker, [track.file_path for track in tracks], chunksize=4)
+            for track, analysis in zip(tracks, results):
+                track.seek_index = analysis['seek_index']
+                track.waveform = analysis['waveform']
+                result = analysis['loudness']
+                if result is None:
+                    continue
+                track.loudness = result['loudness']
+                track.true_peak = result['true_peak']
+                if track.album and track.album != TagReader.album:
+                    albums.setdefault((track.album, track.artist), []).append((track, result))
+                else:
+                    # no album, it is its own album
+                    track.album_loudness = track.loudness
+                    track.album_peak = track.true_peak
+
+        # album loudness gates the blocks of every track together
+        for members in albums.values():
+            loudness = integrated_loudness(np.concatenate([result['blocks'] for _, result in members]))
+            peaks = [track.true_peak for track, _ in members if track.true_peak is not None]
+            peak = max(peaks) if peaks else None
+            for track, _ in members:
+                track.album_loudness = loudness
+                track.album_peak = peak
+
     def schedule_scan(self, after: int):
         """
         Schedule to scan after some time
@@ -7,6 +7,19 @@ from domain.models.song import Track, TrackItem
 
 
 class MusicRepository:
+    # columns added after the first release, created on older databases by _migrate
+    added_columns = {
+        'loudness': 'REAL',
+        'true_peak': 'REAL',
+        'album_loudness': 'REAL',
+        'album_peak': 'REAL',
+        'seek_index': 'BLOB',
+        'waveform': 'BLOB'
+    }
+    # what track lists fetch, the seek index and waveform blobs are read one track at a time
+    track_columns = ('id', 'title', 'artist', 'album', 'duration', 'file_path', 'genre', 'year', 'play_count',
+                     'metadata', 'thumbnail', 'loudness', 'true_peak', 'album_loudness', 'album_peak')
+
     def __init__(self, db_path: str):
         self.db_path = db_path
         self._init_db()
@@ -28,7 +41,10 @@ class MusicRepository:
                     play_count INTEGER DEFAULT 0,
                     metadata TEXT,
                     last_played DATETIME,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    loudness REAL, true_peak REAL,
+                    album_loudness REAL, album_peak REAL,
+                    seek_index BLOB, waveform BLOB
                 );
 
                 -- INDEXES for O(log n) search and sort speed
@@ -48,6 +64,19 @@ class MusicRepository:
                     FOREIGN KEY(track_id) REFERENCES tracks(id) ON DELETE CASCADE
                 );
             """)
+            self._migrate(conn)
+
+    def _migrate(self, conn):
+        """
+        Add columns missing from databases created by older versions
+        :param conn:
+        :return:
+        """
+        existing = {row['name'] for row in conn.execute("PRAGMA table_info(tracks)").fetchall()}
+        for column, column_type in self.added_columns.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE tracks ADD COLUMN {column} {column_type}")
+                logger.info(f"[MusicRepo] Added column {column} to tracks")
 
     # read
     def get_all_tracks_no_blobs(self, limit=None) -> List[Track]:
@@ -57,12 +86,14 @@ class MusicRepository:
         """
         query = """
             SELECT id, title, artist, album, duration, file_path, 
-                   genre, year, play_count, metadata 
+                   genre, year, play_count, metadata,
+                   loudness, true_peak, album_loudness, album_peak
             FROM tracks LIMIT ?
         """
         query_2 =  """
             SELECT id, title, artist, album, duration, file_path, 
-                   genre, year, play_count, metadata 
+                   genre, year, play_count, metadata,
+                   loudness, true_peak, album_loudness, album_peak
             FROM tracks
         """
         with self._get_connection() as conn:
@@ -81,7 +112,8 @@ class MusicRepository:
         """
         sql = """
             SELECT id, title, artist, album, duration, file_path, 
-                   genre, year, play_count, metadata 
+                   genre, year, play_count, metadata,
+                   loudness, true_peak, album_loudness, album_peak
             FROM tracks 
             WHERE title LIKE ? OR artist LIKE ? OR album LIKE ?
             LIMIT 100
@@ -99,7 +131,8 @@ class MusicRepository:
         """
         query = """
             SELECT id, title, artist, album, duration, file_path, 
-                   genre, year, play_count, metadata 
+                   genre, year, play_count, metadata,
+                   loudness, true_peak, album_loudness, album_peak
             FROM tracks ORDER BY created_at DESC LIMIT ?
         """
         with self._get_connection() as conn:
@@ -117,7 +150,7 @@ class MusicRepository:
             return []
 
         placeholders = ', '.join(['?'] * len(track_ids))
-        query = f"SELECT * FROM tracks WHERE id IN ({placeholders})"
+        query = f"SELECT {self._select_columns()} FROM tracks WHERE id IN ({placeholders})"
 
         with self._get_connection() as conn:
             cursor = conn.execute(query, track_ids)
@@ -151,7 +184,7 @@ class MusicRepository:
         :param artist_name:
         :return:
         """
-        query = "SELECT * FROM tracks WHERE album = ? AND artist = ? ORDER BY id"
+        query = f"SELECT {self._select_columns()} FROM tracks WHERE album = ? AND artist = ? ORDER BY id"
         with self._get_connection() as conn:
             return [self._map_row_to_track(row) for row in conn.execute(query, (album_name, artist_name)).fetchall()]
 
@@ -207,36 +240,54 @@ class MusicRepository:
 
     def save_tracks(self, tracks: List[Track]):
         query = """
-            INSERT INTO tracks (id, title, artist, album, duration, file_path, thumbnail, genre, year, metadata, play_count)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE((SELECT play_count FROM tracks WHERE id=?), 0))
+            INSERT INTO tracks (id, title, artist, album, duration, file_path, thumbnail, genre, year, metadata,
+                                loudness, true_peak, album_loudness, album_peak, seek_index, waveform,
+                                play_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE((SELECT play_count FROM tracks WHERE id=?), 0))
             ON CONFLICT(id) DO UPDATE SET
                 title=excluded.title,
                 artist=excluded.artist,
                 file_path=excluded.file_path,
-                metadata=excluded.metadata
+                metadata=excluded.metadata,
+                loudness=COALESCE(excluded.loudness, tracks.loudness),
+                true_peak=COALESCE(excluded.true_peak, tracks.true_peak),
+                album_loudness=COALESCE(excluded.album_loudness, tracks.album_loudness),
+                album_peak=COALESCE(excluded.album_peak, tracks.album_peak),
+                seek_index=COALESCE(excluded.seek_index, tracks.seek_index),
+                waveform=COALESCE(excluded.waveform, tracks.waveform)
         """
         data = []
         for t in tracks:
             meta_json = json.dumps(t.metadata) if isinstance(t.metadata, dict) else "{}"
             data.append((
                 t.id, t.title, t.artist, t.album, t.duration, t.file_path,
-                t.thumbnail, t.genre, t.year, meta_json, t.id
+                t.thumbnail, t.genre, t.year, meta_json,
+                t.loudness, t.true_peak, t.album_loudness, t.album_peak, t.seek_index, t.waveform, t.id
             ))
         with self._get_connection() as conn:
             conn.executemany(query, data)
             conn.commit()
 
     # helpers
+    def _select_columns(self, table: str = None) -> str:
+        """
+        :param table: alias to prefix the columns with
+        :return: track_columns for a SELECT
+        """
+        return ', '.join(f"{table}.{column}" if table else column for column in self.track_columns)
+
     def _map_row_to_track(self, row) -> Track:
         meta = json.loads(row['metadata']) if row['metadata'] else {}
+        keys = row.keys()
         # thumbnail might be missing in 'light' queries
-        thumb = row['thumbnail'] if 'thumbnail' in row.keys() else None
+        thumb = row['thumbnail'] if 'thumbnail' in keys else None
+        analysis = {column: row[column] for column in self.added_columns if column in keys}
 
         return Track(
             id=row['id'], title=row['title'], artist=row['artist'],
             album=row['album'], duration=row['duration'],
             file_path=row['file_path'], thumbnail=thumb,
-            genre=row['genre'], year=row['year'], metadata=meta
+            genre=row['genre'], year=row['year'], metadata=meta, **analysis
         )
 
     def get_all_paths(self) -> List[str]:
@@ -311,8 +362,8 @@ class MusicRepository:
         :param container_id:
         :return:
         """
-        query = """
-            SELECT t.*, ci.added_at, ci.play_count as local_play_count
+        query = f"""
+            SELECT {self._select_columns('t')}, ci.added_at, ci.play_count as local_play_count
             FROM tracks t
             JOIN container_items ci ON t.id = ci.track_id
             WHERE ci.container_id = ?
@@ -360,7 +411,8 @@ class MusicRepository:
         """
         query = """
             SELECT t.id, t.title, t.artist, t.album, t.duration, t.file_path, 
-                   t.genre, t.year, t.metadata, ci.added_at, ci.play_count as local_play_count
+                   t.genre, t.year, t.metadata, t.loudness, t.true_peak,
+                   t.album_loudness, t.album_peak, ci.added_at, ci.play_count as local_play_count
             FROM tracks t
             JOIN container_items ci ON t.id = ci.track_id
             WHERE ci.container_id = ?
@@ -465,6 +517,28 @@ class MusicRepository:
             conn.execute(query, (container_id, ))
             conn.commit()
 
+    def get_seek_index(self, track_id: str) -> Optional[bytes]:
+        """
+        MP3 frame index of a track, kept out of the list queries like the thumbnail
+        :param track_id:
+        :return:
+        """
+        query = "SELECT seek_index FROM tracks WHERE id = ?"
+        with self._get_connection() as conn:
+            row = conn.execute(query, (track_id,)).fetchone()
+            return row[0] if row and row[0] else None
+
+    def get_waveform(self, track_id: str) -> Optional[bytes]:
+        """
+        Waveform peaks of a track, see core.utility.waveform
+        :param track_id:
+        :return:
+        """
+        query = "SELECT waveform FROM tracks WHERE id = ?"
+        with self._get_connection() as conn:
+            row = conn.execute(query, (track_id,)).fetchone()
+            return row[0] if row and row[0] else None
+
     def get_thumbnail_blob(self, track_id: str) -> Optional[bytes]:
         """
         Selective fetch of thumbnail to avoid overhead in list views.
@@ -500,8 +574,8 @@ class MusicRepository:
         :param limit:
         :return:
         """
-        query = """
-        SELECT * FROM tracks
+        query = f"""
+        SELECT {self._select_columns()} FROM tracks
         WHERE last_played >= date('now', '-30 days')
         AND play_count > 0
         ORDER BY play_count DESC, last_played DESC
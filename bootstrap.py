@@ -53,7 +53,7 @@ def bootstrap():
 
     # Initialize hardware/IO Adapters
     scanner = MediaScanner(bus, scheduler=scheduler)
-    audio_engine = AudioEngineService(bus)
+    audio_engine = AudioEngineService(bus, cache_dir=os.path.join(os.getcwd(), 'assets', 'cache', 'pcm'), repo=repo)
 
     # service
     thumbnail_service = ThumbnailService(repo=repo, event_bus=bus, )
@@ -21,6 +21,9 @@ class PlaybackEngineEvent(EventType):
     PLAYBACK_LOAD_ERROR = "playback.load.error" # Data : str
     PLAYBACK_ENQUEUE_ERROR = "playback.enqueue.error" # Data: str
     PLAYBACK_ENGINE_VOLUME = "playback.engine.volume"  # Data: int volume
+    PLAYBACK_ENGINE_NORMALIZATION = "playback.engine.normalization"  # Data: None|str 'track' or 'album'
+    PLAYBACK_SPECTRUM = "playback.spectrum"  # Data: np.ndarray band levels in dB, low to high
+    PLAYBACK_ENGINE_STATS = "playback.engine.stats"  # Data: dict CoreEngine.stats() snapshot
     KILL = "engine.kill" # Data int exit code
 
 
@@ -30,6 +33,7 @@ class QueueEvent(EventType):
     QUEUE_TRACK_CHANGED = "queue.track_changed"  # Data: TrackItem
     QUEUE_SHUFFLE_TOGGLE = "queue.shuffle_toggled"  # Data: bool
     QUEUE_REPEAT_MODE = "queue.repeat_mode"  # Data: Enum (OFF, ONE, ALL)
+    QUEUE_UPCOMING = "queue.upcoming"  # Data: list [Track] next to play
 
 
 class LibraryEvent(EventType):
@@ -53,4 +57,5 @@ class MediaScannerEvent(EventType):
     SCANNER_STARTED = "scanner.started"  # Payload: str (path)
     SCANNER_PROGRESS = "scanner.progress"  # Payload: dict {"file": str, "count": int}
     SCANNER_FINISHED = "scanner.finished"  # Payload: int (count)
+    SCANNER_ANALYZED = "scanner.analyzed"  # Payload: List[Track] with loudness, seek index and waveform filled in
     SCANNER_ERROR = "scanner.error" # Payload Exception object
@@ -13,6 +13,26 @@ class DefaultEvent:
     def __init__(self):
         self._slots = []
         self._lock = threading.RLock()
+        # called with the subscriber count when a slot connects or disconnects
+        self._watchers = []
+
+    def __len__(self):
+        with self._lock:
+            return sum(1 for _, ref in self._slots if ref() is not None)
+
+    def watch(self, callback: Callable):
+        """
+        Be told when the number of slots changes, e.g. to only produce data someone listens to
+        :param callback: called with the slot count
+        :return:
+        """
+        with self._lock:
+            self._watchers.append(callback)
+
+    def _notify_watchers(self):
+        count = len(self)
+        for watcher in list(self._watchers):
+            watcher(count)
 
     def connect(self, slot, priority=0):
         """
@@ -29,6 +49,16 @@ class DefaultEvent:
 
             entry = (-priority, ref)
             bisect.insort(self._slots, entry, key=lambda x: x[0])
+        self._notify_watchers()
+
+    def disconnect(self, slot):
+        """
+        :param slot:
+        :return:
+        """
+        with self._lock:
+            self._slots = [s for s in self._slots if s[1]() is not None and s[1]() != slot]
+        self._notify_watchers()
 
     def _on_dead_reference(self, ref):
         # clean all matching deaf ref
@@ -59,6 +59,30 @@ class EventBus:
         if self._event_debugger:
             self._event_debugger.print_event_log("Subscribe", event_type, callback)
 
+    def unsubscribe(self, event_type: EventType, callback: Callable):
+        """
+        :param event_type:
+        :param callback:
+        :return:
+        """
+        self._get_event(event_type).disconnect(callback)
+
+    def has_subscribers(self, event_type: EventType) -> bool:
+        """
+        :param event_type:
+        :return:
+        """
+        return len(self._get_event(event_type)) > 0
+
+    def watch_subscribers(self, event_type: EventType, callback: Callable):
+        """
+        Get the subscriber count of an event whenever someone subscribes or unsubscribes
+        :param event_type:
+        :param callback: called with the count
+        :return:
+        """
+        self._get_event(event_type).watch(callback)
+
     def publish(self, event_type: EventType, *args, **kwargs):
         """
         Emits the data
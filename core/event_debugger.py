@@ -3,7 +3,7 @@ from core.constants.events import MediaScannerEvent, PlaybackEngineEvent
 
 
 class EventDebugger:
-    _skip = [MediaScannerEvent.SCANNER_PROGRESS, MediaScannerEvent.SCANNER_FINISHED,
+    _skip = [MediaScannerEvent.SCANNER_PROGRESS, MediaScannerEvent.SCANNER_FINISHED, MediaScannerEvent.SCANNER_ANALYZED,
              PlaybackEngineEvent.PLAYBACK_PROGRESS]
 
     def __init__(self, print_console=False):
@@ -0,0 +1,153 @@
+import numpy as np
+from scipy.signal import sosfilt, lfilter, firwin
+
+# ReplayGain 2.0 reference level
+REFERENCE_LUFS = -18.0
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+# gating blocks of 400 ms every 100 ms (75% overlap), as in ITU-R BS.1770
+SEGMENT_SECONDS = 0.1
+SEGMENTS_PER_BLOCK = 4
+OVERSAMPLING = 4
+TRUE_PEAK_TAPS = 48
+
+
+def k_weighting(sample_rate: int) -> np.ndarray:
+    """
+    BS.1770 K-weighting, the head shelf and the RLB high pass, as two
+    second order sections for any sample rate
+    :param sample_rate:
+    :return: (2, 6) sos array
+    """
+    # shelf
+    k = np.tan(np.pi * 1681.9744509555319 / sample_rate)
+    q = 0.7071752369554193
+    vh = 10 ** (3.99984385397 / 20)
+    vb = vh ** 0.499666774155
+    a0 = 1 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+             1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    # high pass
+    k = np.tan(np.pi * 38.13547087613982 / sample_rate)
+    q = 0.5003270373253953
+    a0 = 1 + k / q + k * k
+    high_pass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array([shelf, high_pass])
+
+
+def integrated_loudness(block_powers: np.ndarray) -> float | None:
+    """
+    Gated loudness of a set of 400 ms block powers, the blocks of several
+    tracks together give the album loudness
+    :param block_powers: mean square of each block, channels summed
+    :return: LUFS, None when everything is below the absolute gate
+    """
+    block_powers = np.asarray(block_powers, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        levels = -0.691 + 10 * np.log10(block_powers)
+    gated = block_powers[levels > ABSOLUTE_GATE]
+    if not len(gated):
+        return None
+    relative = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE
+    gated = block_powers[(levels > ABSOLUTE_GATE) & (levels > relative)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def normalization_gain(loudness: float | None, peak_db: float | None, reference: float = REFERENCE_LUFS,
+                       max_peak_db: float = -1.0) -> float:
+    """
+    Linear gain bringing a track to the reference level, lowered when the
+    true peak would go over max_peak_db
+    :param loudness: LUFS, None gives unity gain
+    :param peak_db: true peak in dBTP
+    :param reference:
+    :param max_peak_db:
+    :return:
+    """
+    if loudness is None:
+        return 1.0
+    gain_db = reference - loudness
+    if peak_db is not None:
+        gain_db = min(gain_db, max_peak_db - peak_db)
+    return float(10 ** (gain_db / 20))
+
+
+class LoudnessMeter:
+    """
+    Integrated loudness and true peak of a stream fed block by block. The
+    filters carry their state between blocks so the result does not depend
+    on how the audio was split.
+    """
+
+    def __init__(self, sample_rate: int, channels: int):
+        """
+        :param sample_rate:
+        :param channels:
+        """
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sos = k_weighting(sample_rate)
+        self._zi = np.zeros((len(self.sos), 2, channels))
+        self._segment = int(SEGMENT_SECONDS * sample_rate)
+        self._pending = np.zeros((0, channels))  # filtered frames short of a full segment
+        self._segments = []
+
+        # polyphase 4x interpolator, one filter per phase
+        self._phases = firwin(TRUE_PEAK_TAPS, 1.0 / OVERSAMPLING).reshape(-1, OVERSAMPLING).T * OVERSAMPLING
+        self._phase_zi = np.zeros((OVERSAMPLING, self._phases.shape[1] - 1, channels))
+        self.peak = 0.0
+
+    def process(self, data: np.ndarray):
+        """
+        :param data: (frames, channels)
+        :return:
+        """
+        data = np.asarray(data, dtype=np.float64)
+        filtered, self._zi = sosfilt(self.sos, data, axis=0, zi=self._zi)
+
+        filtered = np.concatenate((self._pending, filtered)) if len(self._pending) else filtered
+        count = len(filtered) // self._segment
+        whole = filtered[:count * self._segment].reshape(count, self._segment, self.channels)
+        # mean square per segment, channel weights are all 1 for mono and stereo
+        self._segments.append(np.square(whole).mean(axis=1).sum(axis=1))
+        self._pending = filtered[count * self._segment:]
+
+        peak = np.abs(data).max(initial=0.0)
+        for phase in range(OVERSAMPLING):
+            upsampled, self._phase_zi[phase] = lfilter(self._phases[phase], [1.0], data, axis=0,
+                                                       zi=self._phase_zi[phase])
+            peak = max(peak, np.abs(upsampled).max(initial=0.0))
+        self.peak = max(self.peak, float(peak))
+
+    def block_powers(self) -> np.ndarray:
+        """
+        Mean square of every full 400 ms gating block so far
+        :return:
+        """
+        segments = np.concatenate(self._segments) if self._segments else np.zeros(0)
+        if len(segments) < SEGMENTS_PER_BLOCK:
+            return np.zeros(0)
+        return np.lib.stride_tricks.sliding_window_view(segments, SEGMENTS_PER_BLOCK).mean(axis=1)
+
+    def integrated(self) -> float | None:
+        """
+        :return: LUFS
+        """
+        return integrated_loudness(self.block_powers())
+
+    def true_peak_db(self) -> float | None:
+        """
+        :return: dBTP, None for digital silence
+        """
+        return float(20 * np.log10(self.peak)) if self.peak > 0 else None
+
+    def result(self) -> dict:
+        """
+        :return: {'loudness': LUFS, 'true_peak': dBTP, 'blocks': gating block powers}
+        """
+        return {
+            'loudness': self.integrated(),
+            'true_peak': self.true_peak_db(),
+            'blocks': self.block_powers().astype(np.float32)
+        }
@@ -0,0 +1,196 @@
+import struct
+
+import numpy as np
+
+# kbps by bitrate index, layer III
+_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),  # MPEG 1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)  # MPEG 2 and 2.5
+}
+# Hz by version bits then sample rate index
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+# mpg123 trims this on top of the encoder delay for gapless playback
+DECODER_DELAY = 529
+
+_HEADER = struct.Struct('<4sBHHIIIBH')
+_MAGIC = b'MP3I'
+_VERSION = 1
+
+
+def _frame_header(data: bytes, pos: int):
+    """
+    :param data:
+    :param pos:
+    :return: (frame length, samples per frame, sample rate) or None if pos is not a layer III header
+    """
+    if data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    b1, b2 = data[pos + 1], data[pos + 2]
+    version, layer = (b1 >> 3) & 3, (b1 >> 1) & 3
+    bitrate_index, rate_index, padding = b2 >> 4, (b2 >> 2) & 3, (b2 >> 1) & 1
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _BITRATES[1 if version == 3 else 2][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    samples = 1152 if version == 3 else 576
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate
+
+
+def _info_tag(frame: bytes):
+    """
+    :param frame:
+    :return: (position of the Xing/Info tag, its flags) or None
+    """
+    for tag in (b'Xing', b'Info'):
+        start = frame.find(tag)
+        if 0 <= start < 64:
+            return start, struct.unpack('>I', frame[start + 4:start + 8])[0]
+    return None
+
+
+def _encoder_delay(frame: bytes):
+    """
+    Encoder delay from the LAME tag of a Xing/Info frame
+    :param frame: the whole first frame
+    :return: None if frame is not a Xing/Info frame, 0 without a LAME tag
+    """
+    tag = _info_tag(frame)
+    if tag is None:
+        return None
+    start, flags = tag
+    lame = start + 8 + 4 * bool(flags & 1) + 4 * bool(flags & 2) + 100 * bool(flags & 4) + 4 * bool(flags & 8)
+    if frame[lame:lame + 4] not in (b'LAME', b'Lavf', b'Lavc') or len(frame) < lame + 24:
+        return 0
+    # 12 bits delay, 12 bits padding
+    return (frame[lame + 21] << 4) | (frame[lame + 22] >> 4)
+
+
+class FrameIndex:
+    """
+    Byte offsets of every stride-th audio frame of an MP3, enough to start
+    decoding a few frames before any sample. Sample positions follow the
+    decoder's gapless output, the encoder delay is accounted for.
+
+    The file's Xing/Info frame is kept too. Put in front of a stream cut at
+    a frame boundary it gives the decoder the real length (otherwise guessed
+    from the first frame's bitrate) and has it trim the delay as it does for
+    the whole file.
+    """
+
+    def __init__(self, offsets: np.ndarray, stride: int, samples_per_frame: int, sample_rate: int, delay: int,
+                 header: bytes = b''):
+        """
+        :param offsets: byte offset of audio frames 0, stride, 2 * stride...
+        :param stride:
+        :param samples_per_frame: 1152 or 576
+        :param sample_rate:
+        :param delay: samples the decoder drops from the start
+        :param header: the Xing/Info frame, empty if the file has none
+        """
+        self.offsets = offsets
+        self.stride = stride
+        self.samples_per_frame = samples_per_frame
+        self.sample_rate = sample_rate
+        self.delay = delay
+        self.header = header
+
+    def locate(self, frame: int, preroll: int = 2):
+        """
+        Where to start decoding to reach a sample
+        :param frame: sample frame in the decoded output
+        :param preroll: audio frames decoded and dropped before it, they fill the bit reservoir
+        :return: (byte offset, sample frames to drop after decoding from it)
+        """
+        audio_frame = max(frame // self.samples_per_frame - preroll, 0)
+        entry = min(audio_frame // self.stride, len(self.offsets) - 1)
+        skip = frame - entry * self.stride * self.samples_per_frame
+        if not self.header:
+            # nothing tells the decoder to trim the delay
+            skip += self.delay
+        return int(self.offsets[entry]), skip
+
+    def stream_header(self, offset: int, file_size: int) -> bytes:
+        """
+        The Xing/Info frame for a stream cut at offset, with the byte count
+        of what follows so the decoder does not warn about a size mismatch
+        :param offset:
+        :param file_size:
+        :return:
+        """
+        tag = _info_tag(self.header) if self.header else None
+        if tag is None or not tag[1] & 2:
+            return self.header
+        field = tag[0] + 8 + 4 * bool(tag[1] & 1)
+        size = struct.pack('>I', len(self.header) + file_size - offset)
+        return self.header[:field] + size + self.header[field + 4:]
+
+    def to_bytes(self) -> bytes:
+        """
+        :return: compact form stored in the repository
+        """
+        wide = len(self.offsets) and int(self.offsets[-1]) > 0xFFFFFFFF
+        header = _HEADER.pack(_MAGIC, _VERSION, self.stride, self.samples_per_frame, self.sample_rate,
+                              self.delay, len(self.offsets), 8 if wide else 4, len(self.header))
+        return header + self.header + self.offsets.astype('<u8' if wide else '<u4').tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """
+        :param data: from to_bytes
+        :return:
+        """
+        magic, version, stride, samples, sample_rate, delay, count, width, header_size = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("Not an MP3 frame index")
+        header = bytes(data[_HEADER.size:_HEADER.size + header_size])
+        offsets = np.frombuffer(data, dtype='<u8' if width == 8 else '<u4', count=count,
+                                offset=_HEADER.size + header_size)
+        return cls(offsets.astype(np.int64), stride, samples, sample_rate, delay, header)
+
+
+def build_frame_index(path: str, stride: int = 16) -> FrameIndex | None:
+    """
+    Scan every frame header of an MP3. The Xing/VBRI table of contents only
+    has 100 points, too coarse for exact seeks on long files
+    :param path:
+    :param stride: keep one offset every stride frames
+    :return: None if the file has no layer III frames
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    pos = 0
+    if data[:3] == b'ID3':
+        pos = 10 + ((data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | data[9] & 0x7F)
+
+    offsets = []
+    delay = None
+    samples = sample_rate = None
+    info_frame = b''
+    end = len(data) - 4
+    while pos < end:
+        frame = _frame_header(data, pos)
+        if frame is None:
+            # resync, skipping tags or junk between frames
+            pos = data.find(b'\xff', pos + 1)
+            if pos < 0:
+                break
+            continue
+        length, samples_, rate_ = frame
+        if delay is None:
+            samples, sample_rate = samples_, rate_
+            encoder_delay = _encoder_delay(data[pos:pos + length])
+            delay = 0
+            if encoder_delay is not None:
+                # the Xing/Info frame is not audio, the decoder skips it
+                info_frame = data[pos:pos + length]
+                if encoder_delay:
+                    delay = encoder_delay + DECODER_DELAY
+                pos += length
+                continue
+        offsets.append(pos)
+        pos += length
+
+    if not offsets:
+        return None
+    return FrameIndex(np.array(offsets[::stride], dtype=np.int64), stride, samples, sample_rate, delay, info_frame)
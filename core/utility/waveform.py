@@ -0,0 +1,138 @@
+import struct
+
+import numpy as np
+
+# buckets per level, each level groups FACTOR buckets of the one before
+LEVELS = (2048, 256, 32)
+FACTOR = 8
+
+_HEADER = struct.Struct('<4sBB')
+_COUNT = struct.Struct('<I')
+_MAGIC = b'WAVP'
+_VERSION = 1
+
+
+class WaveformPeaks:
+    """
+    Min, max and RMS of a track's mono mix over a fixed number of buckets,
+    at a few resolutions. Values are int8, full scale is 127, so a 2048
+    bucket level is 6 KB.
+    """
+
+    def __init__(self, levels: list):
+        """
+        :param levels: (buckets, 3) int8 arrays of min, max and RMS, finest first
+        """
+        self.levels = levels
+
+    def level_for(self, width: int) -> np.ndarray:
+        """
+        The coarsest level with at least width buckets, the finest one if none has
+        :param width: buckets wanted, e.g. pixels
+        :return: (buckets, 3) float32 array of min, max and RMS in -1..1
+        """
+        level = self.levels[0]
+        for candidate in self.levels:
+            if len(candidate) >= width:
+                level = candidate
+        return level.astype(np.float32) / 127
+
+    def to_bytes(self) -> bytes:
+        """
+        :return: compact form stored in the repository
+        """
+        header = _HEADER.pack(_MAGIC, _VERSION, len(self.levels))
+        counts = b''.join(_COUNT.pack(len(level)) for level in self.levels)
+        return header + counts + b''.join(level.astype(np.int8).tobytes() for level in self.levels)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """
+        :param data: from to_bytes
+        :return:
+        """
+        magic, version, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("Not a waveform summary")
+        offset = _HEADER.size
+        sizes = []
+        for _ in range(count):
+            sizes.append(_COUNT.unpack_from(data, offset)[0])
+            offset += _COUNT.size
+        levels = []
+        for size in sizes:
+            levels.append(np.frombuffer(data, dtype=np.int8, count=size * 3, offset=offset).reshape(size, 3))
+            offset += size * 3
+        return cls(levels)
+
+
+class WaveformBuilder:
+    """
+    Builds WaveformPeaks from decoded blocks of any size. Frames short of a
+    whole bucket are carried to the next block, every full bucket is reduced
+    with one reshape, the coarser levels come from the finest one.
+    """
+
+    def __init__(self, frames: int, buckets: int = LEVELS[0], levels: int = len(LEVELS)):
+        """
+        :param frames: length of the track, a bucket is frames / buckets long
+        :param buckets: of the finest level
+        :param levels:
+        """
+        self.size = max(-(-frames // buckets), 1)
+        self.levels = levels
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._mins, self._maxs, self._squares, self._counts = [], [], [], []
+
+    def _reduce(self, mono: np.ndarray):
+        whole = mono.reshape(-1, len(mono) if len(mono) < self.size else self.size)
+        self._mins.append(whole.min(axis=1))
+        self._maxs.append(whole.max(axis=1))
+        self._squares.append(np.einsum('ij,ij->i', whole, whole))
+        self._counts.append(np.full(len(whole), whole.shape[1]))
+
+    def process(self, data: np.ndarray):
+        """
+        :param data: (frames, channels)
+        :return:
+        """
+        data = np.asarray(data, dtype=np.float32)
+        if data.ndim == 1:
+            mono = data
+        else:
+            # a column at a time, reducing along the short axis is several times slower
+            mono = data[:, 0].copy()
+            for channel in range(1, data.shape[1]):
+                np.add(mono, data[:, channel], out=mono)
+            np.multiply(mono, 1.0 / data.shape[1], out=mono)
+        if len(self._pending):
+            mono = np.concatenate((self._pending, mono))
+        count = len(mono) // self.size
+        if count:
+            self._reduce(mono[:count * self.size])
+        self._pending = mono[count * self.size:]
+
+    def result(self) -> WaveformPeaks | None:
+        """
+        :return: None if nothing was processed
+        """
+        if len(self._pending):
+            self._reduce(self._pending)
+            self._pending = np.zeros(0, dtype=np.float32)
+        if not self._mins:
+            return None
+
+        mins, maxs = np.concatenate(self._mins), np.concatenate(self._maxs)
+        squares = np.concatenate(self._squares).astype(np.float64)
+        counts = np.concatenate(self._counts)
+        levels = []
+        for level in range(self.levels):
+            if level:
+                # the last group may be short
+                starts = np.arange(0, len(mins), FACTOR)
+                mins, maxs = np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts)
+                squares, counts = np.add.reduceat(squares, starts), np.add.reduceat(counts, starts)
+            rms = np.sqrt(squares / counts)
+            values = np.stack((mins, maxs, rms), axis=1)
+            levels.append(np.clip(np.round(values * 127), -127, 127).astype(np.int8))
+        return WaveformPeaks(levels)
@@ -21,6 +21,7 @@ class LibraryManager:
 
         self.bus.subscribe(PlaybackEngineEvent.PLAYBACK_COMPLETED, self._on_track_finished)
         self.bus.subscribe(MediaScannerEvent.SCANNER_FINISHED, self._on_scan_finished)
+        self.bus.subscribe(MediaScannerEvent.SCANNER_ANALYZED, self._on_scan_analyzed)
 
     @property
     def library_available(self):
@@ -53,6 +54,18 @@ class LibraryManager:
         self.bus.publish(LibraryEvent.LIBRARY_READY, True)
         self.bus.publish(LibraryEvent.LIBRARY_REFRESHED, tracks)
 
+    def _on_scan_analyzed(self, tracks: List[Track]):
+        """
+        Stores the loudness, seek indexes and waveforms of tracks already in the
+        library, values the analysis could not produce are kept as they were
+        :param tracks:
+        """
+        if not tracks:
+            return
+
+        logger.info(f"[Library Manager] Storing analysis of {len(tracks)} files")
+        self.repo.save_tracks(tracks)
+
     def _on_track_finished(self, track: Track):
         """
         Handles the '30-second rule' and increments stats.
@@ -15,6 +15,15 @@ class Track:
     genre: str
     year: str
     metadata: Dict[str, Any] = field(default_factory=dict)
+    # measured at scan time, LUFS and dBTP
+    loudness: float | None = None
+    true_peak: float | None = None
+    album_loudness: float | None = None
+    album_peak: float | None = None
+    # MP3 frame offsets for fast seeks, see core.utility.mp3_index
+    seek_index: bytes | None = None
+    # min/max/RMS peaks for the seek bar, see core.utility.waveform
+    waveform: bytes | None = None
 
     def to_dict(self):
         return {
@@ -30,6 +39,16 @@ class Track:
             "metadata": self.metadata
         }
 
+    def loudness_info(self) -> dict:
+        """
+        Values the audio engine normalizes playback with
+        :return: {'track': (LUFS, dBTP), 'album': (LUFS, dBTP)}
+        """
+        return {
+            'track': (self.loudness, self.true_peak),
+            'album': (self.album_loudness, self.album_peak)
+        }
+
 
 @dataclass
 class TrackItem:
@@ -11,6 +11,8 @@ from core.constants.events import QueueEvent, PlaybackCommandEvent, PlaybackEngi
 
 
 class QueueManager:
+    prefetch_count = 3  # upcoming tracks announced for the audio engine to cache
+
     def __init__(self, event_bus: EventBus):
         self._bus = event_bus
 
@@ -206,6 +208,27 @@ class QueueManager:
 
         self._emit_current_track()
 
+    def upcoming(self, count: int) -> List[Track]:
+        """
+        Tracks that play after the current one, following shuffle and repeat
+        :param count:
+        :return:
+        """
+        if not self._active_container or self._current_index == -1:
+            return []
+        items = self._active_container.items
+        if self.repeat_mode == RepeatMode.ONE:
+            return [items[self._current_index].track]
+
+        order = self._shuffle_indices if self.is_shuffle else list(range(len(items)))
+        if self._current_index not in order:
+            return []
+        position = order.index(self._current_index)
+        following = order[position + 1:]
+        if self.repeat_mode == RepeatMode.ALL:
+            following += order[:position]
+        return [items[i].track for i in following[:count]]
+
     # Toggles
     def toggle_shuffle(self):
         """
@@ -249,4 +272,5 @@ class QueueManager:
             item.is_current = (i == self._current_index)
         self._bus.publish(PlaybackCommandEvent.PLAYBACK_REQUEST,
                           self._active_container.items[self._current_index].track)
+        self._bus.publish(QueueEvent.QUEUE_UPCOMING, self.upcoming(self.prefetch_count))
         print("[Queue] Emitted")
\ No newline at end of file
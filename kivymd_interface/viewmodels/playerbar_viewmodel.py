@@ -1,6 +1,8 @@
 from adapters.audio_engine_service import AudioServiceState
 from core.constants.events import PlaybackCommandEvent, PlaybackEngineEvent, ThumbnailEvent
+from core import logger
 from core.event import DefaultEvent
+from core.utility.waveform import WaveformPeaks
 from core.utility.utils import load_default_image
 from kivymd_interface.helpers import load_kivy_image_from_data
 
@@ -10,6 +12,7 @@ class PlayerBarViewModel:
     progress = DefaultEvent()  # dict: elapsed, total
     thumbnail = DefaultEvent()  # Kivy.core.Image
     track = DefaultEvent()  # domain.song.track
+    waveform = DefaultEvent()  # core.utility.waveform.WaveformPeaks | None
 
     def __init__(self, context):
         self._context = context
@@ -35,6 +38,13 @@ class PlayerBarViewModel:
             case "next":
                 self._context.get('queue').previous()
 
+    def seek(self, seconds: float):
+        """
+        :param seconds:
+        :return:
+        """
+        self._context.get('bus').publish(PlaybackCommandEvent.PLAYBACK_SEEK, seconds)
+
     def play(self):
         """
         Play pause
@@ -59,6 +69,25 @@ class PlayerBarViewModel:
         #self._context.get('thumbnail_service').request_thumbnail(track.id)
         self.thumbnail.emit(track.thumbnail)
         self.track.emit(track)
+        self.waveform.emit(self._load_waveform(track))
+
+    def _load_waveform(self, track) -> WaveformPeaks | None:
+        """
+        Peaks stored by the scanner, nothing is decoded here
+        :param track:
+        :return: None for tracks scanned without them
+        """
+        data = track.waveform
+        repo = self._context.get('repo')
+        if data is None and repo:
+            data = repo.get_waveform(track.id)
+        if not data:
+            return None
+        try:
+            return WaveformPeaks.from_bytes(data)
+        except ValueError as e:
+            logger.warning(f"[PlayerBar] {e}")
+            return None
 
     def on_progress(self, payload: dict):
         """
@@ -1,5 +1,10 @@
+import numpy as np
 from kivy.clock import mainthread
 from kivy.metrics import dp
+from kivy.factory import Factory
+from kivy.graphics import Color, Mesh
+from kivy.properties import BooleanProperty, ColorProperty, NumericProperty, ObjectProperty
+from kivy.uix.widget import Widget
 from kivymd.uix.card import MDCard
 from kivymd.uix.boxlayout import MDBoxLayout
 
@@ -11,6 +16,104 @@ BAR_DEFINATION = {
 }  #style : height
 
 
+class WaveformSeekBar(Widget):
+    """
+    Seek bar drawn from the scanner's waveform peaks, one vertical line per
+    column from the min to the max of the samples it covers. A flat line is
+    drawn when the track has no peaks.
+    """
+    max = NumericProperty(1.0)
+    value = NumericProperty(0.0)
+    peaks = ObjectProperty(None, allownone=True)  # core.utility.waveform.WaveformPeaks
+    color = ColorProperty([.5, .5, .5, 1])
+    played_color = ColorProperty([1, 1, 1, 1])
+    column_width = NumericProperty(dp(2))
+    dragging = BooleanProperty(False)  # held by a touch, playback progress is not shown meanwhile
+
+    def __init__(self, **kwargs):
+        self.register_event_type('on_seek')
+        super().__init__(**kwargs)
+        self._columns = 0
+        with self.canvas:
+            self._played_instruction = Color(rgba=self.played_color)
+            self._played = Mesh(mode='lines')
+            self._rest_instruction = Color(rgba=self.color)
+            self._rest = Mesh(mode='lines')
+        self.bind(pos=self._redraw, size=self._redraw, peaks=self._redraw, column_width=self._redraw,
+                  value=self._update_progress, max=self._update_progress)
+        self.bind(played_color=lambda _, color: setattr(self._played_instruction, 'rgba', color),
+                  color=lambda _, color: setattr(self._rest_instruction, 'rgba', color))
+
+    def _column_levels(self, columns: int) -> np.ndarray:
+        """
+        :param columns:
+        :return: (columns, 2) min and max in -1..1
+        """
+        if self.peaks is None:
+            return np.zeros((columns, 2), dtype=np.float32)
+        level = self.peaks.level_for(columns)
+        if len(level) < columns:
+            # fewer buckets than columns, stretch them
+            return level[np.arange(columns) * len(level) // columns, :2]
+        starts = np.arange(columns) * len(level) // columns
+        return np.stack((np.minimum.reduceat(level[:, 0], starts), np.maximum.reduceat(level[:, 1], starts)), axis=1)
+
+    def _redraw(self, *args):
+        columns = max(int(self.width // self.column_width), 1)
+        self._columns = columns
+        levels = self._column_levels(columns)
+        half = self.height / 2
+        xs = self.x + (np.arange(columns) + 0.5) * self.width / columns
+        centre = self.y + half
+        # a line from min to max per column, at least a pixel tall
+        low = centre + np.minimum(levels[:, 0] * half, -0.5)
+        high = centre + np.maximum(levels[:, 1] * half, 0.5)
+        vertices = np.zeros((columns, 2, 4), dtype=np.float32)
+        vertices[:, :, 0] = xs[:, None]
+        vertices[:, 0, 1], vertices[:, 1, 1] = low, high
+        vertices = vertices.ravel().tolist()
+        self._played.vertices = vertices
+        self._rest.vertices = vertices
+        self._update_progress()
+
+    def _update_progress(self, *args):
+        played = int(self._columns * min(max(self.value / self.max, 0.0), 1.0)) if self.max else 0
+        self._played.indices = list(range(played * 2))
+        self._rest.indices = list(range(played * 2, self._columns * 2))
+
+    def _touch_value(self, touch) -> float:
+        return min(max((touch.x - self.x) / self.width, 0.0), 1.0) * self.max if self.width else 0.0
+
+    def on_touch_down(self, touch):
+        if not self.collide_point(*touch.pos):
+            return super().on_touch_down(touch)
+        touch.grab(self)
+        self.dragging = True
+        self.value = self._touch_value(touch)
+        return True
+
+    def on_touch_move(self, touch):
+        if touch.grab_current is not self:
+            return super().on_touch_move(touch)
+        self.value = self._touch_value(touch)
+        return True
+
+    def on_touch_up(self, touch):
+        if touch.grab_current is not self:
+            return super().on_touch_up(touch)
+        touch.ungrab(self)
+        self.dragging = False
+        self.value = self._touch_value(touch)
+        self.dispatch('on_seek', self.value)
+        return True
+
+    def on_seek(self, seconds):
+        """
+        :param seconds: where the bar was released
+        :return:
+        """
+
+
 class BasePlayerBar(MDCard):
     radius = [dp(5)] * 4
     focus_behavior = False
@@ -33,6 +136,14 @@ class BasePlayerBar(MDCard):
             case 'play':
                 self._view_model.play()
 
+    def on_seek(self, seek_bar, seconds):
+        """
+        :param seek_bar:
+        :param seconds:
+        :return:
+        """
+        self._view_model.seek(seconds)
+
     def volume_press(self, icon_button):
         """
         When the volume icon is pressed
@@ -78,6 +189,7 @@ class DefaultPlayerBar(BasePlayerBar):
         self._view_model.progress.connect(self.on_playback_progress)
         self._view_model.thumbnail.connect(self.on_thumbnail)
         self._view_model.track.connect(self.on_track)
+        self._view_model.waveform.connect(self.on_waveform)
 
     @mainthread
     def on_playback_progress(self, progress: float | int):
@@ -85,7 +197,18 @@ class DefaultPlayerBar(BasePlayerBar):
         :param progress:
         :return:
         """
-        self.ids.progress.value = progress
+        progress_bar = self.ids.progress
+        # the bar follows the touch until it is released
+        if not progress_bar.dragging:
+            progress_bar.value = progress
+
+    @mainthread
+    def on_waveform(self, peaks):
+        """
+        :param peaks: WaveformPeaks or None
+        :return:
+        """
+        self.ids.progress.peaks = peaks
 
     @mainthread
     def on_thumbnail(self, thumbnail):
@@ -117,3 +240,6 @@ class DefaultPlayerBar(BasePlayerBar):
         :return:
         """
         self.ids.progress.max = duration
+
+
+Factory.register("WaveformSeekBar", cls=WaveformSeekBar)
@@ -4,16 +4,19 @@ import  os
 #os.environ['KIVY_NO_CONSOLELOG'] = "1"
 os.environ['WORKING_DIR'] = os.getcwd()
 
-from bootstrap import bootstrap
-from kivymd_interface.app import ReloMusicPlayerApp
-from kivymd_interface.views.mainview import MainView
+# the engine process and the scanner's workers are spawned, they import this
+# module again as __mp_main__. Only the lines above run there: the app and
+# Kivy are imported below so they never open a window in those processes
+if __name__ == "__main__":
+    from bootstrap import bootstrap
+    from kivymd_interface.app import ReloMusicPlayerApp
+    from kivymd_interface.views.mainview import MainView
 
-
-# presentation with kivymd
-context = bootstrap()
-main_window = MainView   # due to material design specs the window will be inited in build
-app = ReloMusicPlayerApp(context=context, main_window=main_window)
-context.get("scheduler").start_loop()
-app.run()
-# on exit
-context['scheduler'].stop()
+    # presentation with kivymd
+    context = bootstrap()
+    main_window = MainView   # due to material design specs the window will be inited in build
+    app = ReloMusicPlayerApp(context=context, main_window=main_window)
+    context.get("scheduler").start_loop()
+    app.run()
+    # on exit
+    context['scheduler'].stop()